@@ -0,0 +1,95 @@
+// Browser side of server.LayoutGrid. The static layout arrives once per model and is drawn into an
+// offscreen canvas; each frame copies it and draws the robots and packages kept here, which the
+// server only updates with what changed since the previous frame.
+const LayoutGrid = function (canvasWidth, canvasHeight) {
+  const parent = document.createElement("div");
+  parent.style.height = `${canvasHeight}px`;
+  const canvas = document.createElement("canvas");
+  canvas.width = canvasWidth;
+  canvas.height = canvasHeight;
+  parent.appendChild(canvas);
+  document.getElementById("elements").appendChild(parent);
+  const context = canvas.getContext("2d");
+
+  const floor = document.createElement("canvas");
+  floor.width = canvasWidth;
+  floor.height = canvasHeight;
+  const floorContext = floor.getContext("2d");
+
+  let layout = null;
+  let cellWidth = 0;
+  let cellHeight = 0;
+  let robots = new Map(); // id -> [id, x, y, charge, color]
+  let packages = new Map(); // id -> [id, x, y]
+
+  // Row on the canvas of grid row y: like mesa's CanvasGrid, y = 0 is the bottom row
+  const row = (y) => layout.height - 1 - y;
+
+  const drawLayout = () => {
+    cellWidth = canvasWidth / layout.width;
+    cellHeight = canvasHeight / layout.height;
+    floorContext.clearRect(0, 0, canvasWidth, canvasHeight);
+    for (const [x, y, color] of layout.cells) {
+      floorContext.fillStyle = color;
+      floorContext.fillRect((x + 0.05) * cellWidth, (row(y) + 0.05) * cellHeight, 0.9 * cellWidth, 0.9 * cellHeight);
+    }
+    floorContext.strokeStyle = "#eee";
+    floorContext.beginPath();
+    for (let x = 0; x <= layout.width; x++) {
+      floorContext.moveTo(x * cellWidth, 0);
+      floorContext.lineTo(x * cellWidth, canvasHeight);
+    }
+    for (let y = 0; y <= layout.height; y++) {
+      floorContext.moveTo(0, y * cellHeight);
+      floorContext.lineTo(canvasWidth, y * cellHeight);
+    }
+    floorContext.stroke();
+  };
+
+  const draw = () => {
+    context.clearRect(0, 0, canvasWidth, canvasHeight);
+    if (layout === null) return;
+    context.drawImage(floor, 0, 0);
+    context.fillStyle = layout.package_color;
+    for (const [, x, y] of packages.values()) {
+      context.fillRect((x + 0.05) * cellWidth, (row(y) + 0.05) * cellHeight, 0.9 * cellWidth, 0.9 * cellHeight);
+    }
+    const radius = 0.45 * Math.min(cellWidth, cellHeight);
+    context.font = `${Math.max(Math.floor(radius), 6)}px sans-serif`;
+    context.textAlign = "center";
+    context.textBaseline = "middle";
+    for (const [, x, y, charge, color] of robots.values()) {
+      const cx = (x + 0.5) * cellWidth;
+      const cy = (row(y) + 0.5) * cellHeight;
+      context.beginPath();
+      context.arc(cx, cy, radius, 0, 2 * Math.PI);
+      context.fillStyle = color;
+      context.fill();
+      context.fillStyle = "black";
+      context.fillText(charge, cx, cy);
+    }
+  };
+
+  this.render = (data) => {
+    if (data.layout) {
+      layout = data.layout;
+      robots = new Map();
+      packages = new Map();
+      drawLayout();
+    }
+    for (const id of data.removed) {
+      robots.delete(id);
+      packages.delete(id);
+    }
+    for (const robot of data.robots) robots.set(robot[0], robot);
+    for (const item of data.packages) packages.set(item[0], item);
+    draw();
+  };
+
+  this.reset = () => {
+    layout = null;
+    robots = new Map();
+    packages = new Map();
+    draw();
+  };
+};
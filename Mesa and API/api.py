@@ -1,44 +1,394 @@
-from flask import Flask, jsonify, request
-from model import Warehouse, Ant, Shelves, Conveyors, Packages
+import argparse
+import json
+import os
+import time
+
+from flask import Flask, Response, abort, jsonify, make_response, request
+from mesa.agent import Agent
+
+import binary_state
+from model import Warehouse, Ant, Shelves, Conveyors, Packages, Mission
+from recording import ReplayBroadcaster, ReplayCursor, TrajectoryLog
+from sessions import ReplaySession, SessionRegistry
+from streaming import TickBroadcaster
 
 app = Flask(__name__)
-model = None  # Global variable to hold the model
+# One independent Warehouse per session; every request names its session (the id /api/init returns)
+# in an X-Session-Id header, a `session` query parameter or a `session` body field
+sessions = SessionRegistry()
+# Set when serving a recorded trajectory log instead of models (python api.py --replay FILE): every
+# request then goes to this one session, and the endpoints that need a model answer 409
+replay = None
+
+RECORDINGS_DIR = "recordings"  # trajectory logs requested through /api/init {"record": name}
+
+DEFAULT_TICK_RATE = 10.0
+MODEL_PARAMS = {"M": int, "N": int, "num_agentes": int, "porc_shelves": float,
+                "modo_pos_inicial": str, "modo_ruteo": str, "modo_carga": str, "tasa_llegada": float, "seed": int}
+
+MAX_STEPS_PER_REQUEST = 10000
+ROBOT_FIELDS = ["id", "x", "y", "state"]
+PACKAGE_FIELDS = ["id", "x", "y", "state"]
+STATE_TYPES = (Ant, Shelves, Conveyors, Packages)
+STATIC_FIELDS = {"model", "charging_stations", "neighbour_list"}  # left out of delta updates
+
+
+def tick_frame(model):
+    # Compact per-tick positions: one row per robot/package, columns given by *_FIELDS
+    robots = [[ant.unique_id, *ant.pos, ant.state] for ant in model.agents_of(Ant)]
+    packages = [[package.unique_id, *package.pos, package.state] for package in model.agents_of(Packages)]
+    return {"tick": model.schedule.steps, "robots": robots, "packages": packages}
+
+
+def agent_data(agent, include_static=True):
+    data = {"id": agent.unique_id, "position": agent.pos, "type": type(agent).__name__}
+    for attr, value in vars(agent).items():
+        if attr in ("unique_id", "pos") or (not include_static and attr in STATIC_FIELDS):
+            continue
+        if isinstance(value, Warehouse):
+            value = str(value)
+        elif isinstance(value, Agent):
+            value = value.unique_id  # e.g. the package an Ant is carrying
+        elif isinstance(value, Mission):
+            value = {"kind": value.kind, "package": value.package.unique_id,
+                     "pickup": value.pickup_pos, "destination": value.destination_pos}
+        data[attr] = value
+    return data
+
+
+def describe_agent(agent):
+    return agent_data(agent) if isinstance(agent, STATE_TYPES) else None
+
+
+def snapshot_state(model):
+    agents_state = [agent_data(agent) for agent in model.schedule.agents if isinstance(agent, STATE_TYPES)]
+    return {"tick": model.schedule.steps, "full": True, "agents": agents_state, "removed": []}
+
+
+def delta_state(model, since):
+    # Only the agents changed after `since`; a full snapshot when `since` is older than the kept history
+    changes = model.changes_since(since)
+    if changes is None:
+        return snapshot_state(model)
+    changed, removed = changes
+    agents_state = [agent_data(agent, include_static=False) for agent in changed if isinstance(agent, STATE_TYPES)]
+    return {"tick": model.schedule.steps, "full": False, "agents": agents_state, "removed": removed}
+
+
+def json_params():
+    # The request's JSON body, {} without one; 400 when it is not an object
+    params = request.get_json(silent=True)
+    if params is None:
+        return {}
+    if not isinstance(params, dict):
+        abort(make_response(jsonify({"error": "request body must be a JSON object"}), 400))
+    return params
+
+
+def session_id_from_request():
+    params = json_params()
+    session_id = request.headers.get("X-Session-Id") or request.args.get("session") or params.get("session")
+    return str(session_id) if session_id is not None else None
+
+
+def current_session():
+    if replay is not None:
+        return replay, None
+    session_id = session_id_from_request()
+    if session_id is None:
+        return None, (jsonify({"error": "No session id; send the one /api/init returned"}), 400)
+    session = sessions.get(session_id)
+    if session is None:
+        return None, (jsonify({"error": "Unknown session"}), 404)
+    return session, None
+
+
+def live_session():
+    # current_session() for the endpoints that need a model
+    if replay is not None:
+        return None, (jsonify({"error": "Replaying a recording"}), 409)
+    return current_session()
+
 
 @app.route('/api/init', methods=['POST'])
 def init_model():
-    global model
-    model = Warehouse(M = 47, N = 20)  # Initialize Mesa model
-    return jsonify({"status": "Model initialized"}), 200
+    if replay is not None:
+        return jsonify({"error": "Replaying a recording"}), 409
+    params = json_params()
+    try:
+        kwargs = {name: cast(params[name]) for name, cast in MODEL_PARAMS.items() if name in params}
+    except (TypeError, ValueError):
+        return jsonify({"error": "invalid model parameters"}), 400
+    kwargs.setdefault("M", 47)
+    kwargs.setdefault("N", 20)
+    if params.get("record"):
+        # Every tick of the session goes to a trajectory log under RECORDINGS_DIR (see recording.py)
+        os.makedirs(RECORDINGS_DIR, exist_ok=True)
+        kwargs["recording"] = os.path.join(RECORDINGS_DIR, os.path.basename(str(params["record"])))
+    try:
+        model = Warehouse(**kwargs)  # Initialize Mesa model
+    except (TypeError, ValueError) as error:
+        return jsonify({"error": str(error)}), 400
+    session = sessions.create(model)
+    return jsonify({"status": "Model initialized", "session": session.id,
+                    "recording": kwargs.get("recording")}), 200, {"X-Session-Id": session.id}
+
+@app.route('/api/session', methods=['DELETE'])
+def close_session():
+    session_id = session_id_from_request()
+    if session_id is None or not sessions.remove(session_id):
+        return jsonify({"error": "Unknown session"}), 404
+    return jsonify({"status": "Session closed"}), 200
 
 @app.route('/api/state', methods=['GET'])
 def get_state():
-    global model
-    if model is None:
-        return jsonify({"error": "Model not initialized"}), 400
-    
-    agents_state = []
-
-    for agent in model.schedule.agents:
-        if isinstance(agent, (Ant, Shelves, Conveyors, Warehouse, Packages)):
-            agent_data = {"id": agent.unique_id, "position": agent.pos, "type": type(agent).__name__}
-            for attr, value in agent.__dict__.items():
-                if attr not in ["unique_id", "pos"]:
-                    if isinstance(value, Warehouse):
-                        agent_data[attr] = str(value)
-                    else:
-                        agent_data[attr] = value
-            agents_state.append(agent_data)
-
-    return jsonify(agents_state), 200
+    session, error = current_session()
+    if error:
+        return error
+
+    since = request.args.get("since")
+    try:
+        since = int(since) if since is not None else None
+    except ValueError:
+        return jsonify({"error": "since must be an integer tick"}), 400
+
+    binary = request.accept_mimetypes.best_match(["application/json", "application/octet-stream"]) == "application/octet-stream"
+    if session is replay:
+        return replay_state(session, binary)
+    # While the background loop runs, full states come from its last published snapshot without the model lock
+    latest = session.broadcaster.latest if session.streaming else None
+    if latest is not None and (since is None or binary):
+        headers = {"X-Model-Tick": str(latest.tick), "X-Session-Id": session.id}
+        if binary:
+            return Response(latest.binary, mimetype="application/octet-stream", headers=headers)
+        return Response(latest.json(), mimetype="application/json", headers=headers)
+
+    with session.lock:
+        model = session.model
+        headers = {"X-Model-Tick": str(model.schedule.steps), "X-Session-Id": session.id}
+        # Robots and packages as fixed-layout binary records (see binary_state) when the client asks for it
+        if binary:
+            return Response(binary_state.encode_state(model), mimetype="application/octet-stream", headers=headers)
+        if since is None:
+            return jsonify(snapshot_state(model)["agents"]), 200, headers
+        return jsonify(delta_state(model, since)), 200, headers
+
+def replay_state(session, binary):
+    # The replay position, or any recorded tick with ?tick=N (clamped to the log); `since` is ignored
+    # and every answer is a full state
+    try:
+        tick = int(request.args["tick"]) if "tick" in request.args else None
+    except ValueError:
+        return jsonify({"error": "tick must be an integer"}), 400
+    if tick is None:
+        latest = session.broadcaster.latest
+        tick, body = latest.tick, latest.binary if binary else latest.json()
+    else:
+        with session.lock:
+            cursor = ReplayCursor(session.log)
+            tick = cursor.seek(tick)
+            body = cursor.binary() if binary else json.dumps(cursor.agents())
+    headers = {"X-Model-Tick": str(tick), "X-Session-Id": session.id}
+    return Response(body, mimetype="application/octet-stream" if binary else "application/json", headers=headers)
+
+@app.route('/api/state/schema', methods=['GET'])
+def get_state_schema():
+    return jsonify(binary_state.schema()), 200
 
 @app.route('/api/step', methods=['POST'])
 def step_model():
-    global model
-    if model is None:
-        return jsonify({"error": "Model not initialized"}), 400
+    session, error = live_session()
+    if error:
+        return error
+
+    params = json_params()
+    try:
+        steps = int(params.get("steps", request.args.get("steps", 1)))
+        budget_ms = params.get("budget_ms", request.args.get("budget_ms"))
+        budget_ms = float(budget_ms) if budget_ms is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "steps must be an integer and budget_ms a number"}), 400
+    if steps < 1:
+        return jsonify({"error": "steps must be at least 1"}), 400
+    steps = min(steps, MAX_STEPS_PER_REQUEST)
+
+    # Run up to `steps` ticks server-side, stopping early once the wall-clock budget is spent
+    deadline = time.perf_counter() + budget_ms / 1000 if budget_ms is not None else None
+    ticks = []
+    with session.lock:
+        model = session.model
+        for _ in range(steps):
+            model.step()  # Call the step method of your Mesa model
+            ticks.append(tick_frame(model))
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        if session.streaming:
+            session.broadcaster.publish()  # keep the published snapshot current, e.g. while paused
+    sessions.stepped(session)
+
+    return jsonify({"status": "Model stepped", "steps": len(ticks),
+                    "robot_fields": ROBOT_FIELDS, "package_fields": PACKAGE_FIELDS,
+                    "ticks": ticks}), 200
+
+@app.route('/api/ledger', methods=['GET'])
+def get_ledger():
+    # Cycle-time summary of the completed packages, plus the last `limit` of them with their phase ticks
+    session, error = live_session()
+    if error:
+        return error
+    try:
+        limit = int(request.args.get("limit", 100))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    with session.lock:
+        ledger = session.model.ledger
+        data = {"tick": session.model.schedule.steps, "completed": ledger.count, "in_progress": len(ledger.open),
+                "summary": ledger.summary(), "packages": ledger.rows(limit) if limit > 0 else []}
+    return jsonify(data), 200
+
+def encode_snapshot(snapshot):
+    return json.dumps({"tick": snapshot.tick, "full": True, "agents": snapshot.agents, "removed": []})
+
+def get_broadcaster(session):
+    if session.broadcaster is None:
+        session.broadcaster = TickBroadcaster(session.model, session.lock,
+                                              encode_delta=lambda model, since: json.dumps(delta_state(model, since)),
+                                              encode_snapshot=encode_snapshot,
+                                              tick_rate=DEFAULT_TICK_RATE, describe_agent=describe_agent,
+                                              encode_binary=binary_state.encode_state)
+    return session.broadcaster
+
+def open_replay(path):
+    session = ReplaySession("replay", TrajectoryLog(path))
+    session.broadcaster = ReplayBroadcaster(
+        session.log, session.lock,
+        encode_changes=lambda tick, agents, removed: json.dumps(
+            {"tick": tick, "full": False, "agents": agents, "removed": removed}),
+        encode_snapshot=encode_snapshot, tick_rate=DEFAULT_TICK_RATE)
+    return session
+
+def tick_rate_param(default):
+    # (tick_rate, error response)
+    params = json_params()
+    try:
+        tick_rate = float(params.get("tick_rate", request.args.get("tick_rate", default)))
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": "tick_rate must be a number"}), 400)
+    if tick_rate < 0:
+        return None, (jsonify({"error": "tick_rate must be positive, or 0 for as fast as possible"}), 400)
+    return tick_rate, None
+
+def loop_status(session):
+    broadcaster = session.broadcaster
+    running = session.streaming
+    latest = broadcaster.latest if broadcaster is not None else None
+    return {"running": running, "paused": running and broadcaster.paused,
+            "tick_rate": broadcaster.tick_rate if running else None,
+            "ticks_per_second": broadcaster.ticks_per_second if running else 0.0,
+            "published_tick": latest.tick if latest is not None else None}
+
+@app.route('/api/stream/start', methods=['POST'])
+def start_stream():
+    session, error = current_session()
+    if error:
+        return error
+    tick_rate, error = tick_rate_param(DEFAULT_TICK_RATE)
+    if error:
+        return error
+    get_broadcaster(session).start(tick_rate)
+    return jsonify({"status": "Streaming", "tick_rate": tick_rate}), 200
+
+@app.route('/api/stream/pause', methods=['POST'])
+def pause_stream():
+    session, error = current_session()
+    if error:
+        return error
+    if not session.streaming:
+        return jsonify({"error": "Simulation loop not running"}), 409
+    session.broadcaster.pause()
+    return jsonify({"status": "Paused", **loop_status(session)}), 200
+
+@app.route('/api/stream/resume', methods=['POST'])
+def resume_stream():
+    session, error = current_session()
+    if error:
+        return error
+    if not session.streaming:
+        return jsonify({"error": "Simulation loop not running"}), 409
+    session.broadcaster.resume()
+    return jsonify({"status": "Streaming", **loop_status(session)}), 200
+
+@app.route('/api/stream/rate', methods=['POST'])
+def set_stream_rate():
+    session, error = current_session()
+    if error:
+        return error
+    if not session.streaming:
+        return jsonify({"error": "Simulation loop not running"}), 409
+    tick_rate, error = tick_rate_param(None)  # required here
+    if error:
+        return error
+    session.broadcaster.set_rate(tick_rate)
+    return jsonify({"status": "Rate set", **loop_status(session)}), 200
+
+@app.route('/api/stream/seek', methods=['POST'])
+def seek_stream():
+    # Replay only: jump to any recorded tick; stream subscribers get a snapshot of it
+    if replay is None:
+        return jsonify({"error": "Only available when replaying a recording"}), 409
+    params = json_params()
+    try:
+        tick = int(params.get("tick", request.args.get("tick")))
+    except (TypeError, ValueError):
+        return jsonify({"error": "tick must be an integer"}), 400
+    replay.broadcaster.seek(tick)
+    return jsonify({"status": "Seeked", **loop_status(replay)}), 200
+
+@app.route('/api/replay', methods=['GET'])
+def replay_info():
+    if replay is None:
+        return jsonify({"error": "Not replaying a recording"}), 404
+    with replay.lock:
+        log = replay.log
+        log.refresh()
+        header = {key: value for key, value in log.header.items() if key != "floor"}
+        data = {"path": log.path, "first_tick": log.first_tick, "last_tick": log.last_tick,
+                "chunks": len(log.index), "header": header}
+    return jsonify({**data, **loop_status(replay)}), 200
+
+@app.route('/api/stream/status', methods=['GET'])
+def stream_status():
+    session, error = current_session()
+    if error:
+        return error
+    return jsonify(loop_status(session)), 200
+
+@app.route('/api/stream/stop', methods=['POST'])
+def stop_stream():
+    session, error = current_session()
+    if error:
+        return error
+    session.close()
+    return jsonify({"status": "Stream stopped"}), 200
 
-    model.step()  # Call the step method of your Mesa model
-    return jsonify({"status": "Model stepped"}), 200
+@app.route('/api/stream', methods=['GET'])
+def stream():
+    # Server-sent events: a snapshot, then one delta per tick while the model runs (see /api/stream/start)
+    session, error = current_session()
+    if error:
+        return error
+    broadcaster = get_broadcaster(session)
+    if not broadcaster.running:
+        broadcaster.start()
+    subscription = broadcaster.subscribe()
+    return Response(broadcaster.events(subscription), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 if __name__ == '__main__':
-    app.run(port=5000)
+    parser = argparse.ArgumentParser(description="Warehouse API")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--replay", help="serve this trajectory log (see recording.py) instead of live models")
+    args = parser.parse_args()
+    if args.replay:
+        replay = open_replay(args.replay)
+    app.run(port=args.port, threaded=True)
@@ -0,0 +1,50 @@
+import numpy as np
+
+
+def solve_assignment(cost):
+    # Minimum-cost matching between the rows and columns of a (possibly rectangular) cost matrix,
+    # Hungarian method with shortest augmenting paths, O(n^2 m). Returns (row, col) pairs; every row is
+    # matched when there are at least as many columns, otherwise every column is.
+    cost = np.asarray(cost, dtype=float)
+    if cost.size == 0:
+        return []
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=int)  # match[j]: row (1-based) assigned to column j, 0 if none
+    way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        match[0] = i
+        j0 = 0
+        min_reduced = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < min_reduced[1:])
+            min_reduced[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(free, min_reduced[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[match[used]] += delta
+            v[used] -= delta
+            min_reduced[1:][free] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+
+    pairs = [(int(match[j]) - 1, j - 1) for j in range(1, m + 1) if match[j]]
+    if transposed:
+        pairs = [(col, row) for row, col in pairs]
+    return sorted(pairs)
@@ -0,0 +1,122 @@
+import argparse
+import inspect
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from model import Warehouse
+
+# Parameter sweep: python batch_run.py --agentes 1 3 5 --seeds 3 --out sweep.parquet
+# Needs pandas for the results table, and pyarrow to write it as Parquet (the default); without pyarrow
+# the table is written as CSV next to it (sweep.csv) instead.
+PARAM_NAMES = ["num_agentes", "modo_pos_inicial", "modo_carga", "tasa_llegada", "seed"]
+# Warehouse defaults, for journal entries written before a parameter joined the sweep
+DEFAULTS = {name: parameter.default for name, parameter in inspect.signature(Warehouse).parameters.items()
+            if name in PARAM_NAMES}
+
+
+def run_key(params):
+    return json.dumps([params.get(name, DEFAULTS[name]) for name in PARAM_NAMES])
+
+
+def kpis(model, ticks, segundos_por_tick):
+    hours = ticks * segundos_por_tick / 3600
+    delivered = model.delivered_packages
+    return {
+        "delivered": delivered,
+        "delivered_per_hour": delivered / hours if hours else 0.0,
+        "mean_delivery_latency": model.total_delivery_latency / delivered if delivered else None,
+        "robot_utilization": model.busy_robot_ticks / (ticks * model.num_agentes) if model.num_agentes else 0.0,
+        "charging_share": model.charging_robot_ticks / (ticks * model.num_agentes) if model.num_agentes else 0.0,
+        "station_utilization": model.station_ticks / (ticks * len(model.charging_positions))
+        if model.charging_positions else 0.0,
+        "energy_used": model.energy_used,
+        "energy_per_delivered": model.energy_used / delivered if delivered else None,
+    }
+
+
+def run_one(params, ticks, segundos_por_tick, orders=None):
+    start = time.perf_counter()
+    model = Warehouse(num_agentes=params["num_agentes"], modo_pos_inicial=params["modo_pos_inicial"],
+                      modo_carga=params["modo_carga"], tasa_llegada=params["tasa_llegada"],
+                      seed=params["seed"], orders=orders)
+    for _ in range(ticks):
+        model.step()
+    return {**params, "ticks": ticks, **kpis(model, ticks, segundos_por_tick),
+            "wall_seconds": time.perf_counter() - start}
+
+
+def sweep(grid, ticks, out, segundos_por_tick=1.0, workers=None, orders=None):
+    # Every finished run is appended to <out>.jsonl right away, so an interrupted sweep resumes where it
+    # stopped; the results table is rebuilt from that journal at the end (see write_table).
+    journal = out + ".jsonl"
+    done = {}
+    if os.path.exists(journal):
+        with open(journal) as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    done[run_key(row)] = row
+
+    runs = [dict(zip(PARAM_NAMES, values)) for values in itertools.product(*(grid[name] for name in PARAM_NAMES))]
+    pending = [params for params in runs if run_key(params) not in done]
+    print(f"{len(runs)} runs, {len(runs) - len(pending)} already done, {len(pending)} to go")
+
+    with open(journal, "a") as f, ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(run_one, params, ticks, segundos_por_tick, orders) for params in pending]
+        for finished, future in enumerate(as_completed(futures), start=1):
+            row = future.result()
+            done[run_key(row)] = row
+            f.write(json.dumps(row) + "\n")
+            f.flush()
+            energy = row["energy_per_delivered"]
+            print(f"[{finished}/{len(pending)}] {run_key(row)} delivered/h={row['delivered_per_hour']:.1f}"
+                  f" utilization={row['robot_utilization']:.2f} charging={row['charging_share']:.2f}"
+                  f" energy/package={'-' if energy is None else f'{energy:.2f}'}")
+
+    rows = [done[run_key(params)] for params in runs]
+    write_table(rows, out)
+    return rows
+
+
+def write_table(rows, out):
+    # Parquet for .parquet paths when pyarrow is there, CSV otherwise; returns the path written
+    import pandas as pd
+
+    frame = pd.DataFrame(rows)
+    if out.endswith(".parquet"):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            out = out[:-len(".parquet")] + ".csv"
+            print(f"pyarrow is not installed, writing {out} instead")
+        else:
+            frame.to_parquet(out, index=False, engine="pyarrow")
+            return out
+    frame.to_csv(out, index=False)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parameter sweep over Warehouse runs")
+    parser.add_argument("--agentes", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--modo-pos", nargs="+", default=["Fija"], choices=["Fija", "Aleatoria"])
+    parser.add_argument("--modo-carga", nargs="+", default=["Cola"], choices=["Cola", "Aleatoria"])
+    parser.add_argument("--tasa-llegada", type=float, nargs="+", default=[0.14])
+    parser.add_argument("--seeds", type=int, default=3, help="seeds 0..n-1 per combination")
+    parser.add_argument("--ticks", type=int, default=2000)
+    parser.add_argument("--segundos-por-tick", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=None, help="defaults to all cores")
+    parser.add_argument("--out", default="sweep.parquet", help=".parquet (needs pyarrow, else CSV) or .csv")
+    parser.add_argument("--orders", help="order log replayed by every run instead of random arrivals and demand")
+    args = parser.parse_args()
+
+    grid = {"num_agentes": args.agentes, "modo_pos_inicial": args.modo_pos, "modo_carga": args.modo_carga,
+            "tasa_llegada": args.tasa_llegada, "seed": list(range(args.seeds))}
+    sweep(grid, args.ticks, args.out, args.segundos_por_tick, args.workers, args.orders)
+
+
+if __name__ == "__main__":
+    main()
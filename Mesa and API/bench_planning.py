@@ -0,0 +1,132 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from model import Ant, Warehouse
+from planning import STALL_TICKS
+
+EXIT_WAIT_LIMIT = 4 * STALL_TICKS  # most ticks a loaded robot may spend next to the exit before delivering
+
+
+def run(modo_ruteo, num_agentes, ticks, seed, tasa_llegada, window=250):
+    model = Warehouse(num_agentes=num_agentes, modo_ruteo=modo_ruteo, modo_pos_inicial='Aleatoria',
+                      tasa_llegada=tasa_llegada, seed=seed)
+    exit_pos = model.layout.exit
+    overlaps = 0
+    windows = []  # deliveries in each `window` ticks
+    near_exit = {}  # loaded robot id -> tick it got within 2 squares of the exit
+    exit_wait = 0
+    min_charge = 100
+    dead = {}  # robot id -> whether it was carrying a package when it ran out of charge off a station
+    start = time.process_time()
+    for tick in range(1, ticks + 1):
+        model.step()
+        overlaps += int(np.maximum(model.layers.robots - 1, 0).sum())  # robots sharing a cell this tick
+        for robot in model.agents_of(Ant):
+            min_charge = min(min_charge, robot.charge_percentage)
+            if not robot.charge_percentage and robot.pos not in model.charging_positions:
+                dead.setdefault(robot.unique_id, bool(robot.has_package))
+            if robot.has_package and max(abs(robot.pos[0] - exit_pos[0]), abs(robot.pos[1] - exit_pos[1])) <= 2 \
+                    and robot.haul_destination_pos == exit_pos:
+                exit_wait = max(exit_wait, tick - near_exit.setdefault(robot.unique_id, tick))
+            else:
+                near_exit.pop(robot.unique_id, None)
+        if tick % window == 0:
+            windows.append(model.delivered_packages - sum(windows))
+    cpu = time.process_time() - start
+    planner = model.planner
+    return {
+        "delivered": model.delivered_packages,
+        "windows": windows,
+        "min_charge": min_charge,  # lowest charge any robot got down to
+        "dead": len(dead),
+        "dead_loaded": sum(dead.values()),
+        "overlaps": overlaps,
+        "exit_wait": exit_wait,
+        "cpu_ms_per_step": 1000 * cpu / ticks,
+        "plan_ms_per_step": 1000 * planner.plan_seconds / ticks if planner else 0.0,
+        "searches_per_step": planner.searches / ticks if planner else 0.0,
+        "deferred": planner.deferred if planner else 0,
+    }
+
+
+def check_charging(agents, ticks, seeds, tasa_llegada, window=250):
+    # Long 'Reservas' runs with queued charging: every window must deliver something, or the fleet has
+    # locked up (robots queuing for a station used to block the conveyors until nothing moved), no two
+    # robots may ever share a cell, no loaded robot may starve next to the crowded exit conveyor, and no
+    # robot may run flat (a robot held up mid-mission has to stop and charge, package and all)
+    failed = False
+    for num_agentes in agents:
+        for seed in range(seeds):
+            result = run("Reservas", num_agentes, ticks, seed, tasa_llegada, window)
+            stalled = 0 in result["windows"]
+            starved = result["exit_wait"] > EXIT_WAIT_LIMIT
+            flat = result["min_charge"] <= 0 or result["dead"] > 0
+            failed |= stalled or starved or flat or result["overlaps"] > 0
+            print(f"Reservas {num_agentes:>4} robots seed {seed}: deliveries per {window} ticks {result['windows']}, "
+                  f"lowest charge {result['min_charge']:.2f}, out of charge {result['dead']} "
+                  f"({result['dead_loaded']} loaded), overlaps {result['overlaps']}, "
+                  f"longest wait at the exit {result['exit_wait']}{'  STALLED' if stalled else ''}"
+                  f"{'  STARVED' if starved else ''}"
+                  f"{'  OUT OF CHARGE' if flat else ''}")
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shortest-path vs reservation planning as the fleet grows")
+    parser.add_argument("--agents", type=int, nargs="+", default=[5, 20, 50, 100])
+    parser.add_argument("--ticks", type=int, default=1500, help="long enough for the fleet's first charging "
+                                                                "rounds, where gridlocks used to set in")
+    parser.add_argument("--window", type=int, default=250, help="runs fail if the last window delivers nothing")
+    parser.add_argument("--seeds", type=int, default=2)
+    parser.add_argument("--tasa-llegada", type=float, default=0.5)
+    parser.add_argument("--check-charging", action="store_true",
+                        help="only run long 'Reservas' runs (--check-ticks) with 20 and 40 robots and fail if "
+                             "deliveries stop increasing")
+    parser.add_argument("--check-ticks", type=int, default=1500)
+    args = parser.parse_args()
+
+    if args.check_charging:
+        sys.exit(0 if check_charging([20, 40], args.check_ticks, args.seeds, args.tasa_llegada) else 1)
+
+    stalled = []
+    overlapping = []  # 'Reservas' runs where two robots shared a cell
+    starved = []  # 'Reservas' runs where a loaded robot waited next to the exit for over EXIT_WAIT_LIMIT ticks
+    print(f"{'mode':<10}{'robots':>7}{'delivered':>10}{'last window':>12}{'ticks/delivery':>16}{'overlaps':>10}"
+          f"{'exit wait':>10}{'cpu ms/step':>13}{'plan ms/step':>14}{'searches/step':>15}{'deferred':>10}")
+    for num_agentes in args.agents:
+        for modo_ruteo in ("Corta", "Reservas"):
+            results = [run(modo_ruteo, num_agentes, args.ticks, seed, args.tasa_llegada, args.window)
+                       for seed in range(args.seeds)]
+            delivered = sum(r["delivered"] for r in results)
+            last_window = sum(r["windows"][-1] for r in results if r["windows"])
+            ticks_per_delivery = args.ticks * len(results) / delivered if delivered else float("inf")
+            overlaps = sum(r["overlaps"] for r in results)
+            exit_wait = max(r["exit_wait"] for r in results)
+            deferred = sum(r["deferred"] for r in results)
+            cpu, plan, searches = (sum(r[key] for r in results) / len(results)
+                                   for key in ("cpu_ms_per_step", "plan_ms_per_step", "searches_per_step"))
+            print(f"{modo_ruteo:<10}{num_agentes:>7}{delivered:>10}{last_window:>12}{ticks_per_delivery:>16.2f}"
+                  f"{overlaps:>10}{exit_wait:>10}{cpu:>13.3f}{plan:>14.3f}{searches:>15.1f}{deferred:>10}")
+            stalled += [(modo_ruteo, num_agentes, seed) for seed, r in enumerate(results)
+                        if r["windows"] and not r["windows"][-1]]
+            if modo_ruteo == "Reservas":
+                overlapping += [(num_agentes, seed, r["overlaps"]) for seed, r in enumerate(results) if r["overlaps"]]
+                starved += [(num_agentes, seed, r["exit_wait"]) for seed, r in enumerate(results)
+                            if r["exit_wait"] > EXIT_WAIT_LIMIT]
+    for modo_ruteo, num_agentes, seed in stalled:
+        print(f"STALLED: {modo_ruteo} with {num_agentes} robots (seed {seed}) delivered nothing in the last "
+              f"{args.window} ticks")
+    for num_agentes, seed, overlaps in overlapping:
+        print(f"OVERLAPS: Reservas with {num_agentes} robots (seed {seed}) put two robots on one cell {overlaps} times")
+    for num_agentes, seed, exit_wait in starved:
+        print(f"STARVED: Reservas with {num_agentes} robots (seed {seed}) kept a loaded robot next to the exit "
+              f"for {exit_wait} ticks")
+    if stalled or overlapping or starved:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
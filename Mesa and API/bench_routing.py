@@ -0,0 +1,38 @@
+import argparse
+import time
+
+from model import Warehouse
+
+
+def run(modo_ruteo, num_agentes, ticks, seed):
+    model = Warehouse(num_agentes=num_agentes, modo_ruteo=modo_ruteo, seed=seed)
+    start = time.process_time()
+    for _ in range(ticks):
+        model.step()
+    cpu = time.process_time() - start
+    delivered = model.delivered_packages
+    return {
+        "delivered": delivered,
+        "ticks_per_delivery": ticks / delivered if delivered else float("inf"),
+        "cpu_ms_per_step": 1000 * cpu / ticks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Greedy vs shortest-path routing")
+    parser.add_argument("--agents", type=int, default=5)
+    parser.add_argument("--ticks", type=int, default=1000)
+    parser.add_argument("--seeds", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'mode':<8}{'delivered':>10}{'ticks/delivery':>16}{'cpu ms/step':>13}")
+    for modo_ruteo in ("Voraz", "Corta"):
+        results = [run(modo_ruteo, args.agents, args.ticks, seed) for seed in range(args.seeds)]
+        delivered = sum(r["delivered"] for r in results)
+        ticks_per_delivery = args.ticks * len(results) / delivered if delivered else float("inf")
+        cpu = sum(r["cpu_ms_per_step"] for r in results) / len(results)
+        print(f"{modo_ruteo:<8}{delivered:>10}{ticks_per_delivery:>16.1f}{cpu:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import mesa
+import numpy as np
+
+from layouts import generate_layout
+from model import Warehouse
+
+# Reproducible performance numbers for the model and the Flask API, written as JSON so two commits can be
+# compared:
+#     python bench_suite.py --out before.json
+#     python bench_suite.py --out after.json --compare before.json
+# Every case is seeded; timings are medians over --repeats runs. Each MxN grid gets a generated layout that
+# fills it (layouts.generate_layout; 47x20 is the built-in warehouse).
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentiles(samples_ms):
+    ordered = sorted(samples_ms)
+    return {
+        "mean": statistics.fmean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+    }
+
+
+def bench_model(M, N, num_agentes, tasa_llegada, ticks, seed):
+    start = time.perf_counter()
+    model = Warehouse(layout=generate_layout(M, N), num_agentes=num_agentes, tasa_llegada=tasa_llegada, seed=seed)
+    construct_ms = 1000 * (time.perf_counter() - start)
+
+    step_ms = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        model.step()
+        step_ms.append(1000 * (time.perf_counter() - start))
+    return {"construct_ms": construct_ms, "step_ms": percentiles(step_ms),
+            "delivered": model.delivered_packages}
+
+
+def bench_memory(M, N, num_agentes, tasa_llegada, ticks, seed, samples=5):
+    # Separate pass because tracemalloc slows everything down; traced bytes after construction and at
+    # `samples` points of the run, so steady growth shows up as a slope
+    tracemalloc.start()
+    model = Warehouse(layout=generate_layout(M, N), num_agentes=num_agentes, tasa_llegada=tasa_llegada, seed=seed)
+    after_construct = tracemalloc.get_traced_memory()[0]
+    curve = []
+    every = max(ticks // samples, 1)
+    for tick in range(1, ticks + 1):
+        model.step()
+        if tick % every == 0:
+            curve.append([tick, tracemalloc.get_traced_memory()[0]])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    growth = (curve[-1][1] - curve[0][1]) / (curve[-1][0] - curve[0][0]) if len(curve) > 1 else 0.0
+    return {"construct_bytes": after_construct, "peak_bytes": peak, "final_bytes": curve[-1][1] if curve else 0,
+            "growth_bytes_per_tick": growth, "curve": curve}
+
+
+def timed_request(call):
+    start = time.perf_counter()
+    response = call()
+    return 1000 * (time.perf_counter() - start), response
+
+
+def bench_api(num_agentes, requests, warmup_ticks, seed):
+    from api import app
+
+    client = app.test_client()
+    results = {}
+
+    def record(name, samples):
+        results[name] = {"latency_ms": percentiles([ms for ms, _ in samples]),
+                         "bytes": statistics.fmean(len(response.data) for _, response in samples),
+                         "errors": sum(response.status_code >= 400 for _, response in samples)}
+
+    init = []
+    for _ in range(requests):
+        init.append(timed_request(lambda: client.post("/api/init", json={"num_agentes": num_agentes, "seed": seed})))
+        if len(init) < requests:
+            client.delete("/api/session", headers={"X-Session-Id": init[-1][1].get_json()["session"]})
+    record("init", init)
+    headers = {"X-Session-Id": init[-1][1].get_json()["session"]}
+
+    client.post("/api/step", json={"steps": warmup_ticks}, headers=headers)
+    record("step_1", [timed_request(lambda: client.post("/api/step", json={"steps": 1}, headers=headers))
+                      for _ in range(requests)])
+    record("step_10", [timed_request(lambda: client.post("/api/step", json={"steps": 10}, headers=headers))
+                       for _ in range(requests)])
+    record("state_json", [timed_request(lambda: client.get("/api/state", headers=headers))
+                          for _ in range(requests)])
+
+    def delta():
+        tick = int(client.get("/api/state", headers={**headers, "Accept": "application/octet-stream"})
+                   .headers["X-Model-Tick"])
+        client.post("/api/step", json={"steps": 1}, headers=headers)
+        return client.get(f"/api/state?since={tick}", headers=headers)
+    record("state_delta", [timed_request(delta) for _ in range(requests)])
+    record("state_binary", [timed_request(lambda: client.get("/api/state", headers={
+        **headers, "Accept": "application/octet-stream"})) for _ in range(requests)])
+
+    client.delete("/api/session", headers=headers)
+    return results
+
+
+def median_of(runs):
+    # Element-wise median of the numeric leaves of several result dicts
+    first = runs[0]
+    if isinstance(first, dict):
+        return {key: median_of([run[key] for run in runs]) for key in first}
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        return statistics.median(runs)
+    return first
+
+
+def flatten(data, prefix=""):
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, name + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old_cases = {case["name"]: case for case in baseline["cases"]}
+    print(f"\nvs {baseline_path} (commit {baseline.get('commit')})")
+    for case in current["cases"]:
+        old = old_cases.get(case["name"])
+        if old is None:
+            continue
+        old_metrics = dict(flatten(old["result"]))
+        for metric, value in flatten(case["result"]):
+            before = old_metrics.get(metric)
+            if before:
+                print(f"  {case['name']:<40}{metric:<32}{before:>12.3f} -> {value:>12.3f}  "
+                      f"{100 * (value - before) / before:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warehouse model and API benchmark suite")
+    parser.add_argument("--grids", nargs="+", default=["47x20", "100x50", "200x100"], help="MxN sizes")
+    parser.add_argument("--agentes", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--tasa-llegada", type=float, nargs="+", default=[0.14, 0.5])
+    parser.add_argument("--ticks", type=int, default=500)
+    parser.add_argument("--memory-ticks", type=int, default=2000, help="length of the memory-growth run, 0 skips it")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--api-requests", type=int, default=30, help="requests per API endpoint, 0 skips the API")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    args = parser.parse_args()
+
+    cases = []
+    for grid, num_agentes, tasa_llegada in itertools.product(args.grids, args.agentes, args.tasa_llegada):
+        M, N = (int(value) for value in grid.lower().split("x"))
+        name = f"model/{M}x{N}/agents={num_agentes}/arrival={tasa_llegada}"
+        result = median_of([bench_model(M, N, num_agentes, tasa_llegada, args.ticks, args.seed + repeat)
+                            for repeat in range(args.repeats)])
+        if args.memory_ticks:
+            result["memory"] = bench_memory(M, N, num_agentes, tasa_llegada, args.memory_ticks, args.seed)
+        cases.append({"name": name, "params": {"M": M, "N": N, "num_agentes": num_agentes,
+                                               "tasa_llegada": tasa_llegada, "ticks": args.ticks},
+                      "result": result})
+        memory = f"  mem {result['memory']['final_bytes'] / 1e6:6.2f} MB" \
+                 f" ({result['memory']['growth_bytes_per_tick']:+.0f} B/tick)" if args.memory_ticks else ""
+        print(f"{name:<40} construct {result['construct_ms']:8.2f} ms  step p50 {result['step_ms']['p50']:7.3f} ms"
+              f"  p95 {result['step_ms']['p95']:7.3f} ms{memory}")
+
+    if args.api_requests:
+        for num_agentes in args.agentes:
+            name = f"api/agents={num_agentes}"
+            result = median_of([bench_api(num_agentes, args.api_requests, args.ticks, args.seed + repeat)
+                                for repeat in range(args.repeats)])
+            cases.append({"name": name, "params": {"num_agentes": num_agentes, "requests": args.api_requests},
+                          "result": result})
+            for endpoint, stats in result.items():
+                print(f"{name + ' ' + endpoint:<40} p50 {stats['latency_ms']['p50']:8.3f} ms"
+                      f"  p95 {stats['latency_ms']['p95']:8.3f} ms  {stats['bytes']:10.0f} B")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "mesa": mesa.__version__,
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "args": vars(args),
+        "cases": cases,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"wrote {args.out}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import struct
+
+import numpy as np
+
+# Binary state layout (all little-endian), served as application/octet-stream:
+#   header    HEADER (24 bytes)
+#   robots    robot_count records of ROBOT_DTYPE
+#   packages  package_count records of PACKAGE_DTYPE
+# Records are fixed-size with explicit padding so every field is naturally aligned and can be read
+# in place. Bump FORMAT_VERSION whenever a layout changes.
+FORMAT_MAGIC = b"WHST"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHIIIHH")  # magic, version, header size, tick, robot count, package count, robot record size, package record size
+NO_PACKAGE = -1
+
+ROBOT_DTYPE = np.dtype([
+    ("id", "<i4"),
+    ("charge", "<f4"),
+    ("package", "<i4"),  # id of the carried package, NO_PACKAGE when empty
+    ("x", "<i2"),
+    ("y", "<i2"),
+    ("state", "u1"),
+    ("pad", "V3"),
+])
+
+PACKAGE_DTYPE = np.dtype([
+    ("id", "<i4"),
+    ("x", "<i2"),
+    ("y", "<i2"),
+    ("state", "u1"),
+    ("pad", "V3"),
+])
+
+
+class AgentTable:
+    # Struct-of-records table, one row per live agent, maintained by the model hooks.
+    # Rows of removed agents are recycled; `active` marks the rows in use.
+    def __init__(self, dtype, capacity=64):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self._blank = np.zeros((), dtype=dtype)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.rows = {}  # unique_id -> row
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def add(self, unique_id, **values):
+        if not self._free:
+            self._grow()
+        row = self._free.pop()
+        self.rows[unique_id] = row
+        self.data[row] = self._blank
+        self.active[row] = True
+        for field, value in values.items():
+            self.data[field][row] = value
+        return row
+
+    def remove(self, unique_id):
+        row = self.rows.pop(unique_id, None)
+        if row is not None:
+            self.active[row] = False
+            self._free.append(row)
+
+    def set(self, unique_id, field, value):
+        row = self.rows.get(unique_id)
+        if row is not None:
+            self.data[field][row] = value
+
+    def set_pos(self, unique_id, pos):
+        row = self.rows.get(unique_id)
+        if row is not None:
+            self.data["x"][row], self.data["y"][row] = pos
+
+    def get(self, unique_id, field):
+        return int(self.data[field][self.rows[unique_id]])
+
+    def packed(self):
+        return self.data[self.active]
+
+    def _grow(self):
+        capacity = len(self.data)
+        self.data = np.concatenate([self.data, np.zeros(capacity, dtype=self.data.dtype)])
+        self.active = np.concatenate([self.active, np.zeros(capacity, dtype=bool)])
+        self._free.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+
+def encode_state(model):
+    return encode_records(model.schedule.steps, model.robot_table.packed(), model.package_table.packed())
+
+
+def encode_records(tick, robots, packages):
+    header = HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, HEADER.size, tick,
+                         len(robots), len(packages), ROBOT_DTYPE.itemsize, PACKAGE_DTYPE.itemsize)
+    return header + robots.tobytes() + packages.tobytes()
+
+
+def schema():
+    def fields(dtype):
+        return [{"name": name, "type": dtype.fields[name][0].str, "offset": dtype.fields[name][1]}
+                for name in dtype.names if name != "pad"]
+
+    return {
+        "magic": FORMAT_MAGIC.decode(),
+        "version": FORMAT_VERSION,
+        "header": {"format": HEADER.format, "size": HEADER.size,
+                   "fields": ["magic", "version", "header_size", "tick", "robot_count", "package_count",
+                              "robot_record_size", "package_record_size"]},
+        "robot": {"size": ROBOT_DTYPE.itemsize, "fields": fields(ROBOT_DTYPE)},
+        "package": {"size": PACKAGE_DTYPE.itemsize, "fields": fields(PACKAGE_DTYPE)},
+        "no_package": NO_PACKAGE,
+    }
@@ -0,0 +1,203 @@
+import math
+from collections import deque
+
+import numpy as np
+
+from layers import FLOOR_SHELF, near_key_cells
+
+LOW_CHARGE = 25  # robots at or below this charge go to a charging station instead of taking missions
+DRAIN_PER_TICK = .25  # charge points a robot uses every tick it is off a charging station
+CHARGE_PER_TICK = 25  # charge points gained per tick on a station
+FULL_CHARGE = 99  # robots leave the station at or above this
+TOP_UP_CHARGE = 60  # idle robots below this top up while no mission is waiting and a station would not keep them queuing
+RESERVE_CHARGE = 5  # charge a robot must still have when it reaches a station after a mission
+BAY_CLEARANCE = 2  # queued robots wait at least this many cells (Chebyshev) from conveyors and chargers
+# Travel estimates ignore the other robots, so charge budgets count every leg CONGESTION_FACTOR times
+# over plus CONGESTION_TICKS of waiting, e.g. in the queue for a conveyor
+CONGESTION_FACTOR = 2
+CONGESTION_TICKS = 10
+
+
+class ChargingScheduler:
+    # Charging stations with occupancy: one robot charges per station at a time, the others wait in the
+    # station's queue, in request order. request() sends a robot to the station where it starts charging
+    # soonest, counting its travel and the charging time of everyone ahead of it; release() hands the
+    # station to the next robot. A queued robot only drives to the station when it would otherwise
+    # arrive after the robots ahead of it are done; until then it waits in a bay, a floor cell
+    # BAY_CLEARANCE away from conveyors and chargers, shelves first since loaded robots never cross
+    # those, so queues never block the conveyors or the aisles to them.
+    # step() (from CentralSystem) moves robots out of their bays and sends idle robots below
+    # TOP_UP_CHARGE to charge while no mission is waiting, and mission_fits() keeps CentralSystem
+    # from handing a robot a mission it lacks the charge to finish. Traffic can still hold a robot up
+    # for longer than that allows; needs_charge() tells it when to drop what it's doing and go charge
+    # (a loaded robot takes its package along and delivers it once charged).
+    def __init__(self, model, stations, robot_type):
+        self.model = model
+        self.stations = list(stations)
+        self.robot_type = robot_type
+        self.queues = {pos: deque() for pos in self.stations}  # pos -> robots, the first one charges
+        self.assigned = {}  # robot unique_id -> station pos
+        self.bays = {pos: self.rank_bays(pos) for pos in self.stations}  # pos -> bay cells, nearest first
+        self.parked = {}  # robot unique_id -> bay it waits in
+        self.taken = set()  # bays with a robot assigned
+        self.busy = {}  # pos -> busy_ticks(pos) this tick
+        self.busy_tick = None
+
+    def rank_bays(self, station):
+        # One pass over the floor: shelves first, then by travel to the station (a row of the router's
+        # distance tables, or Chebyshev distance without a router), then by position
+        floor = self.model.floor
+        layout = self.model.layout
+        open_cells = ~near_key_cells(floor, BAY_CLEARANCE)
+        for pos in (layout.home, layout.rest):
+            open_cells[pos] = False
+        xs, ys = open_cells.nonzero()
+        router = self.model.router
+        if router is not None:
+            travel = router.distances(station)[xs, ys]
+            travel = np.where(travel < 0, np.iinfo(travel.dtype).max, travel)  # unreachable bays last
+        else:
+            travel = np.maximum(np.abs(xs - station[0]), np.abs(ys - station[1]))
+        order = np.lexsort((ys, xs, travel, floor[xs, ys] != FLOOR_SHELF))
+        return list(zip(xs[order].tolist(), ys[order].tolist()))
+
+    def travel(self, pos, target, loaded=False):
+        return self.model.central_system.travel_cost(pos, target, loaded)
+
+    @staticmethod
+    def charge_ticks(robot):
+        return math.ceil(max(100 - robot.charge_percentage, 0) / CHARGE_PER_TICK)
+
+    def service_ticks(self, robot, pos, first):
+        # Ticks `robot` keeps station `pos` to itself: the rest of its trip when it is next, its charging
+        # and the tick the station changes hands
+        travel = self.travel(robot.pos, pos) if first and robot.pos != pos else 0
+        return travel + self.charge_ticks(robot) + 1
+
+    def busy_ticks(self, pos):
+        # Ticks the robots queued at `pos` need to arrive and charge. Mission matching asks for every
+        # (mission, robot) pair, so it is worked out once per tick and station, or when its queue changes.
+        now = self.model.schedule.steps
+        if self.busy_tick != now:
+            self.busy = {}
+            self.busy_tick = now
+        busy = self.busy.get(pos)
+        if busy is None:
+            busy = self.busy[pos] = sum(self.service_ticks(other, pos, i == 0)
+                                        for i, other in enumerate(self.queues[pos]))
+        return busy
+
+    def expected_start(self, robot, pos):
+        # Ticks until `robot` would start charging at `pos`: its own travel, or the time the robots
+        # queued there need to arrive and charge, whichever is longer
+        return max(self.travel(robot.pos, pos), self.busy_ticks(pos))
+
+    def request(self, robot):
+        # Station the robot is queued at, choosing one the first time; None when there are no stations
+        pos = self.assigned.get(robot.unique_id)
+        if pos is None and self.stations:
+            pos = min(self.stations, key=lambda station: (self.expected_start(robot, station),
+                                                          self.travel(robot.pos, station)))
+            queue = self.queues[pos]
+            # lowest charge first, so a robot that joins late doesn't run out behind fuller ones; the head
+            # of the queue keeps its turn
+            at = next((i for i in range(1, len(queue)) if queue[i].charge_percentage > robot.charge_percentage),
+                      len(queue))
+            queue.insert(at, robot)
+            self.assigned[robot.unique_id] = pos
+            self.busy.pop(pos, None)
+            robot.state = 4
+            self.dispatch(pos)
+        return pos
+
+    def dispatch(self, pos):
+        # A queued robot drives to the station once everyone ahead of it is done by the time it gets
+        # there, and waits in a bay until then
+        ahead = 0
+        for i, robot in enumerate(self.queues[pos]):
+            if ahead <= self.travel(robot.pos, pos):
+                self.unpark(robot)
+                robot.target_pos = pos
+            else:
+                robot.target_pos = self.bay(robot, pos)
+            ahead += self.service_ticks(robot, pos, i == 0)
+
+    def bay(self, robot, pos):
+        bay = self.parked.get(robot.unique_id)
+        if bay is None:
+            floor = self.model.floor
+            bay = next((cell for cell in self.bays[pos] if cell not in self.taken
+                        and not (robot.has_package and floor[cell] == FLOOR_SHELF)), None)
+            if bay is None:
+                return pos  # every bay taken: wait as close to the station as the floor allows
+            self.parked[robot.unique_id] = bay
+            self.taken.add(bay)
+        return bay
+
+    def unpark(self, robot):
+        bay = self.parked.pop(robot.unique_id, None)
+        if bay is not None:
+            self.taken.discard(bay)
+
+    def can_charge(self, robot):
+        # Robots charge only on their own station, one at a time: the first robot of its queue standing
+        # on it (a robot ahead in the queue may still be on its way, or unable to get past the one there)
+        pos = self.assigned.get(robot.unique_id)
+        if pos != robot.pos:
+            return False
+        return next(other for other in self.queues[pos] if other.pos == pos) is robot
+
+    def release(self, robot):
+        pos = self.assigned.pop(robot.unique_id, None)
+        if pos is not None:
+            self.queues[pos].remove(robot)
+            self.busy.pop(pos, None)
+        self.unpark(robot)
+
+    def free_stations(self):
+        return [pos for pos, queue in self.queues.items() if not queue]
+
+    @staticmethod
+    def budget(ticks):
+        # Charge to set aside for a trip estimated at `ticks`, with the congestion margin
+        return DRAIN_PER_TICK * (CONGESTION_FACTOR * ticks + CONGESTION_TICKS)
+
+    def return_budget(self, pos):
+        # Charge it takes from `pos` until charging: the trip to a station with its congestion margin plus
+        # that station's queue, at whichever station that is least
+        return min((self.budget(self.travel(pos, station)) + DRAIN_PER_TICK * self.busy_ticks(station)
+                    for station in self.stations), default=0)
+
+    def mission_fits(self, robot, pickup_pos, destination_pos=None):
+        # Enough charge to reach the pickup above the low-charge mark (so the robot doesn't drop the
+        # mission on the way), then deliver and get back to a station with RESERVE_CHARGE left, every trip
+        # with its congestion margin. Without a destination (inbound missions before a shelf is reserved)
+        # the delivery leg is left out.
+        to_pickup = self.budget(self.travel(robot.pos, pickup_pos))
+        if robot.charge_percentage - to_pickup <= LOW_CHARGE:
+            return False
+        if destination_pos is None:
+            rest = self.return_budget(pickup_pos)
+        else:
+            rest = self.budget(self.travel(pickup_pos, destination_pos, loaded=True)) + \
+                self.return_budget(destination_pos)
+        return robot.charge_percentage - to_pickup - rest >= RESERVE_CHARGE
+
+    def needs_charge(self, robot):
+        # A robot on a mission that is down to what it takes to reach charging from here: drop it and go
+        return robot.charge_percentage - self.return_budget(robot.pos) < RESERVE_CHARGE
+
+    def step(self):
+        for pos in self.stations:
+            self.dispatch(pos)
+        # Opportunistic top-ups: only while nothing waits for a robot, and only where the robot would
+        # not queue (the station is done with everyone ahead by the time it gets there); spreads the
+        # fleet's charging out instead of everyone running low at once
+        if self.model.central_system.missions or not self.stations:
+            return
+        idle = sorted((robot for robot in self.model.agents_with(self.robot_type, "state", 0)
+                       if robot.mission is None and robot.charge_percentage < TOP_UP_CHARGE),
+                      key=lambda robot: robot.charge_percentage)
+        for robot in idle:
+            if any(self.busy_ticks(station) <= self.travel(robot.pos, station) for station in self.stations):
+                self.request(robot)
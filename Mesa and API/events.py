@@ -0,0 +1,93 @@
+from collections import deque
+
+LEDGER_SIZE = 10000  # completed packages kept with their phase timestamps
+
+# Phases of a package, in ticks: arrived at the entrance, inbound mission queued, collected by a robot,
+# put away on a shelf, ordered out, picked from the shelf, handed to the exit conveyor, removed
+PHASES = ("arrived", "queued", "collected", "stored", "ordered", "picked", "sent", "removed")
+# Cycle times reported by PackageLedger.summary(), as (from, to) phases
+DURATIONS = {"receive": ("arrived", "stored"), "dwell": ("stored", "ordered"), "fulfil": ("ordered", "sent"),
+             "total": ("arrived", "sent")}
+
+
+class EventBus:
+    # Synchronous publish/subscribe for agent state transitions. The model emits an (agent type, field)
+    # event for every Tracked attribute change and for placing/removing agents (field "pos", None -> pos
+    # and pos -> None); handlers run right away, in subscription order, as handler(agent, old, new).
+    # Handlers must be picklable (bound methods, module functions) so checkpoints keep working.
+    def __init__(self):
+        self._handlers = {}
+
+    def subscribe(self, agent_type, field, handler):
+        self._handlers.setdefault((agent_type, field), []).append(handler)
+
+    def unsubscribe(self, agent_type, field, handler):
+        handlers = self._handlers.get((agent_type, field), [])
+        if handler in handlers:
+            handlers.remove(handler)
+
+    def emit(self, agent_type, field, agent, old, new):
+        handlers = self._handlers.get((agent_type, field))
+        if handlers:
+            for handler in handlers:
+                handler(agent, old, new)
+
+
+class PackageLedger:
+    # Phase timestamps for every package, from the package events. Packages still in the warehouse are
+    # in `open`; removed ones move to `completed`, which keeps the last `maxlen` of them.
+    def __init__(self, model, events, package_type, maxlen=LEDGER_SIZE):
+        self.model = model
+        self.open = {}  # unique_id -> record
+        self.completed = deque(maxlen=maxlen)
+        self.count = 0  # completed packages, including those no longer kept
+        events.subscribe(package_type, "pos", self.moved)
+        events.subscribe(package_type, "state", self.state_changed)
+        events.subscribe(package_type, "is_locked", self.lock_changed)
+
+    def _stamp(self, package, phase):
+        record = self.open.get(package.unique_id)
+        if record is not None and phase not in record:
+            record[phase] = self.model.schedule.steps
+
+    def moved(self, package, old, new):
+        if old is None:
+            self.open[package.unique_id] = {"id": package.unique_id, "sku": package.sku,
+                                            "arrived": self.model.schedule.steps}
+        elif new is None:
+            record = self.open.pop(package.unique_id, None)
+            if record is not None:
+                record["removed"] = self.model.schedule.steps
+                self.completed.append(record)
+                self.count += 1
+
+    def state_changed(self, package, old, new):
+        # Packages.state: 0 in storage, 1 awaiting pickup, 2 in transit, 3 sent
+        if new == 1:
+            self._stamp(package, "queued")
+        elif new == 2:
+            self._stamp(package, "collected" if old == 1 else "picked")
+        elif new == 0 and old == 2:
+            self._stamp(package, "stored")
+        elif new == 3:
+            self._stamp(package, "sent")
+
+    def lock_changed(self, package, old, new):
+        if new and package.state == 0 and "stored" in self.open.get(package.unique_id, ()):
+            self._stamp(package, "ordered")
+
+    def rows(self, limit=None):
+        records = list(self.completed)
+        return records[-limit:] if limit else records
+
+    def summary(self):
+        # count / mean / p50 / p95 ticks per DURATIONS entry over the kept completed packages
+        report = {}
+        for name, (start, end) in DURATIONS.items():
+            spans = sorted(record[end] - record[start] for record in self.completed
+                           if start in record and end in record)
+            if spans:
+                report[name] = {"count": len(spans), "mean": sum(spans) / len(spans),
+                                "p50": spans[len(spans) // 2],
+                                "p95": spans[min(len(spans) - 1, int(len(spans) * 0.95))]}
+        return report
@@ -0,0 +1,94 @@
+from collections import deque
+
+import numpy as np
+
+SHELF_NONE = 0
+SHELF_FREE = 1
+SHELF_OCCUPIED = 2
+
+# Static floor map codes (Warehouse.floor)
+FLOOR_AISLE = 0
+FLOOR_SHELF = 1
+FLOOR_CONVEYOR = 2
+FLOOR_CHARGER = 3
+
+
+def near_key_cells(floor, radius):
+    # Mask of the squares within `radius` (Chebyshev) of a conveyor or charger
+    keys = np.pad((floor == FLOOR_CONVEYOR) | (floor == FLOOR_CHARGER), radius)
+    width, height = floor.shape
+    near = np.zeros(floor.shape, dtype=bool)
+    for dx in range(2 * radius + 1):
+        for dy in range(2 * radius + 1):
+            near |= keys[dx:dx + width, dy:dy + height]
+    return near
+
+
+class OccupancyLayers:
+    # Persistent width x height arrays, updated in place by the model's place/move/remove hooks.
+    # Robots can share a square, so the charge layer keeps the sum of their charges and reads as the mean.
+    def __init__(self, width, height):
+        self.robots = np.zeros((width, height), dtype=np.int16)
+        self.packages = np.zeros((width, height), dtype=np.int16)
+        self.shelves = np.zeros((width, height), dtype=np.int8)
+        self.charge_sum = np.zeros((width, height), dtype=np.float64)
+
+    @property
+    def charge(self):
+        # Mean charge of the robots on each square, 0 where there are none
+        charge = np.zeros(self.charge_sum.shape, dtype=np.float32)
+        np.divide(self.charge_sum, self.robots, out=charge, where=self.robots > 0, casting="unsafe")
+        return charge
+
+    def add_robot(self, pos, charge):
+        self.robots[pos] += 1
+        self.charge_sum[pos] += charge
+
+    def remove_robot(self, pos, charge):
+        self.robots[pos] -= 1
+        self.charge_sum[pos] = self.charge_sum[pos] - charge if self.robots[pos] else 0
+
+    def update_charge(self, pos, old, new):
+        self.charge_sum[pos] += new - old
+
+    def add_package(self, pos):
+        self.packages[pos] += 1
+
+    def remove_package(self, pos):
+        self.packages[pos] -= 1
+
+    def set_shelf(self, pos, is_free):
+        self.shelves[pos] = SHELF_FREE if is_free else SHELF_OCCUPIED
+
+    def clear_shelf(self, pos):
+        self.shelves[pos] = SHELF_NONE
+
+    def nbytes(self):
+        return self.robots.nbytes + self.packages.nbytes + self.shelves.nbytes + self.charge_sum.nbytes
+
+    def snapshot(self):
+        return {"robots": self.robots.copy(), "packages": self.packages.copy(),
+                "shelves": self.shelves.copy(), "charge": self.charge}
+
+
+class SnapshotCollector:
+    # Stand-in for mesa's DataCollector for long runs: reporters are sampled every `every` ticks
+    # and only the latest `maxlen` samples are kept, so memory stays flat no matter the run length.
+    def __init__(self, model_reporters, every=10, maxlen=1000):
+        self.model_reporters = model_reporters
+        self.every = every
+        self.model_vars = {name: deque(maxlen=maxlen) for name in model_reporters}
+
+    def collect(self, model):
+        tick = model.schedule.steps
+        if tick % self.every:
+            return
+        for name, reporter in self.model_reporters.items():
+            self.model_vars[name].append((tick, reporter(model)))
+
+    def get(self, name):
+        return list(self.model_vars[name])
+
+    def latest(self, name):
+        samples = self.model_vars[name]
+        return samples[-1] if samples else None
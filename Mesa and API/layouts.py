@@ -0,0 +1,312 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from layers import FLOOR_AISLE, FLOOR_CHARGER, FLOOR_CONVEYOR, FLOOR_SHELF
+from routing import bfs, walkable_masks
+
+# Layout files are plain text, one character per square, top line is the top row (y = height - 1):
+#     .  aisle              #  shelf
+#     E  entrance conveyor  X  exit conveyor
+#     C  charging station   H  home square (robots start and idle here; optional, may also be R)
+#     R  rest square robots go to after a delivery (optional, defaults to H)
+# Blank lines and lines starting with ';' are ignored, except '; home X Y' and '; rest X Y', which place
+# those squares on any cell, shelves included (the default rest square is a shelf), instead of H or R.
+#
+# compile_tables() turns a floor plus its key squares into distance/next-hop tables stored as .npy files
+# under a content-hashed directory; Router.load_tables() memory-maps them, so later runs (and parallel
+# workers) skip the BFS work and share the pages.
+
+TABLES_VERSION = 1
+DEFAULT_TABLE_BYTES = 256 * 1024 * 1024  # shelf targets are only precompiled while the tables fit in this
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".layout_cache")
+
+DEFAULT_ENTRANCE = (46, 6)
+DEFAULT_EXIT = (46, 13)
+DEFAULT_CHARGERS = [(46, 8), (46, 9), (46, 10), (46, 11)]
+DEFAULT_HOME = (1, 1)
+DEFAULT_REST = (1, 0)
+DEFAULT_SHELVES = [(2, 3), (2, 4), (2, 5), (2, 6), (2, 7), (2, 8), (2, 9), (2, 10), (2, 11), (2, 12),
+                   (2, 13), (2, 14), (2, 15), (2, 16),
+                   # (3,3), (3,4), (3,5), (3,6), (3,7), (3,8), (3,9), (3,10), (3,11), (3,12), (3,13), (3,14), (3,15), (3,16),
+                   (6, 3), (6, 4), (6, 5), (6, 6), (6, 7), (6, 8), (6, 9), (6, 10), (6, 11), (6, 12),
+                   (6, 13), (6, 14), (6, 15), (6, 16),
+                   # (7, 3), (7, 4), (7, 5), (7, 6), (7, 7), (7, 8), (7, 9), (7, 10), (7, 11), (7, 12),
+                   # (7, 13), (7, 14), (7, 15), (7, 16),
+                   (10, 3), (10, 4), (10, 5), (10, 6), (10, 7), (10, 8), (10, 9), (10, 10), (10, 11),
+                   (10, 12),
+                   (10, 13), (10, 14), (10, 15), (10, 16),
+                   # (11, 3), (11, 4), (11, 5), (11, 6), (11, 7), (11, 8), (11, 9), (11, 10), (11, 11),
+                   # (11, 12),
+                   # (11, 13), (11, 14), (11, 15), (11, 16),
+                   (14, 3), (14, 4), (14, 5), (14, 6), (14, 7), (14, 8), (14, 9), (14, 10), (14, 11),
+                   (14, 12),
+                   (14, 13), (14, 14), (14, 15), (14, 16),
+                   # (15, 3), (15, 4), (15, 5), (15, 6), (15, 7), (15, 8), (15, 9), (15, 10), (15, 11),
+                   # (15, 12),
+                   # (15, 13), (15, 14), (15, 15), (15, 16),
+                   (18, 3), (18, 4), (18, 5), (18, 6), (18, 7), (18, 8), (18, 9), (18, 10), (18, 11),
+                   (18, 12),
+                   (18, 13), (18, 14), (18, 15), (18, 16),
+                   # (19, 3), (19, 4), (19, 5), (19, 6), (19, 7), (19, 8), (19, 9), (19, 10), (19, 11),
+                   # (19, 12),
+                   # (19, 13), (19, 14), (19, 15), (19, 16),
+                   (22, 3), (22, 4), (22, 5), (22, 6), (22, 7), (22, 8), (22, 9), (22, 10), (22, 11),
+                   (22, 12),
+                   (22, 13), (22, 14), (22, 15), (22, 16),
+                   # (23, 3), (23, 4), (23, 5), (23, 6), (23, 7), (23, 8), (23, 9), (23, 10), (23, 11),
+                   # (23, 12),
+                   # (23, 13), (23, 14), (23, 15), (23, 16),
+                   (26, 3), (26, 4), (26, 5), (26, 6), (26, 7), (26, 8), (26, 9), (26, 10), (26, 11),
+                   (26, 12),
+                   (26, 13), (26, 14), (26, 15), (26, 16),
+                   # (27, 3), (27, 4), (27, 5), (27, 6), (27, 7), (27, 8), (27, 9), (27, 10), (27, 11),
+                   # (27, 12),
+                   # (27, 13), (27, 14), (27, 15), (27, 16),
+                   (30, 3), (30, 4), (30, 5), (30, 6), (30, 7), (30, 8), (30, 9), (30, 10), (30, 11),
+                   (30, 12),
+                   (30, 13), (30, 14), (30, 15), (30, 16),
+                   # (31, 3), (31, 4), (31, 5), (31, 6), (31, 7), (31, 8), (31, 9), (31, 10), (31, 11),
+                   # (31, 12),
+                   # (31, 13), (31, 14), (31, 15), (31, 16),
+                   (34, 3), (34, 4), (34, 5), (34, 6), (34, 7), (34, 8), (34, 9), (34, 10), (34, 11),
+                   (34, 12),
+                   (34, 13), (34, 14), (34, 15), (34, 16),
+                   # (35, 3), (35, 4), (35, 5), (35, 6), (35, 7), (35, 8), (35, 9), (35, 10), (35, 11),
+                   # (35, 12),
+                   # (35, 13), (35, 14), (35, 15), (35, 16),
+                   (38, 3), (38, 4), (38, 5), (38, 6), (38, 7), (38, 8), (38, 9), (38, 10), (38, 11),
+                   (38, 12),
+                   (38, 13), (38, 14), (38, 15), (38, 16),
+                   # (39, 3), (39, 4), (39, 5), (39, 6), (39, 7), (39, 8), (39, 9), (39, 10), (39, 11),
+                   # (39, 12),
+                   # (39, 13), (39, 14), (39, 15), (39, 16),
+                   (42, 3), (42, 4), (42, 5), (42, 6), (42, 7), (42, 8), (42, 9), (42, 10), (42, 11),
+                   (42, 12),
+                   (42, 13), (42, 14), (42, 15), (42, 16),
+                   # (43, 3), (43, 4), (43, 5), (43, 6), (43, 7), (43, 8), (43, 9), (43, 10), (43, 11),
+                   # (43, 12),
+                   # (43, 13), (43, 14), (43, 15), (43, 16),
+                   (0, 0), (1, 0), (2, 0), (3, 0), (4, 0), (5, 0), (6, 0), (7, 0), (8, 0), (9, 0), (10, 0),
+                   (11, 0), (12, 0), (13, 0), (14, 0), (15, 0), (16, 0), (17, 0), (18, 0), (19, 0), (20, 0),
+                   (21, 0), (22, 0), (23, 0), (24, 0), (25, 0), (26, 0), (27, 0), (28, 0), (29, 0), (30, 0),
+                   (31, 0), (32, 0), (33, 0), (34, 0),
+                   (35, 0), (36, 0), (37, 0), (38, 0), (39, 0), (40, 0), (41, 0), (42, 0), (43, 0), (44, 0),
+                   (45, 0), (46, 0),
+                   (0, 19), (1, 19), (2, 19), (3, 19), (4, 19), (5, 19), (6, 19), (7, 19), (8, 19), (9, 19),
+                   (10, 19),
+                   (11, 19), (12, 19), (13, 19), (14, 19), (15, 19), (16, 19), (17, 19), (18, 19), (19, 19),
+                   (20, 19),
+                   (21, 19), (22, 19), (23, 19), (24, 19), (25, 19), (26, 19), (27, 19), (28, 19), (29, 19),
+                   (30, 19),
+                   (31, 19), (32, 19), (33, 19), (34, 19),
+                   (35, 19), (36, 19), (37, 19), (38, 19), (39, 19), (40, 19), (41, 19), (42, 19), (43, 19),
+                   (44, 19),
+                   (45, 19), (46, 19),
+                   ]
+
+
+class Layout:
+    def __init__(self, width, height, shelves, entrance, exit, chargers, home=DEFAULT_HOME, rest=None):
+        self.width = width
+        self.height = height
+        self.shelves = list(shelves)  # placement order, which also fixes the shelves' unique ids
+        self.entrance = entrance
+        self.exit = exit
+        self.chargers = list(chargers)
+        self.home = home
+        self.rest = rest or home
+
+    def floor(self):
+        floor = np.full((self.width, self.height), FLOOR_AISLE, dtype=np.int8)
+        for pos in self.shelves:
+            floor[pos] = FLOOR_SHELF
+        for pos in self.chargers:
+            floor[pos] = FLOOR_CHARGER
+        floor[self.entrance] = floor[self.exit] = FLOOR_CONVEYOR
+        return floor
+
+    def to_text(self):
+        symbols = {FLOOR_AISLE: ".", FLOOR_SHELF: "#", FLOOR_CHARGER: "C"}
+        floor = self.floor()
+        rows = [[symbols.get(int(floor[x, y]), ".") for x in range(self.width)] for y in range(self.height)]
+        rows[self.entrance[1]][self.entrance[0]] = "E"
+        rows[self.exit[1]][self.exit[0]] = "X"
+        header = []
+        for pos, symbol, name in ((self.home, "H", "home"), (self.rest, "R", "rest")):
+            if floor[pos] == FLOOR_AISLE:
+                rows[pos[1]][pos[0]] = symbol
+            else:
+                header.append(f"; {name} {pos[0]} {pos[1]}\n")
+        return "".join(header) + "\n".join("".join(row) for row in reversed(rows)) + "\n"
+
+    def same_as(self, other):
+        # Same floor and key squares; shelf order (and so shelf ids) isn't kept by the text format
+        return ((self.width, self.height, self.entrance, self.exit, self.home, self.rest)
+                == (other.width, other.height, other.entrance, other.exit, other.home, other.rest)
+                and sorted(self.shelves) == sorted(other.shelves) and sorted(self.chargers) == sorted(other.chargers))
+
+
+def default_layout(M=47, N=20):
+    # The original 47x20 warehouse; positions outside an M x N grid are reported and skipped by the model
+    return Layout(M, N, DEFAULT_SHELVES, DEFAULT_ENTRANCE, DEFAULT_EXIT, DEFAULT_CHARGERS,
+                  home=DEFAULT_HOME, rest=DEFAULT_REST)
+
+
+def generate_layout(M, N):
+    # The default warehouse's pattern stretched to fill an M x N grid: shelf rows along the top and bottom
+    # edges, shelf columns every 4 squares in blocks of 14 with 2-square cross aisles between blocks, and
+    # the conveyors with max(4, N // 5) chargers between them on the right edge. 47x20 gives the default.
+    if M < 7 or N < 12:
+        raise ValueError("a generated layout needs at least a 7x12 grid")
+    shelves = []
+    for x in range(2, M - 4, 4):
+        for top in range(3, N - 3, 16):
+            shelves += [(x, y) for y in range(top, min(top + 14, N - 3))]
+    shelves += [(x, 0) for x in range(M)] + [(x, N - 1) for x in range(M)]
+    count = max(4, N // 5)
+    start = N // 2 - count // 2
+    chargers = [(M - 1, y) for y in range(start, start + count)]
+    return Layout(M, N, shelves, (M - 1, start - 2), (M - 1, start + count + 1), chargers,
+                  home=DEFAULT_HOME, rest=DEFAULT_REST)
+
+
+def parse_layout(text):
+    rows, marks = [], {}
+    for line in text.splitlines():
+        if line.startswith(";"):
+            words = line[1:].split()
+            if len(words) == 3 and words[0] in ("home", "rest") and words[1].isdigit() and words[2].isdigit():
+                symbol = "H" if words[0] == "home" else "R"
+                if symbol in marks:
+                    raise ValueError(f"layout has more than one {words[0]} square")
+                marks[symbol] = (int(words[1]), int(words[2]))
+        elif line.strip():
+            rows.append(line.rstrip("\n"))
+    if not rows or len({len(row) for row in rows}) != 1:
+        raise ValueError("layout must be a non-empty rectangle of characters")
+    height, width = len(rows), len(rows[0])
+    for symbol, (x, y) in marks.items():
+        if not (0 <= x < width and 0 <= y < height):
+            raise ValueError(f"layout's {'home' if symbol == 'H' else 'rest'} square ({x}, {y}) is off the grid")
+    shelves, chargers = [], []
+    for row_index, row in enumerate(rows):
+        y = height - 1 - row_index
+        for x, symbol in enumerate(row):
+            if symbol == "#":
+                shelves.append((x, y))
+            elif symbol == "C":
+                chargers.append((x, y))
+            elif symbol in "EXHR":
+                if symbol in marks:
+                    raise ValueError(f"layout has more than one '{symbol}'")
+                marks[symbol] = (x, y)
+            elif symbol != ".":
+                raise ValueError(f"unknown layout symbol {symbol!r} at ({x}, {y})")
+    if "E" not in marks or "X" not in marks:
+        raise ValueError("layout needs one entrance 'E' and one exit 'X'")
+    if "H" not in marks:
+        marks["H"] = next(((x, y) for x in range(width) for y in range(height)
+                           if rows[height - 1 - y][x] == "."), marks["E"])
+    return Layout(width, height, sorted(shelves), marks["E"], marks["X"], sorted(chargers),
+                  home=marks["H"], rest=marks.get("R"))
+
+
+def load_layout(path):
+    with open(path) as f:
+        return parse_layout(f.read())
+
+
+def table_targets(floor, key_points, shelves, max_bytes=DEFAULT_TABLE_BYTES):
+    # Conveyors, chargers and home squares always; every shelf too while the tables stay under max_bytes
+    per_target = 2 * floor.size * np.dtype(np.int32).itemsize
+    targets = list(dict.fromkeys(key_points))
+    if (len(targets) + len(shelves)) * 2 * per_target <= max_bytes:
+        targets += [pos for pos in shelves if pos not in targets]
+    return [(x, y, loaded) for x, y in targets for loaded in (0, 1)]
+
+
+def compile_tables(floor, targets, cache_dir=DEFAULT_CACHE_DIR):
+    # Directory holding floor.npy, targets.npy, dist.npy and next_hop.npy for this floor/targets pair,
+    # built on first use. Concurrent builders each write a private temp dir and the first rename wins.
+    floor = np.ascontiguousarray(floor, dtype=np.int8)
+    targets = np.asarray(targets, dtype=np.int32).reshape(-1, 3)
+    digest = hashlib.sha1()
+    digest.update(f"v{TABLES_VERSION}:{floor.shape}".encode())
+    digest.update(floor.tobytes())
+    digest.update(targets.tobytes())
+    path = os.path.join(cache_dir, digest.hexdigest()[:16])
+    if os.path.exists(os.path.join(path, "next_hop.npy")):
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    building = tempfile.mkdtemp(dir=cache_dir, prefix=".build-")
+    try:
+        masks = walkable_masks(floor)
+        shape = (len(targets),) + floor.shape
+        dist = np.lib.format.open_memmap(os.path.join(building, "dist.npy"), mode="w+", dtype=np.int32, shape=shape)
+        next_hop = np.lib.format.open_memmap(os.path.join(building, "next_hop.npy"), mode="w+", dtype=np.int32,
+                                             shape=shape)
+        for row, (x, y, loaded) in enumerate(targets):
+            dist[row], next_hop[row] = bfs((int(x), int(y)), masks[1] if loaded else masks[0])
+        dist.flush()
+        next_hop.flush()
+        del dist, next_hop
+        np.save(os.path.join(building, "floor.npy"), floor)
+        np.save(os.path.join(building, "targets.npy"), targets)
+        with open(os.path.join(building, "meta.json"), "w") as f:
+            json.dump({"version": TABLES_VERSION, "shape": list(floor.shape), "targets": len(targets)}, f)
+        try:
+            os.rename(building, path)
+        except OSError:
+            pass  # another process finished first; its tables are identical
+    finally:
+        shutil.rmtree(building, ignore_errors=True)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a warehouse layout into cached routing tables")
+    parser.add_argument("layout", help="layout file, 'default' for the built-in 47x20 warehouse, or MxN "
+                                       "(e.g. 100x50) for a generated one that fills that grid")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--max-table-mb", type=float, default=DEFAULT_TABLE_BYTES / 2 ** 20)
+    parser.add_argument("--export", help="write the layout as a text file instead")
+    parser.add_argument("--check", action="store_true",
+                        help="only check that the layout reads back the same from its text form")
+    args = parser.parse_args()
+
+    if args.layout == "default":
+        layout = default_layout()
+    elif os.path.exists(args.layout):
+        layout = load_layout(args.layout)
+    else:
+        try:
+            M, N = (int(value) for value in args.layout.lower().split("x"))
+        except ValueError:
+            raise SystemExit(f"no layout file {args.layout!r}, and it isn't an MxN size either")
+        layout = generate_layout(M, N)
+    if args.export or args.check:
+        text = layout.to_text()
+        if not parse_layout(text).same_as(layout):
+            raise SystemExit("layout doesn't read back the same from its text form")
+        if args.export:
+            with open(args.export, "w") as f:
+                f.write(text)
+        else:
+            print("layout reads back the same from its text form")
+        return
+    floor = layout.floor()
+    key_points = [layout.entrance, layout.exit, *layout.chargers, layout.home, layout.rest]
+    targets = table_targets(floor, key_points, layout.shelves, int(args.max_table_mb * 2 ** 20))
+    path = compile_tables(floor, targets, args.cache)
+    print(f"{layout.width}x{layout.height}, {len(targets)} tables -> {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,71 @@ from mesa.model import Model
 from mesa.agent import Agent
 from mesa.space import MultiGrid
 from mesa.time import SimultaneousActivation
-from mesa.datacollection import DataCollector
 
 import numpy as np
+import gzip
+import heapq
 import math
-import random
+import os
+import pickle
+from collections import defaultdict, deque
+
+from assignment import solve_assignment
+from binary_state import AgentTable, NO_PACKAGE, PACKAGE_DTYPE, ROBOT_DTYPE
+from charging import CHARGE_PER_TICK, DRAIN_PER_TICK, FULL_CHARGE, LOW_CHARGE, TOP_UP_CHARGE, ChargingScheduler
+from events import EventBus, PackageLedger
+from layers import FLOOR_AISLE, FLOOR_CHARGER, FLOOR_CONVEYOR, FLOOR_SHELF, OccupancyLayers, SnapshotCollector
+from layouts import compile_tables, default_layout, load_layout, table_targets
+from orders import OrderLog, OrderStream
+from planning import ReservationPlanner
+from recording import TrajectoryRecorder
+from routing import Router
+from slotting import NearestEntrancePolicy, ShelfAllocator
+from tracing import DEBUG, INFO, WARNING, tracer
+
+ant_trace = tracer.channel("ant")
+central_trace = tracer.channel("central")
+warehouse_trace = tracer.channel("warehouse")
+
+CHANGE_HISTORY = 1000  # ticks of per-agent change sets kept for delta state updates
+CHECKPOINT_VERSION = 2
+MISSION_BATCH = 32  # oldest pending missions considered by each tick's matching
+MAX_ACTIVE_MISSIONS = 30  # with 'Reservas', robots on missions at once; more only crowd the conveyors
+UNREACHABLE_COST = 10 ** 6
+NEIGHBOURHOOD = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]  # Moore, centre included, mesa's order
+MODOS_POS_INICIAL = ('Fija', 'Aleatoria')
+MODOS_RUTEO = ('Corta', 'Voraz', 'Reservas')
+MODOS_CARGA = ('Cola', 'Aleatoria')
+
+
+class Tracked:
+    # Agent attribute that reports its changes to the model so the model indexes stay current.
+    # The value lives in the agent __dict__ under the same name, so vars(agent) is unchanged.
+    def __init__(self, indexed=False):
+        self.indexed = indexed
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, agent, owner=None):
+        if agent is None:
+            return self
+        return agent.__dict__[self.name]
+
+    def __set__(self, agent, value):
+        old = agent.__dict__.get(self.name)
+        agent.__dict__[self.name] = value
+        if old != value:
+            agent.model.agent_changed(agent, self.name, old, value)
+
+
+class WarehouseAgent(Agent):
+    # Any attribute write on a placed agent (including mesa moving it) marks it dirty for the current tick
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        model = self.__dict__.get("model")
+        if model is not None and self.__dict__.get("pos") is not None:
+            model.mark_dirty(self)
 
 
 class ChargingStation(Agent):
@@ -14,13 +74,11 @@ class ChargingStation(Agent):
         super().__init__(unique_id, model)
 
 
-class Cell(Agent):
-    def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
-        self.is_shelf = False
+class Ant(WarehouseAgent):
+    state = Tracked(indexed=True)
+    charge_percentage = Tracked()
+    package = Tracked()
 
-
-class Ant(Agent):
     def __init__(self, unique_id, model):
         super().__init__(unique_id, model)
         self.next_position = None
@@ -29,23 +87,35 @@ class Ant(Agent):
         self.haul_destination_pos = None
         self.has_package = None
         self.package = None
+        self.mission = None
         self.charge_percentage = 100
-        self.target_pos = (1, 1)
-        self.charging_stations = [(46, 8), (46, 9), (46, 10), (46, 11)]
+        self.target_pos = model.layout.home
+        self.charging_stations = model.charging_positions
         self.neighbour_list = list()
 
     def move_to_target_pos(self, neighbour_list):
         if self.target_pos is None:
-            print("No target pos")
+            if ant_trace.warning:
+                ant_trace.emit(WARNING, "no_target", tick=self.model.schedule.steps, id=self.unique_id)
             return
 
+        if self.model.planner is not None:
+            self.model.planner.request(self, self.target_pos, loaded=bool(self.has_package))
+            return
+
+        if self.model.router is not None:
+            next_position = self.model.router.next_hop(self.pos, self.target_pos, loaded=bool(self.has_package))
+            if next_position is not None:
+                self.next_position = next_position
+                return
+
         least_distance_to_target = math.inf
         target_position = self.target_pos
         for neighbour in neighbour_list:
-            distance = math.dist(neighbour.pos, target_position)
+            distance = math.dist(neighbour, target_position)
             if distance < least_distance_to_target:
                 least_distance_to_target = distance
-                self.next_position = neighbour.pos
+                self.next_position = neighbour
 
     def deliver_package(self):
         self.state = 1
@@ -53,242 +123,363 @@ class Ant(Agent):
 
     def charge(self, current_charge):
         self.state = 4
-        self.charge_percentage = min(current_charge + 25, 100)
+        self.charge_percentage = min(current_charge + CHARGE_PER_TICK, 100)
+        self.model.station_ticks += 1
 
-    def step(self):
+    def run_empty(self):
+        # Out of charge off a station: it stays where it is for good, out of any station queue
+        self.next_position = self.pos
+        if self.model.charging is not None:
+            self.model.charging.release(self)
+        if self.model.planner is not None:
+            self.model.planner.block(self)
 
-        neighbours = self.model.grid.get_neighbors(
-            self.pos, moore=True, include_center=True)
-        filtered_neighbours = list()
-        shelve_pos = list()
+    def step(self):
+        if not self.charge_percentage and self.pos not in self.charging_stations:
+            self.run_empty()
+            return
 
-        if self.has_package:
-            for neighbour in neighbours:
-                if isinstance(neighbour, (ChargingStation, Conveyors)):
-                    filtered_neighbours.append(neighbour)
-                if isinstance(neighbour, Cell) and not neighbour.is_shelf:
-                    filtered_neighbours.append(neighbour)
-                if neighbour.pos == self.target_pos:
-                    filtered_neighbours.append(neighbour)
-        else:
-            for neighbour in neighbours:
-                if isinstance(neighbour, (Cell, ChargingStation, Conveyors)):
-                    filtered_neighbours.append(neighbour)
-
-        print(self.state, self.target_pos)
-        print(filtered_neighbours)
-
-        for cell in self.model.grid.coord_iter():
-            cell_content, pos = cell
-            for obj in cell_content:
-                # from receiving conveyor to shelves
-                if isinstance(obj, Conveyors) and obj.pos == self.pos and self.state == 1:
-                    self.target_pos = self.haul_destination_pos
-                    self.state = 3
-                # from shelves and to exit conveyor
-                elif isinstance(obj,
-                                Shelves) and obj.pos == self.pos and self.state == 2 and self.pos == self.target_pos:
-                    self.has_package = True
-                    obj.is_free = True
-                    self.target_pos = self.haul_destination_pos
-                    self.state = 3
-                    self.package.state = 2
-                # leaving at exit conveyor
-                elif isinstance(obj, Conveyors) and obj.pos == self.pos and self.state == 3:
-                    print("exit")
-                    self.state = 0
-                    self.package.state = 3
-                    self.has_package = False
-                    self.target_pos = (1, 0)
-                    self.package = None
-                elif isinstance(obj, Shelves) and obj.pos == self.pos and self.state == 3 and obj.is_free:
-                    obj.is_free = False
-                    obj.is_locked = False
-                    self.state = 0
-                    self.target_pos = (1, 0)
-                    self.has_package = False
-                    self.package.state = 0
-                    self.package.is_locked = False
-                    self.package = None
-
-
-        if self.charge_percentage <= 25 and not self.has_package:
-            self.state = 4
-            self.target_pos = self.charging_stations[random.randint(0, 3)]
-
-        current_cell_content = self.model.grid.get_cell_list_contents(self.pos)
-        for content in current_cell_content:
-            if isinstance(content, Packages) and self.pos == (46, 6):
-                self.package = content
-                self.has_package = True
-            elif isinstance(content, Conveyors) and self.pos == (46, 6):
-                content.has_package = False
-
-        for content in current_cell_content:
-            if isinstance(content, Packages) and self.pos == self.target_pos:
-                self.package = content
-                self.has_package = True
-            elif isinstance(content, Shelves) and self.pos == self.target_pos:
-                content.is_free = True
+        filtered_neighbours = self.model.open_neighbours(self.pos, bool(self.has_package), self.target_pos)
+
+        if ant_trace.debug:
+            ant_trace.emit(DEBUG, "neighbours", tick=self.model.schedule.steps, id=self.unique_id,
+                           state=self.state, target=self.target_pos, neighbours=filtered_neighbours)
+
+        conveyor = self.model.conveyors_by_pos.get(self.pos)
+        shelf = self.model.shelves_by_pos.get(self.pos)
+        # from receiving conveyor to shelves
+        if conveyor is not None and conveyor.state == 1 and self.state == 1:
+            self.target_pos = self.haul_destination_pos
+            self.state = 3
+        # from shelves and to exit conveyor
+        elif shelf is not None and self.state == 2 and self.pos == self.target_pos:
+            self.has_package = True
+            shelf.is_free = True
+            self.target_pos = self.haul_destination_pos
+            self.state = 3
+            self.package.state = 2
+        # leaving at exit conveyor
+        elif conveyor is not None and conveyor.state == 2 and self.state == 3:
+            if ant_trace.info:
+                ant_trace.emit(INFO, "exit", tick=self.model.schedule.steps, id=self.unique_id,
+                               package=self.package.unique_id)
+            self.state = 0
+            self.package.state = 3
+            self.has_package = False
+            self.target_pos = self.model.layout.rest
+            self.package = None
+            self.mission = None
+        elif shelf is not None and self.state == 3 and shelf.is_free:
+            shelf.is_free = False
+            shelf.is_locked = False
+            self.state = 0
+            self.target_pos = self.model.layout.rest
+            self.has_package = False
+            self.package.is_locked = False
+            self.package.state = 0  # CentralSystem takes it into stock on this event
+            self.package = None
+            self.mission = None
+
+        # picking up the assigned package at the entrance conveyor
+        if self.state == 3 and not self.has_package and self.package is not None and self.package.pos == self.pos:
+            self.has_package = True
+            self.package.state = 2
+
+        scheduler = self.model.charging
+        if not self.has_package:
+            if self.charge_percentage <= LOW_CHARGE or \
+                    (scheduler is not None and self.mission is not None and scheduler.needs_charge(self)):
+                if self.mission is not None:
+                    self.model.central_system.requeue(self)
+                self.state = 4
+                if scheduler is not None:
+                    scheduler.request(self)  # keeps the station it is already queued for
+                else:
+                    self.target_pos = self.charging_stations[self.random.randint(0, len(self.charging_stations) - 1)]
+        elif self.state == 3 and scheduler is not None and scheduler.needs_charge(self):
+            # held up too long on a delivery: charges with the package on board, then delivers it
+            scheduler.request(self)
 
         if self.pos not in self.charging_stations:
-            self.charge_percentage -= .25
+            self.charge_percentage = max(self.charge_percentage - DRAIN_PER_TICK, 0)
+            if not self.charge_percentage:
+                if ant_trace.warning:
+                    ant_trace.emit(WARNING, "out_of_charge", tick=self.model.schedule.steps, id=self.unique_id,
+                                   pos=self.pos, state=self.state)
+                self.run_empty()
+                return
+
+        planner = self.model.planner
+        if planner is not None:
+            if self.state == 0 and self.mission is None:
+                self.target_pos = planner.park(self)
+            else:
+                planner.unpark(self)
 
-        print(self.state, self.next_position)
+        self.move_to_target_pos(filtered_neighbours)
 
-        print(self.haul_destination_pos)
+        if ant_trace.debug:
+            ant_trace.emit(DEBUG, "move", tick=self.model.schedule.steps, id=self.unique_id, state=self.state,
+                           pos=self.pos, next=self.next_position, haul_destination=self.haul_destination_pos,
+                           charge=self.charge_percentage)
 
-        self.move_to_target_pos(filtered_neighbours)
+        charging = self.pos in self.charging_stations and (not self.has_package or self.state == 4)
+        if charging and self.model.charging is not None:
+            charging = self.model.charging.can_charge(self)  # its turn at its own station
 
-        if self.pos in self.charging_stations and self.charge_percentage < 99 and not self.has_package:
+        if charging and self.charge_percentage < FULL_CHARGE:
             self.charge(self.charge_percentage)
             self.target_pos = self.pos
+            if self.model.charging is None or self.charge_percentage < FULL_CHARGE:
+                return
+            # a queued station goes to the next robot the tick this one is full
+            self.leave_station()
+            self.move_to_target_pos(filtered_neighbours)
             return
 
-        if self.pos in self.charging_stations and self.charge_percentage >= 99 and not self.has_package:
+        if charging and self.charge_percentage >= FULL_CHARGE:
             self.charge(self.charge_percentage)
-            self.target_pos = (1, 1)
-            self.state = 0
+            self.leave_station()
             return
 
+    def leave_station(self):
+        # Charged: back to the delivery it broke off, or home
+        if self.model.charging is not None:
+            self.model.charging.release(self)
+        if self.has_package:
+            self.target_pos = self.haul_destination_pos
+            self.state = 3
+        else:
+            self.target_pos = self.model.layout.home
+            self.state = 0
+
     def advance(self):
-        self.model.grid.move_agent(self, self.next_position)
+        if self.model.planner is not None:
+            self.next_position = self.model.planner.next_position(self)
+        self.model.move_agent(self, self.next_position)
         if self.has_package == True:
-            self.model.grid.move_agent(self.package, self.next_position)
+            self.model.move_agent(self.package, self.next_position)
+
 
+class Conveyors(WarehouseAgent):
+    has_package = Tracked()
+    state = Tracked()
 
-class Conveyors(Agent):
     def __init__(self, unique_id, model):
         super().__init__(unique_id, model)
         self.has_package = False
         self.state = 0  # 1 Entrance, 2 Exit
 
 
-class Packages(Agent):
-    def __init__(self, unique_id, model):
+class Packages(WarehouseAgent):
+    state = Tracked(indexed=True)
+    is_locked = Tracked()
+
+    def __init__(self, unique_id, model, sku=None):
         super().__init__(unique_id, model)
-        self.sku = unique_id
+        self.sku = unique_id if sku is None else sku
         self.state = 0  # 0: In storage #1: Awaiting pickup #2: In transit #3: Sent
         self.is_locked = False
+        self.created_tick = model.schedule.steps
+
 
+class Shelves(WarehouseAgent):
+    is_free = Tracked(indexed=True)
+    is_locked = Tracked()
 
-class Shelves(Agent):
     def __init__(self, unique_id, model):
         super().__init__(unique_id, model)
         self.is_free = True
         self.is_locked = False
 
 
+class Mission:
+    def __init__(self, kind, package, pickup_pos, destination_pos, created_tick):
+        self.kind = kind  # "inbound": entrance conveyor -> shelf, "outbound": shelf -> exit conveyor
+        self.package = package
+        self.pickup_pos = pickup_pos
+        self.destination_pos = destination_pos  # inbound shelves are only chosen when a robot is matched
+        self.created_tick = created_tick
+
+
 class CentralSystem(Agent):
     def __init__(self, unique_id, model):
         super().__init__(unique_id, model)
         self.package_counter = 0
-        self.entrance_position = (46, 6)
-        self.exit_position = (46, 13)
-
-    def entrance_pos(self):
-        cell_content = self.model.grid.get_cell_list_contents([self.entrance_position])
-        # print(cell_content)
-        for obj in cell_content:
-            if isinstance(obj, Packages) and obj.state == 1:
-                return None
-            if isinstance(obj, Packages) and obj.state == 0:
-                obj.state = 1
-            if isinstance(obj, Conveyors) and obj.state == 1 and obj.has_package:
-                return self.entrance_position
-
-    def find_closest_agent_to_objective(self, objective):
-        least_distance_to_objective = math.inf
-        closest_agent = None
-        for cell in self.model.grid.coord_iter():
-            for obj in cell:
-                for agent in obj:
-                    if isinstance(agent, Ant) and agent.state == 0:
-                        distance_to_objective = math.dist(agent.pos, objective)
-                        if distance_to_objective < least_distance_to_objective:
-                            least_distance_to_objective = distance_to_objective
-                            closest_agent = agent
-        return closest_agent
+        self.entrance_position = model.layout.entrance
+        self.exit_position = model.layout.exit
+        self.missions = deque()  # pending missions, oldest first
+        self.arrivals = {}  # unique_id -> package placed on the entrance conveyor since the last step
+        self.stock_by_sku = defaultdict(dict)  # sku -> {shelf pos: package} stored and not yet ordered
+        self.stock_positions = {}  # shelf pos -> package, the same stock by position
+        self.stock_heap = []  # (-x, -y) of stocked shelves, largest position first; stale entries are skipped
+        self.backorders = defaultdict(int)  # sku -> outbound orders waiting for stock
+        model.events.subscribe(Packages, "pos", self.package_moved)
+        model.events.subscribe(Packages, "state", self.package_state_changed)
+
+    def package_moved(self, package, old, new):
+        if old is None and new == self.entrance_position:
+            self.arrivals[package.unique_id] = package
+
+    def package_state_changed(self, package, old, new):
+        if old == 2 and new == 0:
+            self.stock(package)  # put away on its shelf
 
     def exit_pos(self):
-        for cell in self.model.grid.coord_iter():
-            cell_content, pos = cell
-            for obj in cell_content:
-                if isinstance(obj, Conveyors) and obj.state == 2:
-                    return pos
-
-    def free_shelf(self, entrance):  # This function finds a free space in a shelf for a new package
-
-        neighbours = entrance.model.grid.get_neighbors(
-            entrance.pos, moore=True, include_center=True, radius=50)
-        nearest_neighbour_pos = None
-        least_distance = math.inf
-        for neighbour in neighbours:
-            if isinstance(neighbour, Shelves) and neighbour.is_free:
-                distance = math.dist(neighbour.pos, entrance.pos)
-                if distance < least_distance:
-                    least_distance = distance
-                    nearest_neighbour_pos = neighbour.pos
-        if nearest_neighbour_pos is not None:
-            return nearest_neighbour_pos
-        return None  # If no free spaces are found (make ant stay at rest?)
-
-    def generate_exit_mission_package(self):
-        if self.free_shelf() is None:
-            for cell in self.model.grid.coord_iter():
-                cell_content, pos = cell
-                for obj in cell_content:
-                    if isinstance(obj, Packages):
-                        return pos  # Returns the first free space found
+        for conveyor in self.model.agents_of(Conveyors):
+            if conveyor.state == 2:
+                return conveyor.pos
+
+    def free_shelf(self, package=None):  # Reserves a free shelf for a new package (None when full)
+        return self.model.shelf_allocator.allocate(package)
+
+    def queue_inbound_missions(self):
+        # every package that arrived on the entrance conveyor gets a mission once
+        for package in self.arrivals.values():
+            if not package.is_locked and package.state == 0 and package.pos == self.entrance_position:
+                package.is_locked = True
+                package.state = 1
+                self.missions.append(Mission("inbound", package, self.entrance_position, None,
+                                             self.model.schedule.steps))
+        self.arrivals = {}
+
+    def queue_exit_mission(self):
+        # outbound demand: the stored package on the occupied shelf closest to the exit side
+        if central_trace.debug:
+            central_trace.emit(DEBUG, "exit_candidates", tick=self.model.schedule.steps,
+                               count=len(self.stock_positions))
+        heap = self.stock_heap
+        while heap and (-heap[0][0], -heap[0][1]) not in self.stock_positions:
+            heapq.heappop(heap)
+        if not heap:
+            return
+        package = self.stock_positions[(-heap[0][0], -heap[0][1])]
+        self.unstock(package)
+        self.ship(package)
+
+    def order_outbound(self, sku):
+        # outbound order from the order log: the stored package of that SKU closest to the exit side,
+        # or a backorder filled as soon as one is put away
+        stock = self.stock_by_sku.get(sku)
+        if not stock:
+            self.backorders[sku] += 1
+            return
+        package = stock[max(stock)]
+        self.unstock(package)
+        self.ship(package)
+
+    def ship(self, package):
+        package.is_locked = True
+        self.missions.append(Mission("outbound", package, package.pos, self.exit_position, self.model.schedule.steps))
+
+    def stock(self, package):
+        # a package was put away on its shelf
+        if self.backorders.get(package.sku):
+            self.backorders[package.sku] -= 1
+            if not self.backorders[package.sku]:
+                del self.backorders[package.sku]
+            self.ship(package)
+        else:
+            pos = package.pos
+            self.stock_by_sku[package.sku][pos] = package
+            self.stock_positions[pos] = package
+            heapq.heappush(self.stock_heap, (-pos[0], -pos[1]))
+            if len(self.stock_heap) > 4 * len(self.stock_positions) + 64:
+                self.stock_heap = [(-x, -y) for x, y in self.stock_positions]  # drop stale entries
+                heapq.heapify(self.stock_heap)
+
+    def unstock(self, package):
+        stock = self.stock_by_sku.get(package.sku)
+        if stock is not None and stock.get(package.pos) is package:
+            del stock[package.pos]
+            del self.stock_positions[package.pos]
+            if not stock:
+                del self.stock_by_sku[package.sku]
+
+    def requeue(self, ant):
+        # a robot dropped its mission before picking the package up (e.g. to recharge)
+        mission = ant.mission
+        if mission.kind == "inbound" and mission.destination_pos is not None:
+            self.model.shelf_allocator.release(mission.destination_pos)
+            mission.destination_pos = None
+        ant.mission = None
+        ant.package = None
+        self.missions.appendleft(mission)
+
+    def travel_cost(self, pos, target, loaded=False):
+        if self.model.router is not None:
+            distance = self.model.router.distance(pos, target, loaded)
+            return distance if distance >= 0 else UNREACHABLE_COST
+        return max(abs(pos[0] - target[0]), abs(pos[1] - target[1]))
+
+    def assign_missions(self):
+        # Optimal matching of the oldest pending missions to idle robots, minimising total travel to pickup
+        idle = [ant for ant in self.model.agents_with(Ant, "state", 0) if ant.charge_percentage > LOW_CHARGE]
+        slots = len(idle)
+        if self.model.planner is not None:
+            # Robots can't share squares: past what the conveyors can serve, more robots on missions just
+            # queue around them and lock up everyone else, the ones on their way to charge included
+            busy = sum(len(self.model.agents_by_state[(Ant, "state", state)]) for state in (1, 2, 3))
+            slots = min(slots, MAX_ACTIVE_MISSIONS - busy)
+        if slots <= 0 or not self.missions:
+            if self.missions and central_trace.info:
+                central_trace.emit(INFO, "no_idle_ant", tick=self.model.schedule.steps, pending=len(self.missions))
+            return
+        batch = [self.missions[i] for i in range(min(MISSION_BATCH, len(self.missions)))]
+        cost = [[self.mission_cost(ant, mission) for ant in idle] for mission in batch]
+        charging = self.model.charging
+
+        assigned = set()
+        for row, col in solve_assignment(cost):
+            if len(assigned) == slots:
+                break
+            mission, ant = batch[row], idle[col]
+            if cost[row][col] >= UNREACHABLE_COST:
+                continue
+            if mission.kind == "inbound":
+                mission.destination_pos = self.free_shelf(mission.package)
+                if mission.destination_pos is None:
+                    continue  # warehouse full: keep it queued
+                if charging is not None and not charging.mission_fits(ant, mission.pickup_pos,
+                                                                      mission.destination_pos):
+                    self.model.shelf_allocator.release(mission.destination_pos)
+                    mission.destination_pos = None
+                    charging.request(ant)
+                    continue
+                ant.state = 1
+            else:
+                ant.state = 2
+            ant.target_pos = mission.pickup_pos
+            ant.haul_destination_pos = mission.destination_pos
+            ant.package = mission.package
+            ant.mission = mission
+            assigned.add(id(mission))
+        if assigned:
+            self.missions = deque(mission for mission in self.missions if id(mission) not in assigned)
+        if charging is not None:
+            # low robots that none of the waiting missions fit charge now instead of idling
+            for col, ant in enumerate(idle):
+                if ant.state == 0 and ant.charge_percentage < TOP_UP_CHARGE and \
+                        all(row[col] >= UNREACHABLE_COST for row in cost):
+                    charging.request(ant)
+
+    def mission_cost(self, ant, mission):
+        # Travel to the pickup, or UNREACHABLE_COST when the robot's charge can't see the mission through
+        charging = self.model.charging
+        if charging is not None and not charging.mission_fits(ant, mission.pickup_pos, mission.destination_pos):
+            return UNREACHABLE_COST
+        return self.travel_cost(ant.pos, mission.pickup_pos)
 
     def step(self):
-        # creates mission for entry conveyor
-        # print(self.entrance_pos())
-        if self.entrance_pos() is not None:
-            for obj in self.model.grid.get_cell_list_contents((46, 6)):
-                if isinstance(obj, Packages):
-                    entrance_package = obj
-                if isinstance(obj, Conveyors) and obj.state == 1:
-                    entrance_conveyor = obj
-            if not entrance_package.is_locked:
-                closest_ant = self.find_closest_agent_to_objective(self.entrance_pos())
-                if closest_ant is not None:
-                    closest_ant.state = 1
-                    closest_ant.target_pos = self.entrance_pos()
-                    posdest = self.free_shelf(entrance_conveyor)
-                    destination = self.model.grid.get_cell_list_contents(posdest)
-                    for contents in destination:
-                        if isinstance(contents, Shelves):
-                            contents.is_locked = True
-                    closest_ant.haul_destination_pos = posdest
-                    entrance_package.is_locked = True
-                else:
-                    print("no ant found")
-
-        exit_mission_pos = 0
-        paquete = None
-
-        for cell in self.model.grid.coord_iter():
-            cell_content, pos = cell
-            for obj in cell_content:
-                if isinstance(obj, Shelves) and not obj.is_free:
-                    exit_mission_pos = obj.pos
-
-                if isinstance(obj, Packages):
-                    paquete = obj
-        # creates package exit mission
-        chance = random.randint(1, 100)
-        print(exit_mission_pos)
-        if exit_mission_pos != 0 and not paquete.is_locked and chance < 75:
-            package_pos = exit_mission_pos
-            closest_ant = self.find_closest_agent_to_objective(package_pos)
-            if closest_ant is not None:
-                closest_ant.state = 2
-                closest_ant.target_pos = package_pos
-                closest_ant.haul_destination_pos = self.exit_position
-                closest_ant.package = paquete
-                paquete.is_locked = True
-
+        self.queue_inbound_missions()
+        # creates package exit mission (with an order log, outbound orders do that instead)
+        if self.model.orders is None:
+            chance = self.random.randint(1, 100)
+            if chance < 75:
+                self.queue_exit_mission()
+        self.assign_missions()
+        if self.model.charging is not None:
+            self.model.charging.step()
 
 
 class Warehouse(Model):
@@ -296,213 +487,426 @@ class Warehouse(Model):
                  num_agentes: int = 1,
                  porc_shelves: float = 0.2,
                  modo_pos_inicial: str = 'Fija',
+                 modo_ruteo: str = 'Corta',
+                 modo_carga: str = 'Cola',
+                 muestreo: int = 10,
+                 max_muestras: int = 1000,
+                 tasa_llegada: float = 0.14,
+                 seed=None,
+                 slotting_policy=None,
+                 layout=None,
+                 layout_cache=None,
+                 orders=None,
+                 recording=None,
                  ):
+        # layout: a layouts.Layout or the path of a layout file (its size overrides M and N);
+        # None keeps the built-in warehouse. layout_cache: directory for precompiled routing tables.
+        # orders: an order log path (see orders.py) or an iterator of orders.Order replacing the random
+        # arrivals and outbound demand; only logs read from a file survive a checkpoint.
+        # recording: a trajectory log path or recording.TrajectoryRecorder that every tick is appended to.
+        if layout is None:
+            layout = default_layout(M, N)
+        else:
+            if isinstance(layout, str):
+                layout = load_layout(layout)
+            M, N = layout.width, layout.height
+        if num_agentes < 1:
+            raise ValueError("num_agentes must be at least 1")
+        if not 0 <= tasa_llegada <= 1:
+            raise ValueError("tasa_llegada must be between 0 and 1")
+        if muestreo < 1:
+            raise ValueError("muestreo must be at least 1")
+        if max_muestras < 1:
+            raise ValueError("max_muestras must be at least 1")
+        for name, value, choices in (("modo_pos_inicial", modo_pos_inicial, MODOS_POS_INICIAL),
+                                     ("modo_ruteo", modo_ruteo, MODOS_RUTEO),
+                                     ("modo_carga", modo_carga, MODOS_CARGA)):
+            if value not in choices:
+                raise ValueError(f"{name} must be one of {', '.join(choices)}, not {value!r}")
+        for pos in (layout.entrance, layout.exit, layout.home, layout.rest):
+            if not (0 <= pos[0] < M and 0 <= pos[1] < N):
+                raise ValueError(f"a {M}x{N} grid does not reach the conveyor or home square at {pos}")
+        self.layout = layout
+        self.charging_positions = []
 
         self.entrance_conveyor = None
         self.num_agentes = num_agentes
         self.porc_shelves = porc_shelves
+        self.router = None
+        self.planner = None
+        self.charging = None
+        self.shelf_allocator = None
+        self.seed = seed  # mesa's Model.__new__ has already seeded self.random with it; all draws go through it
+        self.tasa_llegada = tasa_llegada  # chance of a new package at the entrance conveyor each tick
+        if isinstance(orders, str):
+            orders = OrderLog(orders)
+        self.orders = OrderStream(orders) if orders is not None else None
+
+        # Running KPI totals
+        self.delivered_packages = 0
+        self.total_delivery_latency = 0  # ticks from arrival at the entrance to leaving on the exit conveyor
+        self.busy_robot_ticks = 0  # robot-ticks spent on a mission (states 1-3)
+        self.energy_used = 0.0  # charge percentage points consumed by the whole fleet
+        self.charging_robot_ticks = 0  # robot-ticks on the way to, queued at or charging at a station
+        self.station_ticks = 0  # station-ticks with a robot charging
+
+        # Change tracking for delta state updates: agents touched during the current tick,
+        # then one (tick, changed, removed) entry per finished tick
+        self.dirty_agents = {}
+        self.removed_agents = {}
+        self.change_log = deque(maxlen=CHANGE_HISTORY)
+
+        # Live indexes, kept current by place_agent/move_agent/remove_agent and Tracked attributes
+        self.agents_by_type = defaultdict(dict)  # type -> {unique_id: agent}
+        self.agents_by_state = defaultdict(dict)  # (type, field, value) -> {unique_id: agent}
+        self.shelves_by_pos = {}
+        self.conveyors_by_pos = {}
+        self.packages_by_pos = defaultdict(dict)  # pos -> {unique_id: package}
+
+        # State transitions of Tracked attributes and agent placement/removal are published here (see
+        # events.py); the model, the central system, the shelf allocator and the ledger subscribe
+        self.events = EventBus()
+        self.shipped = {}  # unique_id -> package handed to the exit conveyor, removed next step
+        self.events.subscribe(Packages, "pos", self._package_moved)
+        self.events.subscribe(Packages, "state", self._package_state_changed)
+        self.ledger = PackageLedger(self, self.events, Packages)  # phase timestamps per package
 
         self.grid = MultiGrid(M, N, False)
+        self.layers = OccupancyLayers(M, N)
+        # Static floor map (FLOOR_* codes): what each square is, without one agent per square
+        self.floor = np.full((M, N), FLOOR_AISLE, dtype=np.int8)
+        # Fixed-layout records for the binary state format; packages get a numeric serial id there
+        self.robot_table = AgentTable(ROBOT_DTYPE, capacity=max(num_agentes, 1))
+        self.package_table = AgentTable(PACKAGE_DTYPE)
+        self.package_serial = 0
         self.schedule = SimultaneousActivation(self)
 
         central_system = CentralSystem(unique_id="central_system", model=self)
         self.schedule.add(central_system)
-
-        posiciones_disponibles = [pos for _, pos in self.grid.coord_iter()]
-
-        uniqueID = 0
-
-        for (idc, pos) in enumerate(posiciones_disponibles):
-            cell = Cell(int(f"{num_agentes}{idc}") + 1, self)
-            uniqueID += 1
-            self.grid.place_agent(cell, pos)
-            self.schedule.add(cell)
+        self.central_system = central_system
 
         entrance_conveyor = Conveyors(int(f"{num_agentes}") + 1, self)
-        self.grid.place_agent(entrance_conveyor, (46, 6))  # Bottom left
+        self.place_agent(entrance_conveyor, layout.entrance)
         entrance_conveyor.state = 1  # Entrance conveyor
-        uniqueID += 1
         self.schedule.add(entrance_conveyor)
-        entrance_conveyor.has_package = True
         self.entrance_conveyor = entrance_conveyor
 
-        sample_package = Packages(uniqueID, model=self)
-        self.grid.place_agent(sample_package, (46, 6))
-        uniqueID += 1
-        self.schedule.add(sample_package)
+        if self.orders is None:
+            sample_package = Packages(f"package_{self.package_serial}", model=self)
+            self.place_agent(sample_package, layout.entrance)
+            self.schedule.add(sample_package)
 
         exit_conveyor = Conveyors(unique_id="exit_conveyor", model=self)
         exit_conveyor.state = 2  # Exit conveyor
-        self.grid.place_agent(exit_conveyor, (46, 13))  # Top right
-        uniqueID += 1
+        self.place_agent(exit_conveyor, layout.exit)
         self.schedule.add(exit_conveyor)
 
 
-        posiciones_estaciones = [(46, 8), (46, 9), (46, 10), (46, 11)]
-        for id, pos in enumerate(posiciones_estaciones):
+        for id, pos in enumerate(layout.chargers):
             x, y = pos
             if x < 0 or x >= M or y < 0 or y >= N:
-                print(f"ChargingStation position {pos} is out of grid dimensions.")
+                if warehouse_trace.warning:
+                    warehouse_trace.emit(WARNING, "out_of_grid", agent="ChargingStation", pos=pos)
                 continue
 
 
-            if pos not in posiciones_disponibles:
-                print(f"ChargingStation position {pos} is not available in posiciones_disponibles.")
+            if self.floor[pos] in (FLOOR_SHELF, FLOOR_CHARGER):
+                if warehouse_trace.warning:
+                    warehouse_trace.emit(WARNING, "position_taken", agent="ChargingStation", pos=pos)
                 continue
 
             estacion = ChargingStation(int(f"{num_agentes}0{id}") + 1, self)
-            self.grid.place_agent(estacion, pos)
-            uniqueID += 1
-            posiciones_disponibles.remove(pos)
-
-
-        num_shelves = 5
-
-        posiciones_shelves = [(2, 3), (2, 4), (2, 5), (2, 6), (2, 7), (2, 8), (2, 9), (2, 10), (2, 11), (2, 12),
-                              (2, 13), (2, 14), (2, 15), (2, 16),
-                              # (3,3), (3,4), (3,5), (3,6), (3,7), (3,8), (3,9), (3,10), (3,11), (3,12), (3,13), (3,14), (3,15), (3,16),
-                              (6, 3), (6, 4), (6, 5), (6, 6), (6, 7), (6, 8), (6, 9), (6, 10), (6, 11), (6, 12),
-                              (6, 13), (6, 14), (6, 15), (6, 16),
-                              # (7, 3), (7, 4), (7, 5), (7, 6), (7, 7), (7, 8), (7, 9), (7, 10), (7, 11), (7, 12),
-                              # (7, 13), (7, 14), (7, 15), (7, 16),
-                              (10, 3), (10, 4), (10, 5), (10, 6), (10, 7), (10, 8), (10, 9), (10, 10), (10, 11),
-                              (10, 12),
-                              (10, 13), (10, 14), (10, 15), (10, 16),
-                              # (11, 3), (11, 4), (11, 5), (11, 6), (11, 7), (11, 8), (11, 9), (11, 10), (11, 11),
-                              # (11, 12),
-                              # (11, 13), (11, 14), (11, 15), (11, 16),
-                              (14, 3), (14, 4), (14, 5), (14, 6), (14, 7), (14, 8), (14, 9), (14, 10), (14, 11),
-                              (14, 12),
-                              (14, 13), (14, 14), (14, 15), (14, 16),
-                              # (15, 3), (15, 4), (15, 5), (15, 6), (15, 7), (15, 8), (15, 9), (15, 10), (15, 11),
-                              # (15, 12),
-                              # (15, 13), (15, 14), (15, 15), (15, 16),
-                              (18, 3), (18, 4), (18, 5), (18, 6), (18, 7), (18, 8), (18, 9), (18, 10), (18, 11),
-                              (18, 12),
-                              (18, 13), (18, 14), (18, 15), (18, 16),
-                              # (19, 3), (19, 4), (19, 5), (19, 6), (19, 7), (19, 8), (19, 9), (19, 10), (19, 11),
-                              # (19, 12),
-                              # (19, 13), (19, 14), (19, 15), (19, 16),
-                              (22, 3), (22, 4), (22, 5), (22, 6), (22, 7), (22, 8), (22, 9), (22, 10), (22, 11),
-                              (22, 12),
-                              (22, 13), (22, 14), (22, 15), (22, 16),
-                              # (23, 3), (23, 4), (23, 5), (23, 6), (23, 7), (23, 8), (23, 9), (23, 10), (23, 11),
-                              # (23, 12),
-                              # (23, 13), (23, 14), (23, 15), (23, 16),
-                              (26, 3), (26, 4), (26, 5), (26, 6), (26, 7), (26, 8), (26, 9), (26, 10), (26, 11),
-                              (26, 12),
-                              (26, 13), (26, 14), (26, 15), (26, 16),
-                              # (27, 3), (27, 4), (27, 5), (27, 6), (27, 7), (27, 8), (27, 9), (27, 10), (27, 11),
-                              # (27, 12),
-                              # (27, 13), (27, 14), (27, 15), (27, 16),
-                              (30, 3), (30, 4), (30, 5), (30, 6), (30, 7), (30, 8), (30, 9), (30, 10), (30, 11),
-                              (30, 12),
-                              (30, 13), (30, 14), (30, 15), (30, 16),
-                              # (31, 3), (31, 4), (31, 5), (31, 6), (31, 7), (31, 8), (31, 9), (31, 10), (31, 11),
-                              # (31, 12),
-                              # (31, 13), (31, 14), (31, 15), (31, 16),
-                              (34, 3), (34, 4), (34, 5), (34, 6), (34, 7), (34, 8), (34, 9), (34, 10), (34, 11),
-                              (34, 12),
-                              (34, 13), (34, 14), (34, 15), (34, 16),
-                              # (35, 3), (35, 4), (35, 5), (35, 6), (35, 7), (35, 8), (35, 9), (35, 10), (35, 11),
-                              # (35, 12),
-                              # (35, 13), (35, 14), (35, 15), (35, 16),
-                              (38, 3), (38, 4), (38, 5), (38, 6), (38, 7), (38, 8), (38, 9), (38, 10), (38, 11),
-                              (38, 12),
-                              (38, 13), (38, 14), (38, 15), (38, 16),
-                              # (39, 3), (39, 4), (39, 5), (39, 6), (39, 7), (39, 8), (39, 9), (39, 10), (39, 11),
-                              # (39, 12),
-                              # (39, 13), (39, 14), (39, 15), (39, 16),
-                              (42, 3), (42, 4), (42, 5), (42, 6), (42, 7), (42, 8), (42, 9), (42, 10), (42, 11),
-                              (42, 12),
-                              (42, 13), (42, 14), (42, 15), (42, 16),
-                              # (43, 3), (43, 4), (43, 5), (43, 6), (43, 7), (43, 8), (43, 9), (43, 10), (43, 11),
-                              # (43, 12),
-                              # (43, 13), (43, 14), (43, 15), (43, 16),
-                              (0, 0), (1, 0), (2, 0), (3, 0), (4, 0), (5, 0), (6, 0), (7, 0), (8, 0), (9, 0), (10, 0),
-                              (11, 0), (12, 0), (13, 0), (14, 0), (15, 0), (16, 0), (17, 0), (18, 0), (19, 0), (20, 0),
-                              (21, 0), (22, 0), (23, 0), (24, 0), (25, 0), (26, 0), (27, 0), (28, 0), (29, 0), (30, 0),
-                              (31, 0), (32, 0), (33, 0), (34, 0),
-                              (35, 0), (36, 0), (37, 0), (38, 0), (39, 0), (40, 0), (41, 0), (42, 0), (43, 0), (44, 0),
-                              (45, 0), (46, 0),
-                              (0, 19), (1, 19), (2, 19), (3, 19), (4, 19), (5, 19), (6, 19), (7, 19), (8, 19), (9, 19),
-                              (10, 19),
-                              (11, 19), (12, 19), (13, 19), (14, 19), (15, 19), (16, 19), (17, 19), (18, 19), (19, 19),
-                              (20, 19),
-                              (21, 19), (22, 19), (23, 19), (24, 19), (25, 19), (26, 19), (27, 19), (28, 19), (29, 19),
-                              (30, 19),
-                              (31, 19), (32, 19), (33, 19), (34, 19),
-                              (35, 19), (36, 19), (37, 19), (38, 19), (39, 19), (40, 19), (41, 19), (42, 19), (43, 19),
-                              (44, 19),
-                              (45, 19), (46, 19),
-                              ]
-
-        for id, pos in enumerate(posiciones_shelves):
+            self.place_agent(estacion, pos)
+            self.charging_positions.append(pos)
+
+        for id, pos in enumerate(layout.shelves):
             x, y = pos
             if x < 0 or x >= M or y < 0 or y >= N:
-                print(f"ChargingStation position {pos} is out of grid dimensions.")
+                if warehouse_trace.warning:
+                    warehouse_trace.emit(WARNING, "out_of_grid", agent="Shelves", pos=pos)
                 continue
 
 
-            if pos not in posiciones_disponibles:
-                print(f"ChargingStation position {pos} is not available in posiciones_disponibles.")
+            if self.floor[pos] in (FLOOR_SHELF, FLOOR_CHARGER):
+                if warehouse_trace.warning:
+                    warehouse_trace.emit(WARNING, "position_taken", agent="Shelves", pos=pos)
                 continue
 
             shelf = Shelves(int(f"{num_agentes}0{id}") + 1, self)
-            self.grid.place_agent(shelf, pos)
+            self.place_agent(shelf, pos)
             self.schedule.add(shelf)
-            contents = self.grid.get_cell_list_contents(pos)
-            for content in contents:
-                if isinstance(content, Cell):
-                    content.is_shelf = True
-            uniqueID += 1
-            posiciones_disponibles.remove(pos)
+
+        # 'Corta': shortest paths over the floor, 'Voraz': greedy step towards the target,
+        # 'Reservas': shortest paths that reserve space-time cells so robots never collide
+        if modo_ruteo in ('Corta', 'Reservas'):
+            self.router = Router(self)
+        if modo_ruteo == 'Reservas':
+            self.planner = ReservationPlanner(self, Ant)
+        if self.router is not None and layout_cache is not None:
+            key_points = [layout.entrance, layout.exit, *self.charging_positions, layout.home, layout.rest]
+            targets = table_targets(self.floor, key_points, list(self.shelves_by_pos))
+            self.router.load_tables(compile_tables(self.floor, targets, layout_cache))
+
+        # Free shelves ranked by the slotting policy (default: shortest path from the entrance conveyor)
+        self.shelf_allocator = ShelfAllocator(self, slotting_policy or NearestEntrancePolicy())
+        self.events.subscribe(Shelves, "is_free", self.shelf_allocator.shelf_changed)
+        self.events.subscribe(Shelves, "is_locked", self.shelf_allocator.shelf_changed)
+
+        # 'Cola': stations serve one robot at a time from a queue, picked by expected start of charging,
+        # and missions go only to robots with the charge to finish them (see charging.py);
+        # 'Aleatoria': low robots head for a random station, where any number of them charge at once
+        if modo_carga == 'Cola':
+            self.charging = ChargingScheduler(self, self.charging_positions, Ant)
 
         # Posicionamiento de agentes
         if modo_pos_inicial == 'Aleatoria':
+            posiciones_disponibles = [tuple(pos) for pos in np.argwhere(
+                (self.floor != FLOOR_SHELF) & (self.floor != FLOOR_CHARGER)).tolist()]
             pos_inicial_robots = self.random.sample(posiciones_disponibles, k=num_agentes)
         else:  # 'Fija'
-            pos_inicial_robots = [(1, 1)] * num_agentes
+            pos_inicial_robots = [layout.home] * num_agentes
 
         for id in range(num_agentes):
             robot = Ant(id, self)
-            self.grid.place_agent(robot, pos_inicial_robots[id])
-            uniqueID += 1
+            self.place_agent(robot, pos_inicial_robots[id])
             self.schedule.add(robot)
             robot.state = 0
 
-        self.datacollector = DataCollector(
-            model_reporters={"Grid": get_grid},
+        # Grid snapshots every `muestreo` ticks, keeping only the last `max_muestras`
+        self.datacollector = SnapshotCollector(
+            model_reporters={"Grid": get_grid}, every=muestreo, maxlen=max_muestras,
         )
 
-    def step(self):
-        chance = random.randint(1, 100)
-        chanceID = random.randint(1, 1000000)
-        if chance < 15:
-            sample_package = Packages(f"package_{chanceID}", model=self)
-            self.grid.place_agent(sample_package, (46, 6))
-            self.schedule.add(sample_package)
-            self.entrance_conveyor.has_package = True
+        self.recorder = TrajectoryRecorder(recording) if isinstance(recording, str) else recording
+        if self.recorder is not None:
+            self.recorder.record(self)
 
-        for cell in self.grid.coord_iter():
-            cell_content, pos = cell
-            for obj in cell_content:
-                if isinstance(obj, Packages) and obj.state == 3:
-                    print("remove")
-                    self.grid.remove_agent(obj)
-                    self.schedule.remove(obj)
+    def step(self):
+        if self.orders is not None:
+            for order in self.orders.due(self.schedule.steps):
+                if order.kind == "inbound":
+                    sample_package = Packages(f"package_{self.package_serial}", model=self, sku=order.sku)
+                    self.place_agent(sample_package, self.layout.entrance)
+                    self.schedule.add(sample_package)
+                else:
+                    self.central_system.order_outbound(order.sku)
+        else:
+            chance = self.random.random()
+            if chance < self.tasa_llegada:
+                sample_package = Packages(f"package_{self.package_serial}", model=self)
+                self.place_agent(sample_package, self.layout.entrance)
+                self.schedule.add(sample_package)
+
+        shipped, self.shipped = self.shipped, {}
+        for obj in shipped.values():
+            if warehouse_trace.info:
+                warehouse_trace.emit(INFO, "remove_package", tick=self.schedule.steps, package=obj.unique_id)
+            self.remove_agent(obj)
+            self.schedule.remove(obj)
+            self.delivered_packages += 1
+            self.total_delivery_latency += self.schedule.steps - obj.created_tick
 
         self.datacollector.collect(self)
         self.schedule.step()
+        self.busy_robot_ticks += sum(len(self.agents_by_state[(Ant, "state", state)]) for state in (1, 2, 3))
+        self.charging_robot_ticks += len(self.agents_by_state[(Ant, "state", 4)])
+
+        self.change_log.append((self.schedule.steps, self.dirty_agents, self.removed_agents))
+        self.dirty_agents = {}
+        self.removed_agents = {}
+        if self.recorder is not None:
+            self.recorder.record(self)
+
+    def save_checkpoint(self, path):
+        # Whole model (grid, schedule, indexes, RNG state, package lifecycle) as a gzipped pickle.
+        # Cached routing tables are left out and rebuilt on demand.
+        with gzip.open(path, "wb", compresslevel=3) as f:
+            pickle.dump({"version": CHECKPOINT_VERSION, "model": self}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load_checkpoint(cls, path, seed=None, recording=None):
+        # Pass a seed to branch a what-if run from the checkpoint with its own random stream. A model that
+        # was being recorded needs a new trajectory log path, so the branch can't overwrite the parent's log.
+        with gzip.open(path, "rb") as f:
+            checkpoint = pickle.load(f)
+        if checkpoint.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version {checkpoint.get('version')}")
+        model = checkpoint["model"]
+        if model.recorder is not None:
+            if recording is None:
+                raise ValueError("The checkpointed model was being recorded: pass a new recording path")
+            if os.path.abspath(recording) == os.path.abspath(model.recorder.path):
+                raise ValueError(f"{recording} is the checkpointed run's own trajectory log")
+        if seed is not None:
+            model.reset_randomizer(seed)
+        if recording is not None:
+            model.recorder = TrajectoryRecorder(recording)
+            model.recorder.record(model)
+        return model
+
+    def _package_moved(self, package, old, new):
+        conveyor = self.conveyors_by_pos.get(new)
+        if old is None and conveyor is not None:
+            conveyor.has_package = True
+
+    def _package_state_changed(self, package, old, new):
+        if new == 3:
+            self.shipped[package.unique_id] = package
+        elif new == 2 and old == 1:
+            # collected from the entrance conveyor: anything else still waiting there?
+            conveyor = self.conveyors_by_pos.get(package.pos)
+            if conveyor is not None:
+                conveyor.has_package = any(other is not package and not other.is_locked
+                                           for other in self.packages_by_pos.get(package.pos, {}).values())
+
+    def mark_dirty(self, agent):
+        self.dirty_agents[agent.unique_id] = agent
+
+    def changes_since(self, tick):
+        # Agents changed and ids removed after `tick`, or None when `tick` is older than the kept history
+        if tick >= self.schedule.steps:
+            return [], []
+        if not self.change_log or tick < self.change_log[0][0] - 1:
+            return None
+        changed = {}
+        removed = {}
+        for entry_tick, dirty, gone in self.change_log:
+            if entry_tick <= tick:
+                continue
+            changed.update(dirty)
+            for unique_id in gone:
+                changed.pop(unique_id, None)
+                removed[unique_id] = None
+        return list(changed.values()), list(removed)
+
+    def open_neighbours(self, pos, loaded=False, target=None):
+        # Squares a robot at pos may move to next (staying put included); loaded robots keep off
+        # shelves other than their target
+        x, y = pos
+        width, height = self.floor.shape
+        neighbours = []
+        for dx, dy in NEIGHBOURHOOD:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < width and 0 <= ny < height:
+                if not loaded or self.floor[nx, ny] != FLOOR_SHELF or (nx, ny) == target:
+                    neighbours.append((nx, ny))
+        return neighbours
+
+    def agents_of(self, agent_type):
+        return self.agents_by_type[agent_type].values()
+
+    def agents_with(self, agent_type, field, value):
+        return self.agents_by_state[(agent_type, field, value)].values()
+
+    def place_agent(self, agent, pos):
+        self.grid.place_agent(agent, pos)
+        agent_type = type(agent)
+        self.agents_by_type[agent_type][agent.unique_id] = agent
+        for field, value in self._indexed_fields(agent):
+            self.agents_by_state[(agent_type, field, value)][agent.unique_id] = agent
+        if isinstance(agent, Ant):
+            self.robot_table.add(agent.unique_id, id=agent.unique_id, state=agent.state,
+                                 charge=agent.charge_percentage, package=self._package_id(agent.package))
+        elif isinstance(agent, Packages):
+            self.package_table.add(agent.unique_id, id=self.package_serial, state=agent.state)
+            self.package_serial += 1
+        self._index_pos(agent)
+        self.events.emit(agent_type, "pos", agent, None, agent.pos)
+
+    def move_agent(self, agent, pos):
+        self._unindex_pos(agent)
+        self.grid.move_agent(agent, pos)
+        self._index_pos(agent)
+
+    def remove_agent(self, agent):
+        pos = agent.pos
+        self._unindex_pos(agent)
+        self.grid.remove_agent(agent)
+        self.dirty_agents.pop(agent.unique_id, None)
+        self.removed_agents[agent.unique_id] = None
+        agent_type = type(agent)
+        self.agents_by_type[agent_type].pop(agent.unique_id, None)
+        for field, value in self._indexed_fields(agent):
+            self.agents_by_state[(agent_type, field, value)].pop(agent.unique_id, None)
+        if isinstance(agent, Ant):
+            self.robot_table.remove(agent.unique_id)
+        elif isinstance(agent, Packages):
+            self.package_table.remove(agent.unique_id)
+        self.events.emit(agent_type, "pos", agent, pos, None)
+
+    def agent_changed(self, agent, field, old, new):
+        agent_type = type(agent)
+        if agent.unique_id not in self.agents_by_type[agent_type]:
+            return  # not placed yet (or already removed)
+        if getattr(agent_type, field).indexed:
+            self.agents_by_state[(agent_type, field, old)].pop(agent.unique_id, None)
+            self.agents_by_state[(agent_type, field, new)][agent.unique_id] = agent
+        if agent_type is Shelves:
+            if field == "is_free":
+                self.layers.set_shelf(agent.pos, new)
+        elif field == "charge_percentage":
+            if new < old:
+                self.energy_used += old - new
+            self.layers.update_charge(agent.pos, old, new)
+            self.robot_table.set(agent.unique_id, "charge", new)
+        elif field == "package":
+            self.robot_table.set(agent.unique_id, "package", self._package_id(new))
+        elif field == "state" and agent_type is Ant:
+            self.robot_table.set(agent.unique_id, "state", new)
+        elif field == "state" and agent_type is Packages:
+            self.package_table.set(agent.unique_id, "state", new)
+        self.events.emit(agent_type, field, agent, old, new)
+
+    def _package_id(self, package):
+        if package is None or package.unique_id not in self.package_table.rows:
+            return NO_PACKAGE
+        return self.package_table.get(package.unique_id, "id")
+
+    @staticmethod
+    def _indexed_fields(agent):
+        for field, attr in vars(type(agent)).items():
+            if isinstance(attr, Tracked) and attr.indexed:
+                yield field, getattr(agent, field)
+
+    def _index_pos(self, agent):
+        if isinstance(agent, Ant):
+            self.layers.add_robot(agent.pos, agent.charge_percentage)
+            self.robot_table.set_pos(agent.unique_id, agent.pos)
+        elif isinstance(agent, Shelves):
+            self.shelves_by_pos[agent.pos] = agent
+            self.layers.set_shelf(agent.pos, agent.is_free)
+            self.floor[agent.pos] = FLOOR_SHELF
+        elif isinstance(agent, Conveyors):
+            self.conveyors_by_pos[agent.pos] = agent
+            self.floor[agent.pos] = FLOOR_CONVEYOR
+        elif isinstance(agent, ChargingStation):
+            self.floor[agent.pos] = FLOOR_CHARGER
+        elif isinstance(agent, Packages):
+            self.packages_by_pos[agent.pos][agent.unique_id] = agent
+            self.layers.add_package(agent.pos)
+            self.package_table.set_pos(agent.unique_id, agent.pos)
+
+    def _unindex_pos(self, agent):
+        if isinstance(agent, Ant):
+            self.layers.remove_robot(agent.pos, agent.charge_percentage)
+        elif isinstance(agent, Shelves):
+            self.shelves_by_pos.pop(agent.pos, None)
+            self.layers.clear_shelf(agent.pos)
+            self.floor[agent.pos] = FLOOR_AISLE
+        elif isinstance(agent, Conveyors):
+            self.conveyors_by_pos.pop(agent.pos, None)
+            self.floor[agent.pos] = FLOOR_AISLE
+        elif isinstance(agent, ChargingStation):
+            self.floor[agent.pos] = FLOOR_AISLE
+        elif isinstance(agent, Packages):
+            packages = self.packages_by_pos.get(agent.pos)
+            if packages is not None:
+                packages.pop(agent.unique_id, None)
+                if not packages:
+                    del self.packages_by_pos[agent.pos]
+            self.layers.remove_package(agent.pos)
 
 
 def get_grid(model: Model) -> np.ndarray:
-
-    grid = np.zeros((model.grid.width, model.grid.height))
-    for cell in model.grid.coord_iter():
-        cell_content, pos = cell
-        x, y = pos
-        for obj in cell_content:
-            if isinstance(obj, Ant):
-                grid[x][y] = 2
-    return grid
\ No newline at end of file
+    # Built from the robots layer instead of walking every cell
+    return np.where(model.layers.robots > 0, 2.0, 0.0)
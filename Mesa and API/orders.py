@@ -0,0 +1,155 @@
+import argparse
+import csv
+import gzip
+import json
+import random
+from collections import namedtuple
+from datetime import datetime
+
+# Order logs drive Warehouse arrivals and demand instead of the random coin flips. One order per line,
+# sorted by time, as CSV with a header row or as JSON lines (either may be gzipped, *.gz):
+#     tick,type,sku                {"tick": 12, "type": "outbound", "sku": "A-113"}
+#     12,inbound,A-113
+# type is inbound/in (a package of that SKU arrives at the entrance conveyor) or outbound/out (one unit of
+# that SKU is to be shipped). Instead of tick a line may have a timestamp, in epoch seconds or ISO 8601;
+# the first one is tick 0 and segundos_por_tick converts the rest.
+
+Order = namedtuple("Order", ["tick", "kind", "sku"])
+
+KINDS = {"inbound": "inbound", "in": "inbound", "outbound": "outbound", "out": "outbound"}
+
+
+class OrderLog:
+    # Iterator over the orders in a file, reading one line at a time so logs of any length replay in
+    # constant memory. Pickles as (path, byte offset), so a checkpointed model resumes where it stopped.
+    def __init__(self, path, segundos_por_tick=1.0):
+        self.path = path
+        self.segundos_por_tick = segundos_por_tick
+        self.jsonl = path.removesuffix(".gz").endswith((".jsonl", ".json", ".ndjson"))
+        self.offset = 0  # byte offset of the next unread line
+        self.line = 0
+        self.header = None
+        self.start = None  # timestamp of tick 0
+        self.last_tick = 0
+        self._file = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._file is None:
+            self._file = gzip.open(self.path, "rb") if self.path.endswith(".gz") else open(self.path, "rb")
+            self._file.seek(self.offset)
+        while True:
+            raw = self._file.readline()
+            if not raw:
+                self.close()
+                raise StopIteration
+            self.offset += len(raw)  # uncompressed position, which is also what gzip seeks by
+            self.line += 1
+            text = raw.decode("utf-8").strip()
+            if not text:
+                continue
+            if self.jsonl:
+                row = json.loads(text)
+            elif self.header is None:
+                self.header = [name.strip() for name in next(csv.reader([text]))]
+                continue
+            else:
+                row = dict(zip(self.header, next(csv.reader([text]))))
+            return self._order(row)
+
+    def _order(self, row):
+        kind = KINDS.get(str(row.get("type", "")).strip().lower())
+        if kind is None or row.get("sku") in (None, ""):
+            raise ValueError(f"{self.path}:{self.line}: need a type (inbound/outbound) and a sku")
+        if row.get("tick") not in (None, ""):
+            tick = int(row["tick"])
+        elif row.get("timestamp") not in (None, ""):
+            stamp = parse_timestamp(row["timestamp"])
+            if self.start is None:
+                self.start = stamp
+            tick = int((stamp - self.start) // self.segundos_por_tick)
+        else:
+            raise ValueError(f"{self.path}:{self.line}: need a tick or a timestamp")
+        if tick < self.last_tick:
+            raise ValueError(f"{self.path}:{self.line}: orders must be sorted by time ({tick} after {self.last_tick})")
+        self.last_tick = tick
+        return Order(tick, kind, str(row["sku"]))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_file"] = None  # reopened at `offset` on the next read
+        return state
+
+
+def parse_timestamp(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(str(value).strip()).timestamp()
+
+
+class OrderStream:
+    # Hands the model the orders due at each tick from any iterator of Order, reading one order ahead
+    def __init__(self, orders):
+        self.orders = iter(orders)
+        self.next_order = None
+        self.exhausted = False
+        self.delivered = 0  # orders handed out so far
+
+    def due(self, tick):
+        while not self.exhausted:
+            if self.next_order is None:
+                self.next_order = next(self.orders, None)
+                if self.next_order is None:
+                    self.exhausted = True
+                    break
+            if self.next_order.tick > tick:
+                break
+            order, self.next_order = self.next_order, None
+            self.delivered += 1
+            yield order
+
+
+def synthetic_orders(ticks, tasa_llegada=0.14, tasa_pedidos=0.1, skus=50, seed=None):
+    # Random inbound arrivals and outbound orders over `skus` SKUs, for trying out order logs
+    rng = random.Random(seed)
+    for tick in range(ticks):
+        if rng.random() < tasa_llegada:
+            yield Order(tick, "inbound", f"SKU-{rng.randrange(skus):05d}")
+        if rng.random() < tasa_pedidos:
+            yield Order(tick, "outbound", f"SKU-{rng.randrange(skus):05d}")
+
+
+def write_orders(path, orders):
+    jsonl = path.removesuffix(".gz").endswith((".jsonl", ".json", ".ndjson"))
+    with (gzip.open(path, "wt", newline="") if path.endswith(".gz") else open(path, "w", newline="")) as f:
+        if jsonl:
+            for order in orders:
+                f.write(json.dumps({"tick": order.tick, "type": order.kind, "sku": order.sku}) + "\n")
+        else:
+            writer = csv.writer(f)
+            writer.writerow(["tick", "type", "sku"])
+            writer.writerows(orders)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic order log (CSV or JSONL, optionally .gz)")
+    parser.add_argument("out")
+    parser.add_argument("--ticks", type=int, default=100000)
+    parser.add_argument("--tasa-llegada", type=float, default=0.14)
+    parser.add_argument("--tasa-pedidos", type=float, default=0.1)
+    parser.add_argument("--skus", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_orders(args.out, synthetic_orders(args.ticks, args.tasa_llegada, args.tasa_pedidos, args.skus, args.seed))
+
+
+if __name__ == "__main__":
+    main()
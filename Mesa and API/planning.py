@@ -0,0 +1,407 @@
+import heapq
+import itertools
+import time
+from collections import defaultdict, deque
+
+from layers import FLOOR_CHARGER, FLOOR_CONVEYOR, FLOOR_SHELF
+
+UNREACHABLE_HEURISTIC = 10 ** 6
+PARKED_PENALTY = 3  # extra cost of a path through a waiting robot, which then has to move away
+STALL_TICKS = 20  # ticks without getting closer to its target before a robot plans ahead of the others
+PARKING_CLEARANCE = 2  # idle robots park at least this many cells (Chebyshev) from conveyors and chargers
+
+
+class ReservationPlanner:
+    # Cooperative multi-robot planning (windowed cooperative A*). Robots reserve the cells they will
+    # occupy over the next `window` ticks in a shared space-time table, and later planners route around
+    # those reservations, so no two robots share a cell or swap places. A path may only end on a cell
+    # nobody else needs afterwards, and that last cell stays reserved until the robot plans again, so a
+    # robot can always wait where it is. No path ends on a conveyor or charger other than the robot's own
+    # target, so nobody waits on the squares everyone needs. From the tick after next on, a path may
+    # still go through a robot that is only waiting (at a cost), which bumps that robot into planning a
+    # way out; that is what breaks up queues around conveyors and chargers. Robots that can't move any
+    # more (out of charge) are block()ed: their square is off limits for good.
+    # Router distances (which ignore other robots) are the A* heuristic.
+    #
+    # Ants request a move during step(); the first advance() of the tick plans every robot at once.
+    # Robots keep following their reserved path and only search again when their target changes, their
+    # path runs low or they were pushed off it. Cost per tick is bounded by `max_replans` searches of at
+    # most `max_expansions` nodes. Robots over budget wait in place and get priority on the next tick;
+    # a move onto the square of a robot left waiting without a reservation is cancelled (see _plan_tick).
+    # Robots that make no progress for STALL_TICKS plan first and take their target and the squares
+    # around them from whoever holds them (see _track_progress). Idle robots park on spots of their own
+    # (park()) rather than all heading home, where they used to pile up around everyone else.
+    def __init__(self, model, robot_type, window=8, max_expansions=256, max_replans=32):
+        self.model = model
+        self.robot_type = robot_type
+        self.window = window
+        self.max_expansions = max_expansions
+        self.max_replans = max_replans
+        self.cells = defaultdict(dict)  # tick -> {pos: robot id}
+        self.waits = defaultdict(set)  # tick -> {pos} where the robot holding it stays put
+        self.edges = defaultdict(set)  # tick -> {(from, to)} moves finishing at that tick
+        self.tails = {}  # pos -> (robot id, tick): where a path ends, held from that tick on
+        self.horizon = 0  # latest tick with any reservation
+        self.plans = {}  # robot id -> deque of (tick, from, to) still ahead
+        self.goals = {}  # robot id -> (target, loaded) the plan was made for
+        self.requests = {}  # robot id -> (target, loaded) for the tick being planned
+        self.waiting = defaultdict(int)  # robot id -> ticks in a row it wanted a plan and got none
+        self.bumped = set()  # robots another path goes through, must plan a way out
+        self.blocked = {}  # pos -> id of a robot that can't move from it
+        self.progress = {}  # robot id -> (goal, closest distance to it so far, tick it got there)
+        self.stalled = {}  # robot id -> rank, for robots STALL_TICKS or more without progress
+        self.moves = {}
+        self.planned_tick = None
+        self._neighbours = {}  # (pos, loaded) -> open cells around it, the floor never changes mid-run
+        self._key_cells = None  # conveyors and chargers, where only robots heading for them may stop
+        self.parking = {}  # robot id -> spot it parks on while idle
+        self.parked = set()  # spots taken
+        self._spots = None  # parking spots in the order they are handed out
+        # Running totals for benchmarks
+        self.searches = 0
+        self.expansions = 0
+        self.deferred = 0
+        self.conflicts = 0  # moves cancelled because the square stayed taken
+        self.plan_seconds = 0.0
+
+    def request(self, ant, target, loaded):
+        self.requests[ant.unique_id] = (tuple(target), bool(loaded))
+
+    def block(self, ant):
+        if self.blocked.get(ant.pos) != ant.unique_id:
+            self._release(ant.unique_id)
+            self.unpark(ant)
+            self.blocked[ant.pos] = ant.unique_id
+
+    def next_position(self, ant):
+        now = self.model.schedule.steps
+        if self.planned_tick != now:
+            start = time.perf_counter()
+            self._plan_tick(now)
+            self.plan_seconds += time.perf_counter() - start
+        return self.moves.get(ant.unique_id, ant.pos)
+
+    def _plan_tick(self, now):
+        self.planned_tick = now
+        for tick in [tick for tick in self.cells if tick <= now]:
+            del self.cells[tick]
+            self.waits.pop(tick, None)
+        for tick in [tick for tick in self.edges if tick <= now]:
+            del self.edges[tick]
+
+        blocked = set(self.blocked.values())
+        ants = {ant.unique_id: ant for ant in self.model.agents_of(self.robot_type) if ant.unique_id not in blocked}
+        self._track_progress(ants, now)
+        candidates = []
+        for uid, ant in ants.items():
+            goal = self.requests.get(uid, (ant.pos, False))  # no request: hold position
+            plan = self.plans.get(uid)
+            if not plan or plan[0][0] != now + 1 or plan[0][1] != ant.pos:
+                self._release(uid)
+                if self._free(uid, now + 1, ant.pos, ant.pos):
+                    self._reserve(uid, now + 1, ant.pos, ant.pos)  # hold the cell until a new path is found
+                self.goals[uid] = goal
+                candidates.append((ant, goal, True))
+            elif self.goals.get(uid) != goal or uid in self.bumped or uid in self.stalled:
+                self.goals[uid] = goal  # follows the old path until it gets a search
+                candidates.append((ant, goal, True))
+            elif len(plan) < self.window // 2:
+                self._extend_parked(uid, goal)
+                if len(self.plans[uid]) < self.window // 2:
+                    candidates.append((ant, goal, False))
+            elif plan[-1][2] == ant.pos != goal[0] and self._target_open(uid, goal[0], now):
+                candidates.append((ant, goal, False))  # waiting for its target, which just came free
+
+        # Stalled robots go first, then bumped ones and those kept waiting, then loaded ones
+        candidates.sort(key=lambda item: (self.stalled.get(item[0].unique_id, len(ants)),
+                                          item[0].unique_id not in self.bumped,
+                                          -self.waiting[item[0].unique_id], not item[1][1], str(item[0].unique_id)))
+        queue = deque(candidates)
+        replanned = 0
+        while queue:
+            ant, goal, invalid = queue.popleft()
+            uid = ant.unique_id
+            if replanned >= self.max_replans:
+                self.deferred += 1
+                if invalid:
+                    self.waiting[uid] += 1
+                continue
+            replanned += 1
+            self.bumped.discard(uid)
+            for other in self._plan_robot(ant, goal, now):
+                if other not in self.bumped and other in ants:
+                    self.bumped.add(other)
+                    queue.appendleft((ants[other], self.goals[other], True))
+            self.waiting.pop(uid, None)
+
+        # Robots left without a reservation for next tick (deferred, or boxed in) stay where they are, even
+        # if someone else's path has that square. Whoever was moving onto a square that stays taken waits
+        # instead and loses its path, which can hold up the robot moving onto its own square, and so on.
+        self.moves = {}
+        staying = deque(self.blocked)
+        incoming = defaultdict(list)  # pos -> robots moving onto it
+        for uid, ant in ants.items():
+            plan = self.plans.get(uid)
+            if plan and plan[0][0] == now + 1 and plan[0][2] != ant.pos:
+                incoming[plan[0][2]].append(uid)
+            else:
+                staying.append(ant.pos)
+        while staying:
+            for uid in incoming.pop(staying.popleft(), ()):
+                self._release(uid)
+                self.waiting[uid] += 1
+                self.conflicts += 1
+                staying.append(ants[uid].pos)
+        for uid, ant in ants.items():
+            plan = self.plans.get(uid)
+            self.moves[uid] = plan.popleft()[2] if plan and plan[0][0] == now + 1 else ant.pos
+        self.requests = {}
+
+    def _track_progress(self, ants, now):
+        # Deadlock recovery: a robot that hasn't got any closer to its target in STALL_TICKS plans first,
+        # and the robots holding its target or the squares around it lose their paths and plan around it
+        # (waiting where they are, so it can bump them out of the way). Stalled robots rank by how long
+        # they have been stuck, the lowest charge first on ties, and only give way to robots ranked ahead
+        # of them: in a crowd queuing for the exit everyone stalls, and the one stuck longest gets through.
+        stalled = []
+        for uid, ant in ants.items():
+            goal = self.requests.get(uid, (ant.pos, False))
+            distance = max(abs(ant.pos[0] - goal[0][0]), abs(ant.pos[1] - goal[0][1]))
+            progress = self.progress.get(uid)
+            if progress is None or progress[0] != goal or distance < progress[1]:
+                self.progress[uid] = (goal, distance, now)
+            elif distance and now - progress[2] >= STALL_TICKS:
+                stalled.append((progress[2], ant.charge_percentage, str(uid), uid))
+        self.stalled = {uid: rank for rank, (*_, uid) in enumerate(sorted(stalled))}
+        for uid, rank in self.stalled.items():
+            if (now - self.progress[uid][2]) % STALL_TICKS:
+                continue  # once every STALL_TICKS, so the others get to move in between
+            ant = ants[uid]
+            target = self.progress[uid][0][0]
+            x, y = ant.pos
+            cells = {target} | {(x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+            holders = {holder for tick in range(now + 1, self.horizon + 1) if tick in self.cells
+                       for pos, holder in self.cells[tick].items() if pos in cells}
+            holders |= {self.tails[pos][0] for pos in cells if pos in self.tails}
+            for other in holders - {uid}:
+                if self.stalled.get(other, rank + 1) > rank:
+                    self._release(other)
+
+    def _plan_robot(self, ant, goal, now):
+        # New reserved path for one robot; returns the parked robots it goes through
+        uid = ant.unique_id
+        old_plan = list(self.plans.get(uid, ()))
+        self._release(uid)
+        path = self._search(uid, ant.pos, now, *goal)
+        if not path and old_plan and old_plan[0][0] == now + 1 and old_plan[0][1] == ant.pos:
+            path = [pos for _, _, pos in old_plan]  # nothing better: keep the path it already had
+        elif not path:
+            path = [ant.pos] if self._free(uid, now + 1, ant.pos, ant.pos) else []
+        bumped = []
+        prev = ant.pos
+        for dt, pos in enumerate(path, start=1):
+            holder = self.cells[now + dt].get(pos)
+            if holder is not None and holder != uid:
+                bumped.append(holder)
+            tail = self.tails.get(pos)
+            if tail is not None and tail[0] != uid and now + dt >= tail[1]:
+                bumped.append(tail[0])
+            self._reserve(uid, now + dt, prev, pos)
+            prev = pos
+        return bumped
+
+    def _extend_parked(self, uid, goal):
+        # A robot sitting on its target keeps its place by reserving more waits, no search needed
+        target, _ = goal
+        plan = self.plans[uid]
+        if not plan or plan[-1][2] != target:
+            return
+        tick = plan[-1][0]
+        while len(plan) < self.window and self._free(uid, tick + 1, target, target):
+            tick += 1
+            self._reserve(uid, tick, target, target)
+
+    def _free(self, uid, tick, prev, pos):
+        if self.blocked.get(pos, uid) != uid:
+            return False
+        holder = self.cells[tick].get(pos) if tick in self.cells else None
+        if holder is not None and holder != uid:
+            return False
+        tail = self.tails.get(pos)
+        if tail is not None and tail[0] != uid and tick >= tail[1]:
+            return False
+        return pos == prev or tick not in self.edges or (pos, prev) not in self.edges[tick]
+
+    def _target_open(self, uid, target, now):
+        tail = self.tails.get(target)
+        if tail is not None and tail[0] != uid:
+            return False
+        return self.cells[now + 1].get(target, uid) == uid if now + 1 in self.cells else True
+
+    def _can_end(self, uid, tick, pos, target):
+        if pos != target and pos in self.key_cells():
+            return False
+        tail = self.tails.get(pos)
+        if tail is not None and tail[0] != uid:
+            return False
+        cells = self.cells
+        return all(t not in cells or cells[t].get(pos, uid) == uid for t in range(tick + 1, self.horizon + 1))
+
+    def _reserve(self, uid, tick, prev, pos):
+        self.cells[tick][pos] = uid
+        if pos != prev:
+            self.edges[tick].add((prev, pos))
+            self.waits[tick].discard(pos)
+        else:
+            self.waits[tick].add(pos)
+        plan = self.plans.setdefault(uid, deque())
+        if plan:
+            self._drop_tail(uid, plan[-1][2])
+        plan.append((tick, prev, pos))
+        if pos not in self.tails:
+            self.tails[pos] = (uid, tick)  # a path never ends where another robot's path ends
+        self.horizon = max(self.horizon, tick)
+
+    def _drop_tail(self, uid, pos):
+        tail = self.tails.get(pos)
+        if tail is not None and tail[0] == uid:
+            del self.tails[pos]
+
+    def _release(self, uid):
+        plan = self.plans.get(uid)
+        if plan:
+            self._drop_tail(uid, plan[-1][2])
+        for tick, prev, pos in self.plans.pop(uid, ()):
+            cells = self.cells.get(tick)
+            if cells is not None and cells.get(pos) == uid:
+                del cells[pos]
+                self.waits[tick].discard(pos)
+            if pos != prev and tick in self.edges:
+                self.edges[tick].discard((prev, pos))
+
+    def invalidate(self):
+        self._neighbours.clear()
+        self._key_cells = None
+        self._spots = None
+
+    def key_cells(self):
+        if self._key_cells is None:
+            floor = self.model.floor
+            self._key_cells = {(int(x), int(y)) for x, y in zip(*((floor == FLOOR_CONVEYOR)
+                                                                | (floor == FLOOR_CHARGER)).nonzero())}
+        return self._key_cells
+
+    def park(self, ant):
+        # Parking spot for an idle robot: the first free one, shelves first (loaded robots never cross
+        # those) and then nearest home, at least PARKING_CLEARANCE away from conveyors and chargers.
+        # The robot keeps it until unpark(), so idle robots spread out instead of crowding home.
+        uid = ant.unique_id
+        spot = self.parking.get(uid)
+        if spot is None:
+            if self._spots is None:
+                self._spots = self._rank_spots()
+            spot = next((cell for cell in self._spots if cell not in self.parked and cell not in self.blocked),
+                        ant.pos)
+            self.parking[uid] = spot
+            self.parked.add(spot)
+        return spot
+
+    def unpark(self, ant):
+        spot = self.parking.pop(ant.unique_id, None)
+        if spot is not None:
+            self.parked.discard(spot)
+
+    def _rank_spots(self):
+        floor = self.model.floor
+        layout = self.model.layout
+        near = {(x + dx, y + dy) for x, y in self.key_cells()
+                for dx in range(-PARKING_CLEARANCE, PARKING_CLEARANCE + 1)
+                for dy in range(-PARKING_CLEARANCE, PARKING_CLEARANCE + 1)}
+        width, height = floor.shape
+        spots = [(floor[x, y] != FLOOR_SHELF, self._heuristic((x, y), layout.home, False), (x, y))
+                 for x in range(width) for y in range(height)
+                 if (x, y) not in near and (x, y) not in (layout.home, layout.rest)]
+        return [pos for _, _, pos in sorted(spots)]
+
+    def _open_neighbours(self, pos, loaded, target):
+        key = (pos, loaded)
+        neighbours = self._neighbours.get(key)
+        if neighbours is None:
+            neighbours = self._neighbours[key] = self.model.open_neighbours(pos, loaded)
+        if loaded and target not in neighbours and max(abs(pos[0] - target[0]), abs(pos[1] - target[1])) == 1:
+            neighbours = neighbours + [target]  # the shelf being delivered to
+        return neighbours
+
+    def _heuristic(self, pos, target, loaded):
+        router = self.model.router
+        if router is None:
+            return max(abs(pos[0] - target[0]), abs(pos[1] - target[1]))
+        distance = router.distance(pos, target, loaded)
+        return distance if distance >= 0 else UNREACHABLE_HEURISTIC
+
+    def _search(self, uid, start, now, target, loaded):
+        # Space-time A* from (start, now) to depth `window`; waiting on the target is free so robots that
+        # arrive early stay put. Returns the cells for ticks now+1.. (possibly fewer than `window` when
+        # the expansion budget runs out, in which case it heads for the node closest to the target).
+        self.searches += 1
+        counter = itertools.count()
+        heuristic = {start: self._heuristic(start, target, loaded)}
+        h = heuristic[start]
+        open_nodes = [(h, h, 0, next(counter), 0, 0, start)]
+        best_g = {(0, start): 0}
+        parent = {(0, start): None}
+        closest = (UNREACHABLE_HEURISTIC + 1, 0, (0, start))  # staying put is the fallback
+        expansions = 0
+        goal_node = None
+        while open_nodes and expansions < self.max_expansions:
+            _, h, _, _, g, dt, pos = heapq.heappop(open_nodes)
+            node = (dt, pos)
+            if g > best_g[node]:
+                continue
+            if dt == self.window:
+                if self._can_end(uid, now + dt, pos, target):
+                    goal_node = node
+                    break
+                continue
+            if (h, -dt) < (closest[0], -closest[1]) and self._can_end(uid, now + dt, pos, target):
+                closest = (h, dt, node)
+            expansions += 1
+
+            tick = now + dt + 1
+            cells = self.cells.get(tick, {})
+            waits = self.waits.get(tick, ())
+            edges = self.edges.get(tick, ())
+            for nxt in self._open_neighbours(pos, loaded, target):
+                if nxt in self.blocked:
+                    continue
+                holder = cells.get(nxt)
+                if holder is not None and holder != uid:
+                    if dt == 0 or nxt not in waits:
+                        continue
+                    bump = True
+                else:
+                    tail = self.tails.get(nxt)
+                    bump = tail is not None and tail[0] != uid and tick >= tail[1]
+                    if bump and dt == 0:
+                        continue
+                if nxt != pos and (nxt, pos) in edges:
+                    continue  # would swap places with a robot coming the other way
+                cost = g + (0 if pos == nxt == target else 1) + (PARKED_PENALTY if bump else 0)
+                child = (dt + 1, nxt)
+                if cost < best_g.get(child, UNREACHABLE_HEURISTIC):
+                    best_g[child] = cost
+                    parent[child] = node
+                    h_child = heuristic.get(nxt)
+                    if h_child is None:
+                        h_child = heuristic[nxt] = self._heuristic(nxt, target, loaded)
+                    # deeper nodes first on ties, so paths that wait on the target finish quickly
+                    heapq.heappush(open_nodes, (cost + h_child, h_child, -(dt + 1), next(counter), cost, dt + 1, nxt))
+        self.expansions += expansions
+
+        node = goal_node or closest[2]
+        path = []
+        while node is not None and node[0] > 0:
+            path.append(node[1])
+            node = parent[node]
+        path.reverse()
+        return path
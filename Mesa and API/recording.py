@@ -0,0 +1,401 @@
+import argparse
+import bisect
+import json
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from binary_state import NO_PACKAGE, PACKAGE_DTYPE, ROBOT_DTYPE, encode_records
+from streaming import Snapshot, TickBroadcaster, sse_message
+
+# Trajectory log: the robot and package records (binary_state.ROBOT_DTYPE / PACKAGE_DTYPE) of every tick
+# of a run, written by TrajectoryRecorder while a Warehouse steps and read back by TrajectoryLog without
+# the model. Little-endian throughout:
+#   FILE_HEADER, then a JSON header (grid size, floor map, model parameters)
+#   chunks    CHUNK_HEADER + zlib-compressed tick records of up to CHUNK_TICKS consecutive ticks
+#   index     one INDEX_ENTRY per chunk, then FOOTER
+# A tick record is TICK_HEADER followed by its robot records, package records and the ids of the packages
+# removed since the previous tick (int32). The first record of a chunk has every robot and package (a
+# keyframe), the rest only those changed since the tick before, so any tick is rebuilt from one chunk.
+# The index is rewritten after every chunk; a log whose recorder was killed is read by walking the chunks.
+LOG_MAGIC = b"WHTR"
+LOG_VERSION = 1
+CHUNK_MAGIC = b"CHNK"
+INDEX_MAGIC = b"WHIX"
+FILE_HEADER = struct.Struct("<4sHI")  # magic, version, JSON header size
+CHUNK_HEADER = struct.Struct("<4sIII")  # magic, first tick, tick count, compressed size
+TICK_HEADER = struct.Struct("<IIII")  # tick, robot count, package count, removed count
+INDEX_ENTRY = struct.Struct("<IIQ")  # first tick, tick count, file offset of the chunk header
+FOOTER = struct.Struct("<QI4s")  # index offset, chunk count, magic
+CHUNK_TICKS = 256
+
+TickRecord = namedtuple("TickRecord", ["tick", "robots", "packages", "removed"])
+
+
+def package_key(package_id):
+    # Packages are "package_<serial>" in replayed states, as they are live (the serial is the package's id
+    # in the package table, handed out in arrival order from 0)
+    return f"package_{package_id}"
+
+
+def describe_robots(robots):
+    return [{"id": unique_id, "position": [x, y], "type": "Ant", "state": state, "charge_percentage": charge,
+             "package": package_key(package) if package != NO_PACKAGE else None}
+            for unique_id, x, y, state, charge, package in zip(
+                robots["id"].tolist(), robots["x"].tolist(), robots["y"].tolist(), robots["state"].tolist(),
+                robots["charge"].tolist(), robots["package"].tolist())]
+
+
+def describe_packages(packages):
+    return [{"id": package_key(package_id), "position": [x, y], "type": "Packages", "state": state}
+            for package_id, x, y, state in zip(packages["id"].tolist(), packages["x"].tolist(),
+                                               packages["y"].tolist(), packages["state"].tolist())]
+
+
+def encode_tick(tick, robots, packages, removed):
+    return (TICK_HEADER.pack(tick, len(robots), len(packages), len(removed)) + robots.tobytes()
+            + packages.tobytes() + np.asarray(removed, dtype="<i4").tobytes())
+
+
+class TrajectoryRecorder:
+    # Appends every tick of a Warehouse to a trajectory log; Warehouse(recording=...) calls record() once
+    # after construction and after every step. After close() the file is reopened at the end of the last
+    # written chunk, so a model that steps on goes on recording into the same log. Checkpoints keep the
+    # recorder, but Warehouse.load_checkpoint() starts a new one on a new path.
+    def __init__(self, path, chunk_ticks=CHUNK_TICKS, compresslevel=6):
+        self.path = path
+        self.chunk_ticks = chunk_ticks
+        self.compresslevel = compresslevel
+        self.index = []  # (first tick, tick count, offset) per written chunk
+        self.offset = 0  # end of the last written chunk
+        self.tick = None  # last recorded tick
+        self.package_ids = {}  # unique_id -> serial id of the packages recorded so far
+        self._records = []  # encoded tick records of the chunk being filled
+        self._first_tick = None
+        self._file = None
+
+    def record(self, model):
+        tick = model.schedule.steps
+        if tick == self.tick:
+            return
+        if self._file is None:
+            self._open(model)
+        changes = model.changes_since(self.tick) if self.tick is not None else None
+        if changes is None and self._records:
+            self._write_chunk()  # history gap: start over from a keyframe
+        removed = []
+        if changes is not None:
+            changed, gone = changes
+            removed = [self.package_ids.pop(unique_id) for unique_id in gone if unique_id in self.package_ids]
+        if not self._records:
+            robots, packages = model.robot_table.packed(), model.package_table.packed()
+            table = model.package_table
+            self.package_ids = {unique_id: int(table.data["id"][row]) for unique_id, row in table.rows.items()}
+            self._first_tick = tick
+        else:
+            robots = self._changed(model.robot_table, changed)
+            packages = self._changed(model.package_table, changed)
+            for unique_id, package_id in zip((agent.unique_id for agent in changed
+                                              if agent.unique_id in model.package_table.rows),
+                                             packages["id"].tolist()):
+                self.package_ids[unique_id] = package_id
+        self._records.append(encode_tick(tick, robots, packages, removed))
+        self.tick = tick
+        if len(self._records) >= self.chunk_ticks:
+            self._write_chunk()
+
+    @staticmethod
+    def _changed(table, agents):
+        return table.data[[table.rows[agent.unique_id] for agent in agents if agent.unique_id in table.rows]]
+
+    def _open(self, model):
+        if self.offset:
+            self._file = open(self.path, "r+b")  # resumed from a checkpoint
+            self._file.truncate(self.offset)
+            return
+        header = json.dumps({"width": model.grid.width, "height": model.grid.height,
+                             "floor": model.floor.tolist(), "entrance": model.layout.entrance,
+                             "exit": model.layout.exit, "num_agentes": model.num_agentes, "seed": model.seed,
+                             "tasa_llegada": model.tasa_llegada, "chunk_ticks": self.chunk_ticks}).encode()
+        self._file = open(self.path, "wb")
+        self._file.write(FILE_HEADER.pack(LOG_MAGIC, LOG_VERSION, len(header)) + header)
+        self.offset = self._file.tell()
+
+    def _write_chunk(self):
+        data = zlib.compress(b"".join(self._records), self.compresslevel)
+        self._file.seek(self.offset)
+        self._file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, self._first_tick, len(self._records), len(data)) + data)
+        self.index.append((self._first_tick, len(self._records), self.offset))
+        self.offset += CHUNK_HEADER.size + len(data)
+        self._records = []
+        # Index right after the new chunk, so the log is complete up to here even if recording stops
+        self._file.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in self.index)
+                         + FOOTER.pack(self.offset, len(self.index), INDEX_MAGIC))
+        self._file.flush()
+
+    def close(self):
+        # Writes out the chunk being filled; recording picks up again if the model steps on
+        if self._file is not None:
+            if self._records:
+                self._write_chunk()
+            self._file.close()
+            self._file = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_file"] = None
+        return state
+
+
+class TrajectoryLog:
+    # Random access to a trajectory log. The last few decoded chunks are cached; not thread-safe, so
+    # threads share one under a lock.
+    def __init__(self, path, cache_chunks=4):
+        self.path = path
+        self.cache_chunks = cache_chunks
+        self._file = open(path, "rb")
+        magic, version, header_size = FILE_HEADER.unpack(self._file.read(FILE_HEADER.size))
+        if magic != LOG_MAGIC:
+            raise ValueError(f"{path} is not a trajectory log")
+        if version != LOG_VERSION:
+            raise ValueError(f"Unsupported trajectory log version {version}")
+        self.header = json.loads(self._file.read(header_size))
+        self.data_start = FILE_HEADER.size + header_size
+        self._chunks = OrderedDict()  # chunk number -> (ticks, records)
+        self.refresh()
+
+    @property
+    def first_tick(self):
+        return self.index[0][0] if self.index else None
+
+    @property
+    def last_tick(self):
+        return self.index[-1][0] + self.index[-1][1] - 1 if self.index else None
+
+    def refresh(self):
+        # Re-reads the index, e.g. to follow a log that is still being recorded
+        self.index = self._read_index()
+        self.first_ticks = [first_tick for first_tick, _, _ in self.index]
+
+    def _read_index(self):
+        size = self._file.seek(0, os.SEEK_END)
+        if size >= self.data_start + FOOTER.size:
+            self._file.seek(size - FOOTER.size)
+            index_offset, count, magic = FOOTER.unpack(self._file.read(FOOTER.size))
+            if magic == INDEX_MAGIC and index_offset + count * INDEX_ENTRY.size + FOOTER.size == size:
+                self._file.seek(index_offset)
+                return list(INDEX_ENTRY.iter_unpack(self._file.read(count * INDEX_ENTRY.size)))
+        index = []
+        offset = self.data_start
+        while offset + CHUNK_HEADER.size <= size:
+            self._file.seek(offset)
+            magic, first_tick, ticks, length = CHUNK_HEADER.unpack(self._file.read(CHUNK_HEADER.size))
+            if magic != CHUNK_MAGIC or offset + CHUNK_HEADER.size + length > size:
+                break
+            index.append((first_tick, ticks, offset))
+            offset += CHUNK_HEADER.size + length
+        return index
+
+    def chunk(self, number):
+        # (ticks, TickRecord list) of one chunk
+        cached = self._chunks.get(number)
+        if cached is not None:
+            self._chunks.move_to_end(number)
+            return cached
+        _, ticks, offset = self.index[number]
+        self._file.seek(offset)
+        length = CHUNK_HEADER.unpack(self._file.read(CHUNK_HEADER.size))[3]
+        data = zlib.decompress(self._file.read(length))
+        records = []
+        position = 0
+        for _ in range(ticks):
+            tick, robot_count, package_count, removed_count = TICK_HEADER.unpack_from(data, position)
+            position += TICK_HEADER.size
+            robots = np.frombuffer(data, ROBOT_DTYPE, robot_count, position)
+            position += robots.nbytes
+            packages = np.frombuffer(data, PACKAGE_DTYPE, package_count, position)
+            position += packages.nbytes
+            removed = np.frombuffer(data, "<i4", removed_count, position)
+            position += removed.nbytes
+            records.append(TickRecord(tick, robots, packages, removed))
+        cached = ([record.tick for record in records], records)
+        self._chunks[number] = cached
+        if len(self._chunks) > self.cache_chunks:
+            self._chunks.popitem(last=False)
+        return cached
+
+    def locate(self, tick):
+        # (chunk number, position) of the last recorded tick at or before `tick`, clamped to the log
+        if not self.index:
+            raise ValueError(f"{self.path} has no recorded ticks")
+        number = max(bisect.bisect_right(self.first_ticks, tick) - 1, 0)
+        ticks, _ = self.chunk(number)
+        return number, max(bisect.bisect_right(ticks, tick) - 1, 0)
+
+    def close(self):
+        self._file.close()
+
+
+class ReplayCursor:
+    # The robots and packages at one tick of a TrajectoryLog: seek() jumps to any tick by replaying one
+    # chunk, step() moves on one recorded tick
+    def __init__(self, log):
+        self.log = log
+        self.tick = None
+        self.number = None  # chunk and position in it of the current tick
+        self.position = None
+        self.robots = {}  # id -> record bytes
+        self.packages = {}
+
+    def seek(self, tick):
+        number, position = self.log.locate(tick)
+        _, records = self.log.chunk(number)
+        for at in range(position + 1):
+            self._apply(records[at], keyframe=at == 0)
+        self.number, self.position = number, position
+        return self.tick
+
+    def step(self):
+        # The TickRecord moved to, or None at the end of the log
+        if self.tick is None:
+            self.seek(self.log.first_tick)
+            return self.log.chunk(self.number)[1][self.position]
+        number, position = self.number, self.position + 1
+        if position >= len(self.log.chunk(number)[1]):
+            number, position = number + 1, 0
+            if number >= len(self.log.index):
+                self.log.refresh()
+                if number >= len(self.log.index):
+                    return None
+        record = self.log.chunk(number)[1][position]
+        self._apply(record, keyframe=position == 0)
+        self.number, self.position = number, position
+        return record
+
+    @property
+    def keyframe(self):
+        return self.position == 0
+
+    def _apply(self, record, keyframe):
+        if keyframe:
+            self.robots, self.packages = {}, {}
+        for table, rows in ((self.robots, record.robots), (self.packages, record.packages)):
+            raw, size = rows.tobytes(), rows.dtype.itemsize
+            for at, unique_id in enumerate(rows["id"].tolist()):
+                table[unique_id] = raw[at * size:(at + 1) * size]
+        for package_id in record.removed.tolist():
+            self.packages.pop(package_id, None)
+        self.tick = record.tick
+
+    def arrays(self):
+        return (np.frombuffer(b"".join(self.robots.values()), ROBOT_DTYPE),
+                np.frombuffer(b"".join(self.packages.values()), PACKAGE_DTYPE))
+
+    def agents(self):
+        robots, packages = self.arrays()
+        return describe_robots(robots) + describe_packages(packages)
+
+    def binary(self):
+        return encode_records(self.tick, *self.arrays())
+
+
+class ReplayBroadcaster(TickBroadcaster):
+    # TickBroadcaster over a recorded log: every tick moves a ReplayCursor on one recorded tick instead of
+    # stepping a model, and seek() jumps anywhere, resyncing subscribers with a snapshot. The loop pauses
+    # itself at the end of the log. encode_changes(tick, agents, removed) -> str builds the tick messages.
+    def __init__(self, log, lock, encode_changes, encode_snapshot, tick_rate=10.0):
+        super().__init__(None, lock, encode_delta=None, encode_snapshot=encode_snapshot, tick_rate=tick_rate)
+        self.log = log
+        self.cursor = ReplayCursor(log)
+        self.encode_changes = encode_changes
+        with lock:
+            self.cursor.seek(log.first_tick)
+            self._reload()
+            self.publish()
+
+    def _reload(self):
+        self._agents = {agent["id"]: agent for agent in self.cursor.agents()}
+
+    def advance(self):
+        record = self.cursor.step()
+        if record is None:
+            return None
+        if self.cursor.keyframe:
+            self._agents = {}
+        changed = describe_robots(record.robots) + describe_packages(record.packages)
+        removed = [package_key(package_id) for package_id in record.removed.tolist()]
+        for unique_id in removed:
+            self._agents.pop(unique_id, None)
+        for agent in changed:
+            self._agents[agent["id"]] = agent
+        return sse_message("tick", self.encode_changes(record.tick, changed, removed))
+
+    def publish(self):
+        self.latest = Snapshot(self.cursor.tick, tuple(self._agents.values()), self.cursor.binary())
+
+    def seek(self, tick):
+        with self.lock:
+            self.cursor.seek(tick)
+            self._reload()
+            self.publish()
+        message = self.snapshot_message()
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.offer(message)
+        return self.cursor.tick
+
+
+def record_run(path, ticks, chunk_ticks=CHUNK_TICKS, **params):
+    from model import Warehouse
+
+    model = Warehouse(recording=TrajectoryRecorder(path, chunk_ticks), **params)
+    for _ in range(ticks):
+        model.step()
+    model.recorder.close()
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record a Warehouse run to a trajectory log, or inspect one")
+    commands = parser.add_subparsers(dest="command", required=True)
+    record = commands.add_parser("record")
+    record.add_argument("out")
+    record.add_argument("--ticks", type=int, default=28800)
+    record.add_argument("--num-agentes", type=int, default=5)
+    record.add_argument("--tasa-llegada", type=float, default=0.14)
+    record.add_argument("--seed", type=int, default=0)
+    record.add_argument("--orders", help="order log driving the run (see orders.py)")
+    record.add_argument("--chunk-ticks", type=int, default=CHUNK_TICKS)
+    info = commands.add_parser("info")
+    info.add_argument("log")
+    info.add_argument("--seek", type=int, nargs="*", default=[], help="time random access to these ticks")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        start = time.perf_counter()
+        record_run(args.out, args.ticks, args.chunk_ticks, num_agentes=args.num_agentes,
+                   tasa_llegada=args.tasa_llegada, seed=args.seed, orders=args.orders)
+        print(f"recorded {args.ticks} ticks in {time.perf_counter() - start:.1f} s, "
+              f"{os.path.getsize(args.out) / 1e6:.2f} MB")
+        return
+
+    log = TrajectoryLog(args.log)
+    print(f"{args.log}: ticks {log.first_tick}-{log.last_tick} in {len(log.index)} chunks, "
+          f"{os.path.getsize(args.log) / 1e6:.2f} MB, {log.header['width']}x{log.header['height']}, "
+          f"{log.header['num_agentes']} robots")
+    for tick in args.seek:
+        start = time.perf_counter()
+        cursor = ReplayCursor(log)
+        cursor.seek(tick)
+        robots, packages = cursor.arrays()
+        print(f"tick {cursor.tick}: {len(robots)} robots, {len(packages)} packages "
+              f"in {1000 * (time.perf_counter() - start):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
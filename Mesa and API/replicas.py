@@ -0,0 +1,464 @@
+import argparse
+import os
+import statistics
+import time
+
+import numpy as np
+
+from layers import FLOOR_CHARGER, FLOOR_SHELF
+from layouts import compile_tables, default_layout, load_layout
+from model import LOW_CHARGE, MISSION_BATCH, UNREACHABLE_COST
+from routing import MOORE_OFFSETS, UNREACHABLE, bfs, walkable_masks
+
+NOT_QUEUED = np.iinfo(np.int64).max
+EMPTY = -1  # free package slot / no package / no destination
+
+
+class ReplicaWarehouse:
+    # R independent copies of the warehouse advanced together. State is kept struct-of-arrays (one row per
+    # replica) and every tick is a fixed sequence of NumPy operations over all replicas at once, following
+    # the same rules as Warehouse with modo_ruteo='Corta' and modo_carga='Aleatoria': packages arrive at the
+    # entrance, CentralSystem queues inbound/outbound missions and matches them to idle robots, and robots
+    # go rest -> pickup -> deliver -> charge exactly as Ant.step does. Differences from the reference model:
+    #   - missions are matched greedily by lowest travel cost instead of with the Hungarian method
+    #   - shelves with the same score are allocated in layout order
+    #   - one random stream for all replicas, so runs are reproducible per seed but not draw-for-draw
+    #     identical to a Warehouse with the same seed
+    # validate() compares the KPIs against Warehouse runs.
+    def __init__(self, replicas, num_agentes=1, modo_pos_inicial='Fija', tasa_llegada=0.14, seed=None,
+                 layout=None, layout_cache=None):
+        if layout is None:
+            layout = default_layout()
+        elif isinstance(layout, str):
+            layout = load_layout(layout)
+        self.layout = layout
+        self.replicas = replicas
+        self.num_agentes = num_agentes
+        self.tasa_llegada = tasa_llegada
+        self.rng = np.random.default_rng(seed)
+        self.steps = 0
+
+        floor = layout.floor()
+        self.height = layout.height
+        cells = floor.size
+
+        # Targets: shelves first (target id == shelf index, in cell order so the largest position is the
+        # last one), then conveyors, home, rest and chargers; a position shared by two roles is one target
+        shelves = sorted(dict.fromkeys(pos for pos in layout.shelves if floor[pos] == FLOOR_SHELF))
+        chargers = [pos for pos in dict.fromkeys(layout.chargers) if floor[pos] == FLOOR_CHARGER]
+        positions = list(dict.fromkeys(shelves + [layout.entrance, layout.exit, layout.home, layout.rest] + chargers))
+        target_of = {pos: tid for tid, pos in enumerate(positions)}
+        self.num_shelves = len(shelves)
+        self.entrance = target_of[layout.entrance]
+        self.exit = target_of[layout.exit]
+        self.home = target_of[layout.home]
+        self.rest = target_of[layout.rest]
+        self.chargers = np.array([target_of[pos] for pos in chargers], dtype=np.int32)
+        self.target_cell = np.array([self._cell(pos) for pos in positions], dtype=np.int32)
+        self.cell_target = np.full(cells, EMPTY, dtype=np.int32)
+        self.cell_target[self.target_cell] = np.arange(len(positions), dtype=np.int32)
+        self.cell_shelf = np.where(self.cell_target < self.num_shelves, self.cell_target, EMPTY)
+        self.is_charger = (floor == FLOOR_CHARGER).ravel()
+
+        # Distance / next-hop tables, row 2 * target + loaded, as laid out by layouts.compile_tables
+        self.dist, self.next_hop = self._tables(floor, positions, layout_cache)
+        self.neighbours = np.full((cells, len(MOORE_OFFSETS)), EMPTY, dtype=np.int64)
+        for cell in range(cells):
+            x, y = divmod(cell, self.height)
+            for k, (dx, dy) in enumerate(MOORE_OFFSETS):
+                if 0 <= x + dx < layout.width and 0 <= y + dy < self.height:
+                    self.neighbours[cell, k] = (x + dx) * self.height + y + dy
+        # NearestEntrancePolicy: loaded path length from each shelf to the entrance, ties in layout order
+        entrance_distance = self._distance(np.full(self.num_shelves, self.entrance), np.ones(self.num_shelves, bool),
+                                           self.target_cell[:self.num_shelves]).astype(float)
+        entrance_distance[entrance_distance == UNREACHABLE] = np.inf
+        layout_order = {pos: rank for rank, pos in enumerate(dict.fromkeys(layout.shelves))}
+        ties = np.array([layout_order[pos] for pos in shelves], dtype=float) / max(self.num_shelves, 1)
+        self.shelf_score = entrance_distance + ties
+
+        R, A, S = replicas, num_agentes, self.num_shelves
+        # Robots
+        if modo_pos_inicial == 'Aleatoria':
+            open_cells = np.flatnonzero(((floor != FLOOR_SHELF) & (floor != FLOOR_CHARGER)).ravel())
+            picks = np.argsort(self.rng.random((R, len(open_cells))), axis=1)[:, :A]
+            self.robot_pos = open_cells[picks].astype(np.int64)
+        else:  # 'Fija'
+            self.robot_pos = np.full((R, A), self._cell(layout.home), dtype=np.int64)
+        self.robot_state = np.zeros((R, A), dtype=np.int8)  # same codes as Ant.state
+        self.robot_charge = np.full((R, A), 100.0)
+        self.robot_target = np.full((R, A), self.home, dtype=np.int32)
+        self.robot_dest = np.full((R, A), EMPTY, dtype=np.int32)  # haul destination target
+        self.robot_package = np.full((R, A), EMPTY, dtype=np.int64)  # package slot of its mission
+        self.robot_loaded = np.zeros((R, A), dtype=bool)
+        # Shelves
+        self.shelf_free = np.ones((R, S), dtype=bool)
+        self.shelf_locked = np.zeros((R, S), dtype=bool)
+        self.shelf_package = np.full((R, S), EMPTY, dtype=np.int64)
+        self.shelf_ready = np.zeros((R, S), dtype=bool)  # holds an unlocked package, can take outbound demand
+        # Packages, in slots reused after delivery; state EMPTY marks a free slot, else Packages.state codes.
+        # pkg_key orders the mission queue: appended missions count up, requeued ones count down.
+        self.pkg_state = np.full((R, 0), EMPTY, dtype=np.int8)
+        self.pkg_pos = np.zeros((R, 0), dtype=np.int64)
+        self.pkg_locked = np.zeros((R, 0), dtype=bool)
+        self.pkg_created = np.zeros((R, 0), dtype=np.int64)
+        self.pkg_key = np.zeros((R, 0), dtype=np.int64)
+        self.back_key = np.zeros(R, dtype=np.int64)
+        self.front_key = np.full(R, -1, dtype=np.int64)
+        self.arrived = []  # (replicas, slots) of packages not yet seen by the central system
+        self._grow(64)
+
+        # Running KPI totals, per replica
+        self.delivered_packages = np.zeros(R, dtype=np.int64)
+        self.total_delivery_latency = np.zeros(R, dtype=np.int64)
+        self.busy_robot_ticks = np.zeros(R, dtype=np.int64)
+        self.energy_used = np.zeros(R)
+
+        self._add_packages(np.arange(R))  # the package waiting on the entrance conveyor at start
+
+    def _cell(self, pos):
+        return pos[0] * self.height + pos[1]
+
+    @staticmethod
+    def _tables(floor, positions, layout_cache):
+        targets = [(x, y, loaded) for x, y in positions for loaded in (0, 1)]
+        if layout_cache is not None:
+            path = compile_tables(floor, targets, layout_cache)
+            dist = np.load(os.path.join(path, "dist.npy"), mmap_mode="r")
+            next_hop = np.load(os.path.join(path, "next_hop.npy"), mmap_mode="r")
+        else:
+            masks = walkable_masks(floor)
+            dist = np.empty((len(targets),) + floor.shape, dtype=np.int32)
+            next_hop = np.empty_like(dist)
+            for row, (x, y, loaded) in enumerate(targets):
+                dist[row], next_hop[row] = bfs((x, y), masks[loaded])
+        return dist.reshape(len(targets), -1), next_hop.reshape(len(targets), -1)
+
+    def _grow(self, extra):
+        R = self.replicas
+        self.pkg_state = np.concatenate([self.pkg_state, np.full((R, extra), EMPTY, dtype=np.int8)], axis=1)
+        self.pkg_pos = np.concatenate([self.pkg_pos, np.zeros((R, extra), dtype=np.int64)], axis=1)
+        self.pkg_locked = np.concatenate([self.pkg_locked, np.zeros((R, extra), dtype=bool)], axis=1)
+        self.pkg_created = np.concatenate([self.pkg_created, np.zeros((R, extra), dtype=np.int64)], axis=1)
+        self.pkg_key = np.concatenate([self.pkg_key, np.full((R, extra), NOT_QUEUED, dtype=np.int64)], axis=1)
+
+    def _add_packages(self, rows):
+        # One new package on the entrance conveyor of each replica in rows
+        free = self.pkg_state[rows] == EMPTY
+        if not free.any(axis=1).all():
+            self._grow(self.pkg_state.shape[1])
+            free = self.pkg_state[rows] == EMPTY
+        slots = free.argmax(axis=1)
+        self.pkg_state[rows, slots] = 0
+        self.pkg_pos[rows, slots] = self.target_cell[self.entrance]
+        self.pkg_locked[rows, slots] = False
+        self.pkg_created[rows, slots] = self.steps
+        self.pkg_key[rows, slots] = NOT_QUEUED
+        self.arrived.append((rows, slots))
+
+    def _distance(self, targets, loaded, cells):
+        # Router.distance for arrays of (target, loaded, cell), stepping off cells outside the mask
+        rows = 2 * np.asarray(targets, dtype=np.int64) + loaded
+        d = self.dist[rows, cells]
+        off = d == UNREACHABLE
+        if off.any():
+            around = self.neighbours[cells[off]]
+            near = np.where(around >= 0, self.dist[rows[off][:, None], np.maximum(around, 0)], UNREACHABLE)
+            near = np.where(near == UNREACHABLE, np.iinfo(np.int32).max, near).min(axis=1)
+            d[off] = np.where(near == np.iinfo(np.int32).max, UNREACHABLE, near + 1)
+        return d
+
+    def _next_hop(self, targets, loaded, cells):
+        # Router.next_hop for arrays; robots with no way out stay where they are
+        rows = 2 * targets.astype(np.int64) + loaded
+        hop = self.next_hop[rows, cells].astype(np.int64)
+        off = hop == UNREACHABLE
+        if off.any():
+            around = self.neighbours[cells[off]]
+            near = np.where(around >= 0, self.dist[rows[off][:, None], np.maximum(around, 0)], UNREACHABLE)
+            near = np.where(near == UNREACHABLE, np.iinfo(np.int32).max, near)
+            best = near.argmin(axis=1)  # first of equals, in MOORE_OFFSETS order like the Router
+            stuck = near[np.arange(len(best)), best] == np.iinfo(np.int32).max
+            hop[off] = np.where(stuck, cells[off], around[np.arange(len(best)), best])
+        return hop
+
+    def _queue(self, mask, front=False):
+        # Give the packages in mask (R x P) mission keys, in slot order within each replica
+        order = np.cumsum(mask, axis=1) - 1
+        count = mask.sum(axis=1)
+        if front:
+            self.pkg_key[mask] = (self.front_key[:, None] - order)[mask]
+            self.front_key -= count
+        else:
+            self.pkg_key[mask] = (self.back_key[:, None] + order)[mask]
+            self.back_key += count
+
+    def step(self):
+        R = self.replicas
+        arrivals = np.flatnonzero(self.rng.random(R) < self.tasa_llegada)
+        if len(arrivals):
+            self._add_packages(arrivals)
+
+        sent = self.pkg_state == 3
+        if sent.any():
+            self.delivered_packages += sent.sum(axis=1)
+            self.total_delivery_latency += np.where(sent, self.steps - self.pkg_created, 0).sum(axis=1)
+            self.pkg_state[sent] = EMPTY
+
+        self._central_system()
+        self._robots()
+        self.busy_robot_ticks += ((self.robot_state >= 1) & (self.robot_state <= 3)).sum(axis=1)
+        self.steps += 1
+
+    def run(self, ticks):
+        for _ in range(ticks):
+            self.step()
+        return self
+
+    def _central_system(self):
+        R = self.replicas
+        # Inbound missions for unlocked packages waiting on the entrance conveyor
+        for rows, slots in self.arrived:
+            self.pkg_locked[rows, slots] = True
+            self.pkg_state[rows, slots] = 1
+            self.pkg_key[rows, slots] = self.back_key[rows]
+            self.back_key[rows] += 1
+        self.arrived = []
+
+        # Outbound demand (CentralSystem.step: randint(1, 100) < 75): the stored package on the occupied
+        # shelf with the largest position
+        demand = np.flatnonzero((self.rng.integers(1, 101, R) < 75) & self.shelf_ready.any(axis=1))
+        if len(demand):
+            last = self.num_shelves - 1 - self.shelf_ready[demand, ::-1].argmax(axis=1)
+            slots = self.shelf_package[demand, last]
+            self.shelf_ready[demand, last] = False
+            self.pkg_locked[demand, slots] = True
+            self.pkg_key[demand, slots] = self.back_key[demand]
+            self.back_key[demand] += 1
+
+        self._assign_missions()
+
+    def _assign_missions(self):
+        idle = (self.robot_state == 0) & (self.robot_charge > LOW_CHARGE)
+        queued = self.pkg_key != NOT_QUEUED
+        rows = np.flatnonzero(idle.any(axis=1) & queued.any(axis=1))
+        if not len(rows):
+            return
+        # The oldest MISSION_BATCH missions of each replica against its idle robots
+        batch = np.argsort(self.pkg_key[rows], axis=1, kind="stable")[:, :MISSION_BATCH]
+        valid = np.take_along_axis(queued[rows], batch, axis=1)
+        pickup = self.cell_target[np.take_along_axis(self.pkg_pos[rows], batch, axis=1)]
+        cost = self._distance(np.broadcast_to(np.maximum(pickup, 0)[:, :, None], (len(rows),) + pickup.shape[1:]
+                                              + (self.num_agentes,)).ravel(),
+                              False, np.broadcast_to(self.robot_pos[rows][:, None, :],
+                                                     (len(rows), batch.shape[1], self.num_agentes)).ravel())
+        cost = np.where(cost == UNREACHABLE, UNREACHABLE_COST, cost).astype(float)
+        cost = cost.reshape(len(rows), batch.shape[1], self.num_agentes)
+        cost[~valid] = np.inf
+        cost[~idle[rows][:, None, :].repeat(batch.shape[1], axis=1)] = np.inf
+
+        # Greedy matching: each round every replica takes its cheapest remaining (mission, robot) pair
+        for _ in range(min(batch.shape[1], self.num_agentes)):
+            flat = cost.reshape(len(rows), -1)
+            best = flat.argmin(axis=1)
+            live = np.flatnonzero(np.isfinite(flat[np.arange(len(rows)), best]))
+            if not len(live):
+                break
+            b, a = np.divmod(best[live], self.num_agentes)
+            cost[live, b, :] = np.inf
+            cost[live, :, a] = np.inf
+            r = rows[live]
+            slot = batch[live, b]
+            inbound = self.pkg_state[r, slot] == 1
+
+            dest = np.full(len(r), self.exit, dtype=np.int32)
+            if inbound.any():
+                free = self.shelf_free[r[inbound]] & ~self.shelf_locked[r[inbound]]
+                score = np.where(free, self.shelf_score, np.inf)
+                shelf = score.argmin(axis=1)
+                full = ~np.isfinite(score[np.arange(len(shelf)), shelf])
+                self.shelf_locked[r[inbound][~full], shelf[~full]] = True
+                dest[inbound] = np.where(full, EMPTY, shelf)
+            ok = dest != EMPTY  # warehouse full: the inbound mission stays queued
+            r, a, slot, dest, inbound = r[ok], a[ok], slot[ok], dest[ok], inbound[ok]
+            self.robot_state[r, a] = np.where(inbound, 1, 2)
+            self.robot_target[r, a] = self.cell_target[self.pkg_pos[r, slot]]
+            self.robot_dest[r, a] = dest
+            self.robot_package[r, a] = slot
+            self.pkg_key[r, slot] = NOT_QUEUED
+
+    def _robots(self):
+        # Ant.step then Ant.advance for every robot of every replica
+        R, A = self.replicas, self.num_agentes
+        rows = np.broadcast_to(np.arange(R)[:, None], (R, A))
+        pos = self.robot_pos
+        state = self.robot_state
+        package = self.robot_package
+        slot = np.maximum(package, 0)
+        shelf = self.cell_shelf[pos]
+        on_shelf = shelf >= 0
+        shelf_index = np.maximum(shelf, 0)
+        target_cell = self.target_cell[self.robot_target]
+        stopped = (self.robot_charge <= 0) & ~self.is_charger[pos]  # out of charge: stays put for good
+
+        collect = ~stopped & (pos == self.target_cell[self.entrance]) & (state == 1)
+        pick = ~stopped & ~collect & on_shelf & (state == 2) & (pos == target_cell)
+        ship = ~stopped & ~collect & ~pick & (pos == self.target_cell[self.exit]) & (state == 3)
+        store = ~stopped & ~collect & ~pick & ~ship & on_shelf & (state == 3) & self.shelf_free[rows, shelf_index]
+
+        # from receiving conveyor to shelves
+        self.robot_target[collect] = self.robot_dest[collect]
+        state[collect] = 3
+        # from shelves and to exit conveyor
+        self.robot_loaded[pick] = True
+        self.shelf_free[rows[pick], shelf_index[pick]] = True
+        self.shelf_package[rows[pick], shelf_index[pick]] = EMPTY
+        self.robot_target[pick] = self.robot_dest[pick]
+        state[pick] = 3
+        self.pkg_state[rows[pick], slot[pick]] = 2
+        # leaving at exit conveyor
+        self.pkg_state[rows[ship], slot[ship]] = 3
+        # onto the reserved shelf
+        self.shelf_free[rows[store], shelf_index[store]] = False
+        self.shelf_locked[rows[store], shelf_index[store]] = False
+        self.shelf_package[rows[store], shelf_index[store]] = package[store]
+        self.shelf_ready[rows[store], shelf_index[store]] = True
+        self.pkg_state[rows[store], slot[store]] = 0
+        self.pkg_locked[rows[store], slot[store]] = False
+        done = ship | store
+        state[done] = 0
+        self.robot_target[done] = self.rest
+        self.robot_loaded[done] = False
+        package[done] = EMPTY
+        self.robot_dest[done] = EMPTY
+
+        # picking up the assigned package at the entrance conveyor
+        load = ~stopped & (state == 3) & ~self.robot_loaded & (package >= 0)
+        load &= self.pkg_pos[rows, slot] == pos
+        self.robot_loaded[load] = True
+        self.pkg_state[rows[load], slot[load]] = 2
+
+        low = ~stopped & (self.robot_charge <= LOW_CHARGE) & ~self.robot_loaded
+        dropped = low & (package >= 0)
+        if dropped.any():
+            # CentralSystem.requeue: back to the front of the queue, inbound shelves released
+            release = dropped & (state == 1)
+            self.shelf_locked[rows[release], self.robot_dest[release]] = False
+            requeued = np.zeros_like(self.pkg_locked)
+            requeued[rows[dropped], package[dropped]] = True
+            self._queue(requeued, front=True)
+            package[dropped] = EMPTY
+            self.robot_dest[dropped] = EMPTY
+        if low.any():
+            state[low] = 4
+            self.robot_target[low] = self.chargers[self.rng.integers(0, len(self.chargers), int(low.sum()))]
+
+        draining = ~stopped & ~self.is_charger[pos]
+        self.robot_charge[draining] -= .25
+        self.energy_used += .25 * draining.sum(axis=1)
+
+        next_pos = self._next_hop(self.robot_target.ravel(), self.robot_loaded.ravel(), pos.ravel()).reshape(R, A)
+        stopped |= draining & (self.robot_charge <= 0)  # just ran empty
+        next_pos[stopped] = pos[stopped]
+
+        charging = self.is_charger[pos] & ~self.robot_loaded
+        topping_up = charging & (self.robot_charge < 99)
+        charged = charging & ~topping_up
+        self.robot_charge[charging] = np.minimum(self.robot_charge[charging] + 25, 100)
+        state[topping_up] = 4
+        self.robot_target[topping_up] = self.cell_target[pos[topping_up]]
+        state[charged] = 0
+        self.robot_target[charged] = self.home
+
+        # advance: robots move, carried packages with them
+        self.robot_pos = next_pos
+        self.pkg_pos[rows[self.robot_loaded], slot[self.robot_loaded]] = next_pos[self.robot_loaded]
+
+    def kpis(self, segundos_por_tick=1.0):
+        # batch_run.kpis, one value per replica
+        ticks = self.steps
+        hours = ticks * segundos_por_tick / 3600
+        delivered = self.delivered_packages
+        with np.errstate(invalid="ignore", divide="ignore"):
+            latency = np.where(delivered > 0, self.total_delivery_latency / delivered, np.nan)
+        return {
+            "delivered": delivered,
+            "delivered_per_hour": delivered / hours if hours else np.zeros(self.replicas),
+            "mean_delivery_latency": latency,
+            "robot_utilization": self.busy_robot_ticks / (ticks * self.num_agentes) if ticks and self.num_agentes
+            else np.zeros(self.replicas),
+            "energy_used": self.energy_used,
+        }
+
+
+def validate(num_agentes=5, tasa_llegada=0.14, ticks=2000, seeds=10, replicas=200, tolerance=0.1, layout=None,
+             segundos_por_tick=1.0):
+    # KPI means of `seeds` reference Warehouse runs against `replicas` engine replicas. A metric passes when
+    # the means differ by less than `tolerance` (relative) or three standard errors of the difference.
+    from batch_run import kpis
+    from model import Warehouse
+
+    reference = []
+    for seed in range(seeds):
+        model = Warehouse(num_agentes=num_agentes, tasa_llegada=tasa_llegada, seed=seed, layout=layout,
+                          modo_carga='Aleatoria')
+        for _ in range(ticks):
+            model.step()
+        reference.append(kpis(model, ticks, segundos_por_tick))
+    engine = ReplicaWarehouse(replicas, num_agentes=num_agentes, tasa_llegada=tasa_llegada, seed=0,
+                              layout=layout).run(ticks).kpis(segundos_por_tick)
+
+    report = {}
+    for metric in ("delivered_per_hour", "mean_delivery_latency", "robot_utilization", "energy_used"):
+        ours = [float(value) for value in engine[metric] if not np.isnan(value)]
+        theirs = [row[metric] for row in reference if row[metric] is not None]
+        if len(ours) < 2 or len(theirs) < 2:
+            continue
+        ref_mean, mean = statistics.fmean(theirs), statistics.fmean(ours)
+        stderr = (statistics.variance(theirs) / len(theirs) + statistics.variance(ours) / len(ours)) ** .5
+        difference = mean - ref_mean
+        report[metric] = {"reference": ref_mean, "engine": mean, "difference": difference, "stderr": stderr,
+                          "ok": abs(difference) <= max(tolerance * abs(ref_mean), 3 * stderr)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Many warehouse replicas advanced together with NumPy")
+    parser.add_argument("--replicas", type=int, default=1000)
+    parser.add_argument("--agentes", type=int, default=5)
+    parser.add_argument("--tasa-llegada", type=float, default=0.14)
+    parser.add_argument("--ticks", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--layout", help="layout file (see layouts.py), default: the built-in warehouse")
+    parser.add_argument("--layout-cache", help="directory for precompiled routing tables")
+    parser.add_argument("--validate", type=int, default=0, metavar="SEEDS",
+                        help="also run SEEDS reference Warehouse models and compare the KPIs")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    engine = ReplicaWarehouse(args.replicas, num_agentes=args.agentes, tasa_llegada=args.tasa_llegada,
+                              seed=args.seed, layout=args.layout, layout_cache=args.layout_cache)
+    built = time.perf_counter() - start
+    engine.run(args.ticks)
+    elapsed = time.perf_counter() - start - built
+    print(f"{args.replicas} replicas x {args.ticks} ticks: build {built:.2f} s, run {elapsed:.2f} s "
+          f"({args.replicas * args.ticks / elapsed:,.0f} replica-ticks/s)")
+    for metric, values in engine.kpis().items():
+        values = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+        if len(values):
+            print(f"  {metric:<24} mean {np.mean(values):10.3f}  p5 {np.percentile(values, 5):10.3f}"
+                  f"  p95 {np.percentile(values, 95):10.3f}")
+
+    if args.validate:
+        print(f"\nvalidation against {args.validate} Warehouse runs")
+        report = validate(args.agentes, args.tasa_llegada, args.ticks, args.validate, min(args.replicas, 1000),
+                          args.tolerance, args.layout)
+        for metric, row in report.items():
+            print(f"  {metric:<24} reference {row['reference']:10.3f}  engine {row['engine']:10.3f}"
+                  f"  diff {row['difference']:+9.3f} (se {row['stderr']:.3f})  {'ok' if row['ok'] else 'MISMATCH'}")
+        if not all(row["ok"] for row in report.values()):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
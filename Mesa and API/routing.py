@@ -0,0 +1,151 @@
+import os
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from layers import FLOOR_SHELF
+
+MOORE_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+UNREACHABLE = -1
+
+
+def walkable_masks(floor):
+    # (empty, loaded): empty robots drive under shelves, loaded ones keep to aisles, conveyors and chargers
+    return np.ones(floor.shape, dtype=bool), floor != FLOOR_SHELF
+
+
+class Router:
+    # Shortest paths over the warehouse floor. One BFS per (target, loaded) pair builds a distance
+    # field plus a next-hop table, so a robot finds its next cell with a single array lookup.
+    # Tables are kept in an LRU cache because only a handful of targets are hot at any time.
+    def __init__(self, model, max_targets=64):
+        self.model = model
+        self.max_targets = max_targets
+        self.width = model.grid.width
+        self.height = model.grid.height
+        self._tables = OrderedDict()  # (target, loaded) -> (distance, next_hop)
+        self.tables_path = None
+        self._static = {}  # (target, loaded) -> row in the precompiled tables (see layouts.compile_tables)
+        self._static_dist = None
+        self._static_next_hop = None
+        self.hits = 0
+        self.misses = 0
+        self.walkable_empty = None
+        self.walkable_loaded = None
+        self.build_masks()
+
+    def build_masks(self):
+        # Empty robots drive under shelves; loaded robots only use aisles, conveyors and chargers
+        self.walkable_empty, self.walkable_loaded = walkable_masks(self.model.floor)
+        self.invalidate()
+
+    def load_tables(self, path):
+        # Precompiled tables, memory-mapped so processes on the same layout share one copy in the page cache
+        targets = np.load(os.path.join(path, "targets.npy"))
+        self._static_dist = np.load(os.path.join(path, "dist.npy"), mmap_mode="r")
+        self._static_next_hop = np.load(os.path.join(path, "next_hop.npy"), mmap_mode="r")
+        self._static = {((int(x), int(y)), bool(loaded)): row for row, (x, y, loaded) in enumerate(targets)}
+        self.tables_path = path
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_tables"] = OrderedDict()  # cheap to rebuild, not worth storing in checkpoints
+        state["_static"] = {}  # mapped again from tables_path on load
+        state["_static_dist"] = state["_static_next_hop"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.tables_path is not None and os.path.isdir(self.tables_path):
+            self.load_tables(self.tables_path)
+
+    def invalidate(self):
+        # The floor changed: neither the cached nor the precompiled tables are valid any more
+        self._tables.clear()
+        self._static = {}
+        self._static_dist = self._static_next_hop = None
+        self.tables_path = None
+
+    def nbytes(self):
+        # copied first: the session registry calls this while a streaming thread may be adding tables
+        return sum(dist.nbytes + next_hop.nbytes for dist, next_hop in list(self._tables.values()))
+
+    def distance(self, pos, target, loaded=False):
+        # Steps from pos to target; pos may be off the mask (a shelf for loaded robots), -1 if unreachable
+        dist, _ = self._table(target, loaded)
+        d = int(dist[pos])
+        if d != UNREACHABLE:
+            return d
+        x, y = pos
+        best = UNREACHABLE
+        for dx, dy in MOORE_OFFSETS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < self.width and 0 <= ny < self.height:
+                d = int(dist[nx, ny])
+                if d != UNREACHABLE and (best == UNREACHABLE or d + 1 < best):
+                    best = d + 1
+        return best
+
+    def distances(self, target, loaded=False):
+        # Steps from every square to target (-1 where unreachable), as a read-only array
+        return self._table(target, loaded)[0]
+
+    def next_hop(self, pos, target, loaded=False):
+        dist, next_hop = self._table(target, loaded)
+        hop = int(next_hop[pos])
+        if hop != UNREACHABLE:
+            return divmod(hop, self.height)
+        # pos is off the mask (e.g. a loaded robot standing on a shelf): step onto the best neighbour
+        best = None
+        best_distance = None
+        x, y = pos
+        for dx, dy in MOORE_OFFSETS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < self.width and 0 <= ny < self.height:
+                d = int(dist[nx, ny])
+                if d != UNREACHABLE and (best_distance is None or d < best_distance):
+                    best_distance = d
+                    best = (nx, ny)
+        return best
+
+    def _table(self, target, loaded):
+        key = (tuple(target), bool(loaded))
+        row = self._static.get(key)
+        if row is not None:
+            self.hits += 1
+            return self._static_dist[row], self._static_next_hop[row]
+        table = self._tables.get(key)
+        if table is not None:
+            self.hits += 1
+            self._tables.move_to_end(key)
+            return table
+        self.misses += 1
+        table = bfs(key[0], self.walkable_loaded if loaded else self.walkable_empty)
+        self._tables[key] = table
+        if len(self._tables) > self.max_targets:
+            self._tables.popitem(last=False)
+        return table
+
+
+def bfs(target, walkable):
+    # Distance and next-hop tables towards `target` over the `walkable` mask (next hops are x * height + y)
+    width, height = walkable.shape
+    # Plain lists in the inner loop, numpy arrays for the cached result
+    open_cells = walkable.tolist()
+    dist = [[UNREACHABLE] * height for _ in range(width)]
+    next_hop = [[UNREACHABLE] * height for _ in range(width)]
+    tx, ty = target
+    dist[tx][ty] = 0
+    next_hop[tx][ty] = tx * height + ty  # at the target: stay
+    queue = deque([target])
+    while queue:
+        x, y = queue.popleft()
+        d = dist[x][y] + 1
+        here = x * height + y
+        for dx, dy in MOORE_OFFSETS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < width and 0 <= ny < height and open_cells[nx][ny] and dist[nx][ny] == UNREACHABLE:
+                dist[nx][ny] = d
+                next_hop[nx][ny] = here
+                queue.append((nx, ny))
+    return np.array(dist, dtype=np.int32), np.array(next_hop, dtype=np.int32)
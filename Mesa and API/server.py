@@ -1,41 +1,104 @@
+import os
+
 import mesa
 
-from model import Warehouse, Ant, ChargingStation, Cell, Conveyors, Packages, Shelves, CentralSystem
+from layers import FLOOR_CHARGER, FLOOR_SHELF
+from model import Warehouse, Ant, ChargingStation, Conveyors, Packages, Shelves, CentralSystem
 
 MAX_NUMBER_ROBOTS = 20
 
+SHELF_COLOR = "black"
+PACKAGE_COLOR = "brown"
+ENTRANCE_COLOR = "green"
+EXIT_COLOR = "red"
+CHARGER_COLOR = "yellow"
+
+
+def battery_color(charge):
+    # Red when empty, yellow at half charge, green when full
+    level = min(max(charge / 100, 0.0), 1.0)
+    red = 255 if level <= 0.5 else round(510 * (1 - level))
+    green = 255 if level >= 0.5 else round(510 * level)
+    return f"#{red:02x}{green:02x}00"
+
 
 def agent_portrayal(agent):
     if isinstance(agent, Ant):
-        return {"Shape": "circle", "Filled": "false", "Color": "Cyan", "Layer": 1, "r": 0.9,
-                "text": f"{agent.charge}", "text_color": "black"}
+        return {"Shape": "circle", "Filled": "true", "Color": battery_color(agent.charge_percentage), "Layer": 1,
+                "r": 0.9, "text": f"{agent.charge_percentage:.0f}", "text_color": "black"}
     elif isinstance(agent, Shelves):
-        return {"Shape": "rect", "Filled": "true", "Color": "black", "Layer": 0,
+        return {"Shape": "rect", "Filled": "true", "Color": SHELF_COLOR, "Layer": 0,
                 "w": 0.9, "h": 0.9}
     elif isinstance(agent, Packages):
-        return {"Shape": "rect", "Filled": "true", "Color": "brown", "Layer": 0,
+        return {"Shape": "rect", "Filled": "true", "Color": PACKAGE_COLOR, "Layer": 0,
                 "w": 0.9, "h": 0.9}
-    elif isinstance(agent, Cell):
-        portrayal = {"Shape": "rect", "Filled": "true", "Layer": 0, "w": 0.9, "h": 0.9}
-        portrayal["Color"] = "white"
-        return portrayal
     elif isinstance(agent, Conveyors):
         portrayal = {"Shape": "rect", "Filled": "true", "Layer": 0, "w": 0.9, "h": 0.9}
         if agent.state == 1:  # Entrance
-            portrayal["Color"] = "green"
+            portrayal["Color"] = ENTRANCE_COLOR
         elif agent.state == 2:  # Exit
-            portrayal["Color"] = "red"
+            portrayal["Color"] = EXIT_COLOR
         return portrayal
     elif isinstance(agent, ChargingStation):
-        return {"Shape": "rect", "Filled": "true", "Color": "yellow", "Layer": 0,
+        return {"Shape": "rect", "Filled": "true", "Color": CHARGER_COLOR, "Layer": 0,
                 "w": 0.9, "h": 0.9}
 
 
-M = 47
-N = 20
+def robot_entry(robot):
+    x, y = robot.pos
+    return [robot.unique_id, x, y, round(robot.charge_percentage), battery_color(robot.charge_percentage)]
+
+
+def package_entry(package):
+    x, y = package.pos
+    return [package.unique_id, x, y]
+
+
+class LayoutGrid(mesa.visualization.VisualizationElement):
+    # Canvas grid for Warehouse that only sends what moves. The first frame of a model carries the static
+    # layout (shelves, conveyors, chargers), which the browser draws once and keeps; every later frame only
+    # has the robots and packages changed since the previous one plus the ids removed, from
+    # Warehouse.changes_since. Drawn by LayoutGrid.js, which sizes the cells from the layout.
+    local_includes = ["LayoutGrid.js"]
+    local_dir = os.path.dirname(os.path.abspath(__file__))
+
+    def __init__(self, canvas_width=700, canvas_height=400):
+        super().__init__()
+        self.js_code = f"elements.push(new LayoutGrid({canvas_width}, {canvas_height}));"
+        self.model = None
+        self.tick = 0
+
+    def render(self, model):
+        changes = None
+        if model is self.model and model.schedule.steps >= self.tick:
+            changes = model.changes_since(self.tick)
+        self.model = model
+        self.tick = model.schedule.steps
+        if changes is None:
+            # New model (reset) or a frame older than the change history: send everything
+            agents = [agent for agent in model.schedule.agents if isinstance(agent, (Ant, Packages))]
+            frame = {"layout": self.layout(model)}
+            removed = []
+        else:
+            agents, removed = changes
+            frame = {}
+        frame["tick"] = model.schedule.steps
+        frame["robots"] = [robot_entry(agent) for agent in agents if isinstance(agent, Ant) and agent.pos]
+        frame["packages"] = [package_entry(agent) for agent in agents if isinstance(agent, Packages) and agent.pos]
+        frame["removed"] = removed
+        return frame
+
+    def layout(self, model):
+        width, height = model.floor.shape
+        colors = {FLOOR_SHELF: SHELF_COLOR, FLOOR_CHARGER: CHARGER_COLOR}
+        cells = [[x, y, colors[code]] for x, column in enumerate(model.floor.tolist())
+                 for y, code in enumerate(column) if code in colors]
+        cells += [[x, y, ENTRANCE_COLOR if conveyor.state == 1 else EXIT_COLOR]
+                  for (x, y), conveyor in model.conveyors_by_pos.items()]
+        return {"width": width, "height": height, "cells": cells, "package_color": PACKAGE_COLOR}
+
 
-grid = mesa.visualization.CanvasGrid(
-    agent_portrayal, M, N, 700, 400)
+grid = LayoutGrid(700, 400)
 
 model_params = {
     "M": mesa.visualization.Slider(
@@ -0,0 +1,136 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+AGENT_BYTES = 2048  # rough footprint of one scheduled agent with its grid and index entries
+
+
+def estimate_model_bytes(model):
+    # Cheap approximation used for the registry's memory cap, not an exact measurement
+    size = model.schedule.get_agent_count() * AGENT_BYTES + model.grid.width * model.grid.height * 64
+    size += model.layers.nbytes() + model.robot_table.data.nbytes + model.package_table.data.nbytes
+    if model.router is not None:
+        size += model.router.nbytes()
+    return size
+
+
+class Session:
+    def __init__(self, session_id, model):
+        self.id = session_id
+        self.model = model
+        self.lock = threading.Lock()  # held while a request or the streaming thread uses the model
+        self.broadcaster = None
+        self.last_used = time.monotonic()
+        self.size_bytes = 0  # estimate_model_bytes() as of the last create or step
+
+    @property
+    def streaming(self):
+        return self.broadcaster is not None and self.broadcaster.running
+
+    @property
+    def evictable(self):
+        # Never evict a session whose loop is running or that has clients attached to its stream
+        return not self.streaming and not (self.broadcaster is not None and self.broadcaster.subscribed)
+
+    def close(self):
+        # Called without self.lock held: stopping the broadcaster waits for its loop, which takes the lock
+        # each tick. The recorder is then closed under the lock so a request mid-step can't write to it.
+        if self.broadcaster is not None:
+            self.broadcaster.stop()
+            self.broadcaster = None
+        with self.lock:
+            if self.model is not None and self.model.recorder is not None:
+                self.model.recorder.close()  # flushes the trajectory log; it reopens if the model steps again
+
+
+class ReplaySession(Session):
+    # Serves a recorded trajectory log (see recording.py) instead of a model. Its broadcaster, a
+    # recording.ReplayBroadcaster over the log, stays when the loop stops, keeping the replay position.
+    def __init__(self, session_id, log):
+        super().__init__(session_id, None)
+        self.log = log
+
+    def close(self):
+        if self.broadcaster is not None:
+            self.broadcaster.stop()
+
+
+class SessionRegistry:
+    # Independent Warehouse instances keyed by session id, kept in least-recently-used order.
+    # Sessions are evicted when idle for idle_timeout seconds, and the least recently used ones go
+    # first when max_sessions or max_memory_bytes would be exceeded; streaming sessions never are, even
+    # if that leaves the registry over its caps. Models only grow when they step, so sizes are measured
+    # and evictions run on create() and stepped() only.
+    def __init__(self, max_sessions=32, idle_timeout=1800.0, max_memory_bytes=512 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_memory_bytes = max_memory_bytes
+        self._sessions = OrderedDict()
+        self._memory_bytes = 0  # sum of the registered sessions' size_bytes
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self, model):
+        # Ids are only ever made here, so a client can't take over or close another client's session
+        session = Session(uuid.uuid4().hex, model)
+        session.size_bytes = estimate_model_bytes(model)
+        with self._lock:
+            self._sessions[session.id] = session
+            self._memory_bytes += session.size_bytes
+            evicted = self._evict_locked(keep=session.id)
+        for old in evicted:
+            old.close()
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+                self._sessions.move_to_end(session.id)
+        return session
+
+    def stepped(self, session):
+        # Re-measure a session after its model has stepped, then evict others if it outgrew the cap
+        with session.lock:
+            size = estimate_model_bytes(session.model)
+        with self._lock:
+            if self._sessions.get(session.id) is not session:
+                return
+            self._memory_bytes += size - session.size_bytes
+            session.size_bytes = size
+            evicted = self._evict_locked(keep=session.id)
+        for old in evicted:
+            old.close()
+
+    def remove(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._memory_bytes -= session.size_bytes
+        if session is not None:
+            session.close()
+        return session is not None
+
+    def memory_bytes(self):
+        return self._memory_bytes
+
+    def _evict_locked(self, keep=None):
+        evicted = []
+        now = time.monotonic()
+        for session in list(self._sessions.values()):
+            if session.id != keep and session.evictable and now - session.last_used > self.idle_timeout:
+                evicted.append(self._sessions.pop(session.id))
+                self._memory_bytes -= session.size_bytes
+
+        for session in list(self._sessions.values()):  # least recently used first
+            if len(self._sessions) <= self.max_sessions and self._memory_bytes <= self.max_memory_bytes:
+                break
+            if session.id == keep or not session.evictable:
+                continue
+            evicted.append(self._sessions.pop(session.id))
+            self._memory_bytes -= session.size_bytes
+        return evicted
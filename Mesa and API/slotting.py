@@ -0,0 +1,102 @@
+import heapq
+import itertools
+
+
+class SlottingPolicy:
+    # Decides where inbound packages go. rankings() names one score per ranking (lower is better) and
+    # ranking_for() picks the ranking a given package is placed by.
+    def rankings(self, model):
+        raise NotImplementedError
+
+    def ranking_for(self, package):
+        raise NotImplementedError
+
+
+class NearestEntrancePolicy(SlottingPolicy):
+    def rankings(self, model):
+        entrance = model.central_system.entrance_position
+        return {"entrance": lambda pos: path_distance(model, pos, entrance)}
+
+    def ranking_for(self, package):
+        return "entrance"
+
+
+class VelocityPolicy(SlottingPolicy):
+    # Fast-moving SKUs go to the free shelves closest to the exit conveyor, everything else as close
+    # to the entrance as possible
+    def __init__(self, fast_skus):
+        self.fast_skus = set(fast_skus)
+
+    def rankings(self, model):
+        entrance = model.central_system.entrance_position
+        exit_position = model.central_system.exit_position
+        return {"entrance": lambda pos: path_distance(model, pos, entrance),
+                "exit": lambda pos: path_distance(model, pos, exit_position)}
+
+    def ranking_for(self, package):
+        return "exit" if getattr(package, "sku", None) in self.fast_skus else "entrance"
+
+
+def path_distance(model, pos, target):
+    # Loaded-robot path length when routing is on, Chebyshev distance otherwise
+    if model.router is not None:
+        distance = model.router.distance(pos, target, loaded=True)
+        if distance >= 0:
+            return distance
+        return float("inf")
+    return max(abs(pos[0] - target[0]), abs(pos[1] - target[1]))
+
+
+class ShelfAllocator:
+    # Free, unlocked shelves kept in one heap per ranking, with lazy deletion: a shelf's entries stay in
+    # the heaps after it is taken and are skipped when popped. The model subscribes shelf_changed() to
+    # every is_free / is_locked transition, so allocate() is O(log n) and never hands out a shelf twice.
+    def __init__(self, model, policy):
+        self.model = model
+        self.policy = policy
+        self.scores = {}  # ranking -> {pos: score}
+        self.heaps = {}
+        self.available = set()
+        self._counter = itertools.count()
+        for name, score in policy.rankings(model).items():
+            self.scores[name] = {pos: score(pos) for pos in model.shelves_by_pos}
+            self.heaps[name] = []
+        for shelf in model.shelves_by_pos.values():
+            self.update(shelf)
+
+    def __len__(self):
+        return len(self.available)
+
+    def update(self, shelf):
+        pos = shelf.pos
+        if shelf.is_free and not shelf.is_locked:
+            if pos not in self.available:
+                self.available.add(pos)
+                order = next(self._counter)
+                for name, heap in self.heaps.items():
+                    heapq.heappush(heap, (self.scores[name][pos], order, pos))
+                    if len(heap) > 4 * len(self.scores[name]):
+                        self._rebuild(name)  # heaps the policy rarely pops collect stale entries
+        else:
+            self.available.discard(pos)
+
+    def shelf_changed(self, shelf, old, new):
+        self.update(shelf)
+
+    def _rebuild(self, name):
+        heap = [(self.scores[name][pos], next(self._counter), pos) for pos in self.available]
+        heapq.heapify(heap)
+        self.heaps[name] = heap
+
+    def allocate(self, package=None):
+        # Reserve the best free shelf for `package` under the policy; None when the warehouse is full
+        heap = self.heaps[self.policy.ranking_for(package)]
+        while heap:
+            _, _, pos = heapq.heappop(heap)
+            if pos in self.available:
+                self.model.shelves_by_pos[pos].is_locked = True  # removes it from `available` via update()
+                return pos
+        return None
+
+    def release(self, pos):
+        self.model.shelves_by_pos[pos].is_locked = False
@@ -0,0 +1,238 @@
+import json
+import threading
+import time
+
+
+def sse_message(event, data):
+    return f"event: {event}\ndata: {data}\n\n".encode()
+
+
+class Subscription:
+    # Single-slot mailbox: a new tick replaces an unread one, so a slow viewer never queues up work.
+    # When that happens the subscriber is flagged as lagged and resyncs from a snapshot.
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._message = None
+        self.lagged = False
+        self.closed = False
+
+    def offer(self, message):
+        with self._cond:
+            if self._message is not None:
+                self.lagged = True
+            self._message = message
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def take(self, timeout=None):
+        with self._cond:
+            if self._message is None and not self.closed:
+                self._cond.wait(timeout)
+            message, self._message = self._message, None
+            lagged, self.lagged = self.lagged, False
+            return message, lagged
+
+
+class Snapshot:
+    # The state of one tick as published by TickBroadcaster. Never changed after publication, so any
+    # thread may read it without the model lock. `agents` holds one description per agent (descriptions
+    # of unchanged agents are shared with earlier snapshots, which is safe because none is ever mutated);
+    # the JSON body is encoded once, by the first reader that asks for it.
+    __slots__ = ("tick", "agents", "binary", "_json", "_encoding")
+
+    def __init__(self, tick, agents, binary):
+        self.tick = tick
+        self.agents = agents
+        self.binary = binary
+        self._json = None
+        self._encoding = threading.Lock()  # only ever taken by readers, never by the simulation loop
+
+    def json(self):
+        if self._json is None:
+            with self._encoding:
+                if self._json is None:
+                    self._json = json.dumps(self.agents).encode()
+        return self._json
+
+
+class TickBroadcaster:
+    # Steps a Warehouse on a background thread at `tick_rate` ticks per second (0: as fast as possible)
+    # and pushes every tick to all subscribers. Each tick is encoded once (encode_delta) and shared by
+    # every subscriber; snapshots for new or lagging subscribers (encode_snapshot) are built at most once
+    # per tick.
+    #
+    # After every tick it also publishes a Snapshot (double buffering): the loop keeps its own map of
+    # agent descriptions, refreshes only the agents the tick changed (describe_agent, returning None for
+    # agents left out), then swaps `latest` to a new immutable Snapshot in one reference assignment.
+    # Readers use `latest` without touching the model lock, so they never stall the loop or each other.
+    def __init__(self, model, lock, encode_delta, encode_snapshot, tick_rate=10.0, describe_agent=None,
+                 encode_binary=None):
+        self.model = model
+        self.lock = lock
+        self.encode_delta = encode_delta
+        self.encode_snapshot = encode_snapshot  # Snapshot -> str
+        self.describe_agent = describe_agent or (lambda agent: None)
+        self.encode_binary = encode_binary or (lambda model: b"")
+        self.tick_rate = tick_rate
+        self.latest = None  # last published Snapshot
+        self.ticks_per_second = 0.0  # measured over the last second of running
+        self._agents = {}  # back buffer: unique_id -> description, only touched with the model lock held
+        self._agents_tick = None
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+        self._snapshot = (None, None)  # (tick, message)
+        self._stop = threading.Event()
+        self._resume = threading.Event()  # cleared while paused
+        self._resume.set()
+        self._wake = threading.Event()  # interrupts the wait between ticks on pause/rate/stop
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def subscribed(self):
+        return bool(self._subscribers)
+
+    @property
+    def paused(self):
+        return not self._resume.is_set()
+
+    def start(self, tick_rate=None):
+        if tick_rate is not None:
+            self.tick_rate = tick_rate
+        if self.running:
+            return
+        with self.lock:
+            self.publish()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="tick-broadcaster", daemon=True)
+        self._thread.start()
+
+    def pause(self):
+        self._resume.clear()
+        self._wake.set()
+
+    def resume(self):
+        self._resume.set()
+        self._wake.set()
+
+    def set_rate(self, tick_rate):
+        self.tick_rate = tick_rate
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._resume.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+            self._subscribers.clear()
+        for subscription in subscribers:
+            subscription.close()
+
+    def subscribe(self):
+        subscription = Subscription()
+        with self._subscribers_lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._subscribers_lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self):
+        # New Snapshot of the current tick; call with the model lock held
+        model = self.model
+        changes = model.changes_since(self._agents_tick) if self._agents_tick is not None else None
+        if changes is None:  # first publication, or too far behind the change log
+            self._agents = {}
+            changed, removed = model.schedule.agents, []
+        else:
+            changed, removed = changes
+        for unique_id in removed:
+            self._agents.pop(unique_id, None)
+        for agent in changed:
+            description = self.describe_agent(agent)
+            if description is not None:
+                self._agents[agent.unique_id] = description
+        self._agents_tick = model.schedule.steps
+        self.latest = Snapshot(model.schedule.steps, tuple(self._agents.values()), self.encode_binary(model))
+
+    def advance(self):
+        # Runs one tick and returns its message, or None when there is nothing more to run (the loop then
+        # pauses); call with the model lock held
+        self.model.step()
+        return sse_message("tick", self.encode_delta(self.model, self.model.schedule.steps - 1))
+
+    def snapshot_message(self):
+        latest = self.latest
+        if latest is None:
+            with self.lock:
+                self.publish()
+            latest = self.latest
+        cached_tick, message = self._snapshot
+        if cached_tick != latest.tick:
+            message = sse_message("snapshot", self.encode_snapshot(latest))
+            self._snapshot = (latest.tick, message)
+        return message
+
+    def events(self, subscription, keepalive=15.0):
+        # Generator for one SSE client: a snapshot first, then one delta per tick
+        try:
+            yield self.snapshot_message()
+            while not subscription.closed:
+                message, lagged = subscription.take(keepalive)
+                if lagged:
+                    yield self.snapshot_message()
+                elif message is not None:
+                    yield message
+                elif not subscription.closed:
+                    yield b": keep-alive\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def _run(self):
+        next_tick = time.perf_counter()
+        window_start, window_ticks = next_tick, 0
+        while not self._stop.is_set():
+            if not self._resume.is_set():
+                self.ticks_per_second = 0.0
+                self._resume.wait()
+                next_tick = window_start = time.perf_counter()
+                window_ticks = 0
+                continue
+            with self.lock:
+                message = self.advance()
+                if message is not None:
+                    self.publish()
+            if message is None:  # nothing left to run
+                self._resume.clear()
+                continue
+            with self._subscribers_lock:
+                subscribers = list(self._subscribers)
+            for subscription in subscribers:
+                subscription.offer(message)
+
+            now = time.perf_counter()
+            window_ticks += 1
+            if now - window_start >= 1.0:
+                self.ticks_per_second = window_ticks / (now - window_start)
+                window_start, window_ticks = now, 0
+            if self.tick_rate:
+                next_tick += 1 / self.tick_rate
+                delay = next_tick - now
+                if delay > 0:
+                    self._wake.clear()
+                    if self._wake.wait(delay):
+                        next_tick = time.perf_counter()  # paused, stopped or new rate: start the schedule over
+                else:
+                    next_tick = now  # running behind: don't try to catch up
@@ -0,0 +1,137 @@
+import json
+import os
+import pickle
+import struct
+import sys
+import threading
+
+# Structured trace events. Every subsystem gets a Channel whose per-level flags are plain booleans, so
+# call sites guard with `if channel.debug:` and pay nothing else while tracing is off (the default):
+#
+#     if ant_trace.debug:
+#         ant_trace.emit(DEBUG, "move", id=..., pos=...)
+#
+# Enable it from code with tracer.configure(...) or through the environment, e.g.
+#     WAREHOUSE_TRACE="ant:debug,central" WAREHOUSE_TRACE_FILE=trace.jsonl python batch_run.py
+# Files ending in .bin get length-prefixed pickle records instead of JSON lines; read_trace() reads both.
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING}
+LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+RECORD_HEADER = struct.Struct("<I")
+
+
+class Channel:
+    __slots__ = ("name", "tracer", "debug", "info", "warning")
+
+    def __init__(self, name, tracer):
+        self.name = name
+        self.tracer = tracer
+        self.set_level(None)
+
+    def set_level(self, level):
+        # None switches the channel off
+        self.debug = level is not None and level <= DEBUG
+        self.info = level is not None and level <= INFO
+        self.warning = level is not None and level <= WARNING
+
+    def emit(self, level, event, **fields):
+        self.tracer.write({"subsystem": self.name, "level": LEVEL_NAMES[level], "event": event, **fields})
+
+
+class JsonlSink:
+    def __init__(self, stream, owns_stream=True):
+        self.stream = stream
+        self.owns_stream = owns_stream
+
+    def write(self, record):
+        self.stream.write(json.dumps(record, default=str) + "\n")
+
+    def close(self):
+        if self.owns_stream:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class BinarySink:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, record):
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        self.stream.write(RECORD_HEADER.pack(len(payload)) + payload)
+
+    def close(self):
+        self.stream.close()
+
+
+class Tracer:
+    def __init__(self):
+        self.channels = {}
+        self.sink = None
+        self._lock = threading.Lock()
+
+    def channel(self, name):
+        if name not in self.channels:
+            self.channels[name] = Channel(name, self)
+        return self.channels[name]
+
+    def configure(self, subsystems=None, level="info", path=None):
+        # subsystems: names to enable (all when None), or a {name: level} mapping
+        self.disable()
+        if path is None:
+            self.sink = JsonlSink(sys.stderr, owns_stream=False)
+        elif path.endswith(".bin"):
+            self.sink = BinarySink(open(path, "ab"))
+        else:
+            self.sink = JsonlSink(open(path, "a"))
+
+        if subsystems is None:
+            subsystems = {name: level for name in self.channels}
+        elif not isinstance(subsystems, dict):
+            subsystems = {name: level for name in subsystems}
+        for name, channel_level in subsystems.items():
+            self.channel(name).set_level(LEVELS[channel_level])
+
+    def disable(self):
+        for channel in self.channels.values():
+            channel.set_level(None)
+        with self._lock:
+            if self.sink is not None:
+                self.sink.close()
+                self.sink = None
+
+    def write(self, record):
+        with self._lock:
+            if self.sink is not None:
+                self.sink.write(record)
+
+    def configure_from_env(self, environ=os.environ):
+        spec = environ.get("WAREHOUSE_TRACE")
+        if not spec:
+            return
+        subsystems = {}
+        for item in spec.split(","):
+            name, _, level = item.strip().partition(":")
+            subsystems[name] = level or "info"
+        self.configure(subsystems, path=environ.get("WAREHOUSE_TRACE_FILE"))
+
+
+def read_trace(path):
+    if path.endswith(".bin"):
+        with open(path, "rb") as f:
+            while header := f.read(RECORD_HEADER.size):
+                (size,) = RECORD_HEADER.unpack(header)
+                yield pickle.loads(f.read(size))
+    else:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+tracer = Tracer()
+tracer.configure_from_env()